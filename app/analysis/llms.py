@@ -5,9 +5,11 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
 from ..config import settings
+from .. import timing
 
 
 
+@timing.timed("llm")
 def use_openai(model:str,message:list,temperature:float,stream:bool = False):
     from openai import OpenAI
     client = OpenAI(
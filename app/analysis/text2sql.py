@@ -10,6 +10,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
 from . import prompts, llms, utils
+from .. import timing
 
     
 class Text2SQL():    
@@ -63,6 +64,7 @@ class Text2SQL():
             modified_sql_query = sql_query.replace("%","%%").replace("\n"," ")
             return modified_sql_query
         return ""
+    @timing.timed("text2sql")
     def get_sql_query(self, query: str, company_description: str) -> str:
         try:
             analysis_steps = utils.generate_analysis_steps(query, company_description)
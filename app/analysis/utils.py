@@ -1,7 +1,6 @@
-import sys, re, contextlib, io, base64, boto3, datetime, uuid
-import pandas as pd
-import matplotlib.pyplot as plt
-from botocore.exceptions import NoCredentialsError
+from __future__ import annotations
+import sys, re, contextlib, io, base64, datetime, uuid
+from typing import TYPE_CHECKING
 import os
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -9,7 +8,13 @@ app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
 from .llms import use_openai
 from . import prompts
-import asyncio, json, pytest, time
+from .. import timing
+import asyncio, json, time
+
+"""pandas, matplotlib and boto3 are imported where they are used, so
+    importing the API does not pay for them"""
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 async def test_streamimg(query:str):
@@ -76,6 +81,7 @@ def extract_codes(analysis_code:str)->str:
     codes = "\n".join(code_blocks)
     return codes
 
+@timing.timed("s3")
 def upload_bytes_to_s3(bytes_data, file_extension):
     """
     Upload bytes data to an Amazon S3 bucket and return the public link to the uploaded file.
@@ -97,6 +103,8 @@ def upload_bytes_to_s3(bytes_data, file_extension):
     upload_link = assistant.upload_bytes_to_s3(data, extension)
     print("Uploaded file link:", upload_link)
     """
+    import boto3
+    from botocore.exceptions import NoCredentialsError
     from config import settings
     link = ""
     try:
@@ -128,6 +136,8 @@ def execute_code(code:str, local_variable:dict):
         Output:
             (dict) A dictionary which filtered all the local variables.
     """
+    import pandas as pd
+    import matplotlib.pyplot as plt
     final_print_outputs = []
     plots = []
     try:
@@ -189,6 +199,7 @@ def execute_code(code:str, local_variable:dict):
     return filtered_variables, "\n".join(final_print_outputs), plots
 
 
+@timing.timed("analyse")
 def analyse(query:str,df:pd.DataFrame,company_description:str,analysis_step:str):
     df_head = df.head().to_string()
     column_content = get_distinct_values_df(df)
@@ -203,6 +214,7 @@ def analyse(query:str,df:pd.DataFrame,company_description:str,analysis_step:str)
     return [variables, prints, plots]
 
 async def get_analysis_recommendation(query:str,data:dict, company_description:str,analysis_steps:str, language:str):
+    import pandas as pd
     df = pd.DataFrame(data)
     results = analyse(query,df,company_description,analysis_steps)
     #variables, prints, plots
@@ -225,7 +237,6 @@ async def get_analysis_recommendation(query:str,data:dict, company_description:s
             await asyncio.sleep(0.1)
     yield f"data: {full_response}\n\n"
 
-@pytest.mark.asyncio
 async def test_get_analysis_recommendation():
     # _ = utils.authentication(access_token,db)
     import json
@@ -0,0 +1,215 @@
+import sys, os, base64, random
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, Dict, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+"""Prefix of body columns holding base64 of a zstd frame, see compress_body and decode_body"""
+ZSTD_BODY_PREFIX = "zstd:"
+
+"""Content types whose bodies are never captured"""
+BINARY_CONTENT_TYPES = (
+    "multipart/",
+    "application/octet-stream",
+    "application/zip",
+    "application/gzip",
+    "application/pdf",
+    "image/",
+    "audio/",
+    "video/",
+)
+
+"""
+Headers whose values are replaced by REDACTED: the standard credential
+headers, the access-token header the routers authenticate with, and
+AUDIT_REDACTED_HEADERS.
+"""
+REDACTED_HEADERS = {
+    "authorization", "proxy-authorization", "cookie", "set-cookie", "access-token",
+    *(header.lower() for header in settings.audit_redacted_headers)
+}
+REDACTED = "[redacted]"
+
+
+@dataclass(frozen=True)
+class CapturePolicy:
+    """
+    What log_response stores of a request/response exchange. Request
+    metadata (method, path, status, duration) is always stored; bodies are
+    stored for a sample_rate fraction of the requests, up to max_body_bytes.
+    """
+    sample_rate: float = 1.0
+    max_body_bytes: int = 4096
+    capture_request_body: bool = True
+    capture_response_body: bool = True
+    capture_headers: bool = True
+    capture_cookies: bool = False
+    compress: bool = True
+
+
+DEFAULT_POLICY = CapturePolicy(
+    sample_rate=settings.audit_body_sample_rate,
+    max_body_bytes=settings.audit_body_max_bytes,
+    capture_cookies=settings.audit_capture_cookies
+)
+
+"""
+Per-route overrides of the default policy, keyed by path prefix; the
+longest matching prefix wins. AUDIT_CAPTURE_POLICIES (JSON, same shape)
+overrides these.
+"""
+ROUTE_POLICIES: Dict[str, dict] = {
+    # credentials, pins and tokens
+    "/auth": {"capture_request_body": False, "capture_response_body": False},
+    "/datasources/upload_csv": {"capture_request_body": False},
+    "/analysis": {"max_body_bytes": 2048},
+}
+
+
+class CapturePolicies:
+    """Resolves the capture policy of a request path"""
+    def __init__(self, default: CapturePolicy, routes: Dict[str, dict]):
+        self.default = default
+        self.routes = {
+            prefix: replace(default, **overrides)
+            for prefix, overrides in routes.items()
+        }
+        self.prefixes = sorted(self.routes, key=len, reverse=True)
+
+    def for_path(self, path: str) -> CapturePolicy:
+        for prefix in self.prefixes:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return self.routes[prefix]
+        return self.default
+
+
+def sampled(policy: CapturePolicy) -> bool:
+    """Whether the bodies of this request are captured"""
+    return policy.sample_rate >= 1.0 or random.random() < policy.sample_rate
+
+
+def is_binary(content_type: Optional[str]) -> bool:
+    content_type = (content_type or "").lower()
+    return content_type.startswith(BINARY_CONTENT_TYPES)
+
+
+def capture_body(body: bytes, content_type: Optional[str], policy: CapturePolicy, total: int = None) -> str:
+    """
+    The stored form of a body: binary bodies are replaced by a marker,
+    text is cut at max_body_bytes with a truncation marker, and large
+    results are zstd-compressed.
+
+    Args:
+        body (bytes): The body, or the captured start of it.
+        content_type (str): The Content-Type of the body.
+        policy (CapturePolicy): The policy of the route.
+        total (int): The full body size when `body` is only its start.
+
+    Returns:
+        str: The text to store.
+    """
+    total = len(body) if total is None else total
+    if not total:
+        return ""
+    if is_binary(content_type):
+        return f"[binary body not captured: {content_type}, {total} bytes]"
+    captured = body[:policy.max_body_bytes]
+    try:
+        text = captured.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(captured) - 3:
+            return f"[binary body not captured: {content_type}, {total} bytes]"
+        """The cap split a multi-byte character"""
+        text = captured[:e.start].decode("utf-8")
+    if total > len(captured):
+        text += f"...[truncated, {len(captured)} of {total} bytes captured]"
+    return compress_body(text) if policy.compress else text
+
+
+def compress_body(text: str) -> str:
+    """zstd-compress a body if that makes it smaller in the text column"""
+    if zstandard is None or len(text) < settings.audit_body_compress_min_bytes:
+        return text
+    compressed = ZSTD_BODY_PREFIX + base64.b64encode(compressor.compress(text.encode("utf-8"))).decode("ascii")
+    return compressed if len(compressed) < len(text) else text
+
+
+def decode_body(value: Optional[str]) -> Optional[str]:
+    """The text of a stored body column, decompressing zstd bodies"""
+    if value is None or not value.startswith(ZSTD_BODY_PREFIX) or zstandard is None:
+        return value
+    try:
+        frame = base64.b64decode(value[len(ZSTD_BODY_PREFIX):], validate=True)
+        return zstandard.ZstdDecompressor().decompress(frame).decode("utf-8")
+    except Exception:
+        """A body that happens to start with the prefix"""
+        return value
+
+
+class BodyCapture:
+    """Keeps the first max_bytes of a streamed body and counts the rest"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.captured = 0
+        self.total = 0
+        self.complete = False
+
+    def feed(self, chunk: bytes):
+        self.total += len(chunk)
+        if self.captured < self.max_bytes:
+            part = chunk[:self.max_bytes - self.captured]
+            self.chunks.append(part)
+            self.captured += len(part)
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+async def tee(body_iterator, capture: BodyCapture, on_complete: Callable[[], Awaitable[None]]):
+    """
+    Pass the chunks of a response body through as they arrive while
+    feeding them to `capture`, then await on_complete once the stream has
+    ended or the client went away. Nothing is buffered beyond the capture
+    cap, so streamed responses reach the client as they are produced.
+    """
+    try:
+        async for chunk in body_iterator:
+            capture.feed(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            yield chunk
+        capture.complete = True
+    finally:
+        await on_complete()
+
+
+def capture_headers(headers, policy: CapturePolicy) -> Optional[str]:
+    if not policy.capture_headers:
+        return None
+    return str({
+        key: REDACTED if key.lower() in REDACTED_HEADERS else value
+        for key, value in headers.items()
+    })
+
+
+def capture_cookies(cookies: dict, policy: CapturePolicy) -> Optional[str]:
+    if not policy.capture_cookies:
+        return None
+    return str(dict(cookies))
+
+
+compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+
+policies = CapturePolicies(
+    DEFAULT_POLICY,
+    {**ROUTE_POLICIES, **settings.audit_capture_policies}
+)
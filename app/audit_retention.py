@@ -0,0 +1,326 @@
+import sys, os, datetime, time, gzip, argparse
+import orjson
+from typing import Dict, List
+from sqlalchemy import Table, text, inspect, select, delete
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .database import engine
+from . import models, metrics
+from .audit_capture import decode_body
+from .logger import logger
+from .config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FUTURE_PARTITION = "p_future"
+
+"""Columns that may hold zstd-compressed bodies, archived as plain text"""
+BODY_COLUMNS = ("request_body", "response_body")
+
+"""MySQL named lock held for a maintenance pass, so concurrent runs skip instead of racing"""
+LOCK_NAME = "audit_log_retention"
+
+
+def partition_name(day: datetime.date) -> str:
+    """Name of the partition holding the rows created on a day"""
+    return f"p{day:%Y%m%d}"
+
+
+def partition_day(name: str) -> datetime.date:
+    """The day of a partition named by partition_name, or None for p_future"""
+    if name == FUTURE_PARTITION:
+        return None
+    return datetime.datetime.strptime(name[1:], "%Y%m%d").date()
+
+
+def archived_row(row) -> dict:
+    """A row as written to an archive, with its body columns decoded"""
+    """Column names are str subclasses, which orjson refuses as keys"""
+    row = {str(key): value for key, value in row.items()}
+    for column in BODY_COLUMNS:
+        if column in row:
+            row[column] = decode_body(row[column])
+    return row
+
+
+class AuditLogRetention:
+    """
+    Maintains the day partitions of the request/response log tables: adds
+    partitions for the coming days, and archives expired days to compressed
+    JSON lines files before dropping them. Dropping a partition is a
+    metadata operation, unlike a DELETE of millions of rows. On other
+    dialects expired rows are archived and deleted in chunks instead; the
+    log tables need an auto-increment column in a composite primary key,
+    which SQLite does not support.
+
+    It also purges the idempotency keys of processed Kafka messages once
+    they are older than processed_ttl_days.
+
+    Run it from one place only, `python -m app.audit_retention run --forever`
+    or a cron job; on MySQL a pass is skipped while another one holds the
+    lock.
+    """
+    def __init__(
+            self,
+            engine: Engine,
+            tables: List[Table],
+            retention_days: int,
+            partitions_ahead: int = 7,
+            archive_dir: str = None,
+            chunk_size: int = 10000,
+            processed_ttl_days: int = 0
+        ):
+        self.engine = engine
+        self.tables = tables
+        self.retention_days = retention_days
+        self.partitions_ahead = partitions_ahead
+        self.archive_dir = archive_dir
+        self.chunk_size = chunk_size
+        self.processed_ttl_days = processed_ttl_days
+
+    @property
+    def partitioned(self) -> bool:
+        return self.engine.dialect.name == "mysql"
+
+    def partitions(self, conn: Connection, table: Table) -> Dict[str, datetime.date]:
+        """The partitions of a table by name, with their day"""
+        names = conn.execute(
+            text(
+                "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+                "AND PARTITION_NAME IS NOT NULL"
+            ),
+            {"table": table.name}
+        ).scalars()
+        return {name: partition_day(name) for name in names}
+
+    def add_partitions(self, conn: Connection, table: Table, today: datetime.date) -> List[str]:
+        """
+        Split partitions for today and the coming days off p_future. Range
+        partitions must increase, so only days after the newest existing
+        partition are added.
+        """
+        existing = self.partitions(conn, table)
+        if FUTURE_PARTITION not in existing:
+            logger.warning(f'{table.name} is not partitioned, run `python -m app.audit_retention migrate`')
+            return []
+        newest = max((day for day in existing.values() if day is not None), default=today - datetime.timedelta(days=1))
+        days = [
+            today + datetime.timedelta(days=offset)
+            for offset in range(self.partitions_ahead + 1)
+            if today + datetime.timedelta(days=offset) > newest
+        ]
+        if not days:
+            return []
+        definitions = ", ".join(
+            f"PARTITION {partition_name(day)} VALUES LESS THAN "
+            f"(TO_DAYS('{day + datetime.timedelta(days=1):%Y-%m-%d}'))"
+            for day in days
+        )
+        conn.execute(text(
+            f"ALTER TABLE {table.name} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+            f"({definitions}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        ))
+        return [partition_name(day) for day in days]
+
+    def archive(self, conn: Connection, table: Table, statement, label: str) -> int:
+        """
+        Stream the rows selected by a statement into
+        <archive_dir>/<table>/<table>-<label>.jsonl.zst (.gz without
+        zstandard). Compressed bodies are written decoded, so the archive
+        reads without this application. The file is written under a
+        temporary name and renamed once complete, so a crash never leaves a
+        truncated archive behind.
+
+        Returns:
+            int: The number of rows archived.
+        """
+        if not self.archive_dir:
+            return 0
+        directory = os.path.join(self.archive_dir, table.name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{table.name}-{label}.jsonl" + (".zst" if zstandard else ".gz"))
+        """Unique per process, so a concurrent pass never truncates this one's file"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        rows = 0
+        with open(tmp, "wb") as raw:
+            if zstandard:
+                out = zstandard.ZstdCompressor().stream_writer(raw)
+            else:
+                out = gzip.GzipFile(fileobj=raw, mode="wb")
+            with out:
+                result = conn.execution_options(yield_per=self.chunk_size).execute(statement)
+                for partition in result.mappings().partitions():
+                    out.write(b"".join(orjson.dumps(archived_row(row)) + b"\n" for row in partition))
+                    rows += len(partition)
+        if not rows:
+            os.remove(tmp)
+            return 0
+        os.replace(tmp, path)
+        metrics.AUDIT_LOG_ROWS_ARCHIVED.labels(table.name).inc(rows)
+        logger.info(f'Archived {rows} rows of {table.name} to {path}')
+        return rows
+
+    def expire_partitions(self, conn: Connection, table: Table, cutoff: datetime.date) -> List[str]:
+        """Archive and drop the partitions of days before the cutoff"""
+        expired = sorted(
+            name for name, day in self.partitions(conn, table).items()
+            if day is not None and day < cutoff
+        )
+        for name in expired:
+            self.archive(conn, table, text(f"SELECT * FROM {table.name} PARTITION ({name})"), name[1:])
+            conn.execute(text(f"ALTER TABLE {table.name} DROP PARTITION {name}"))
+            metrics.AUDIT_LOG_PARTITIONS_DROPPED.labels(table.name).inc()
+            logger.info(f'Dropped partition {name} of {table.name}')
+        return expired
+
+    def expire_rows(self, conn: Connection, table: Table, cutoff: datetime.date) -> int:
+        """Archive and delete, in chunks, the rows created before the cutoff"""
+        cutoff = datetime.datetime.combine(cutoff, datetime.time())
+        expired = table.c.created_at < cutoff
+        self.archive(conn, table, select(table).where(expired), f"before{cutoff:%Y%m%d}-{time.time():.0f}")
+        return self.delete_chunks(conn, table, table.c.id, expired)
+
+    def purge_processed_messages(self, conn: Connection, cutoff: datetime.datetime) -> int:
+        """
+        Delete, in chunks, the idempotency keys recorded before the cutoff.
+        A message redelivered after that is no longer recognised as a
+        duplicate, so the TTL must outlast the retention of the Kafka topics.
+        """
+        table = models.ProcessedMessage.__table__
+        return self.delete_chunks(conn, table, table.c.idempotency_key, table.c.created_at < cutoff)
+
+    def delete_chunks(self, conn: Connection, table: Table, key, condition) -> int:
+        """Delete the matching rows chunk_size at a time, committing after each chunk"""
+        deleted = 0
+        while True:
+            keys = select(key).where(condition).limit(self.chunk_size)
+            """The derived table lets MySQL take a LIMIT inside IN"""
+            chunk = conn.execute(delete(table).where(key.in_(
+                select(keys.subquery().c[key.name])
+            ))).rowcount
+            conn.commit()
+            deleted += chunk
+            if chunk < self.chunk_size:
+                return deleted
+
+    def migrate(self, conn: Connection, table: Table):
+        """
+        Convert a log table created before partitioning: widen id, move
+        created_at into the primary and unique keys, add the lookup indexes and
+        partition it by day. Rewrites the table, run it in a maintenance window.
+        """
+        if FUTURE_PARTITION in self.partitions(conn, table):
+            logger.info(f'{table.name} is already partitioned')
+            return
+        inspector = inspect(conn)
+        unique = {tuple(constraint["column_names"]): constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        changes = [
+            "MODIFY id BIGINT NOT NULL AUTO_INCREMENT",
+            "DROP PRIMARY KEY",
+            "ADD PRIMARY KEY (id, created_at)"
+        ]
+        for constraint in table.constraints:
+            if constraint.name and constraint.name.startswith("uq_") and constraint.name not in unique.values():
+                columns = [column.name for column in constraint.columns]
+                if (columns[0],) in unique:
+                    changes.append(f"DROP INDEX {unique[(columns[0],)]}")
+                changes.append(f"ADD CONSTRAINT {constraint.name} UNIQUE ({', '.join(columns)})")
+        conn.execute(text(f"ALTER TABLE {table.name} {', '.join(changes)}"))
+        for index in table.indexes:
+            if index.name not in indexes:
+                conn.execute(CreateIndex(index))
+        conn.execute(text(f"ALTER TABLE {table.name} PARTITION BY {models.AUDIT_LOG_PARTITION_BY}"))
+        conn.commit()
+        logger.info(f'Partitioned {table.name}')
+
+    def run_once(self, today: datetime.date = None) -> dict:
+        """
+        Run one maintenance pass over every table. A retention of 0 days
+        keeps the logs (upcoming partitions are still added), a TTL of 0
+        days keeps the idempotency keys.
+
+        Returns:
+            dict: What was done per table.
+        """
+        today = today or models.utcnow().date()
+        cutoff = today - datetime.timedelta(days=self.retention_days)
+        report = {}
+        with self.engine.connect() as lock:
+            if not self.acquire_lock(lock):
+                logger.info('Another audit log retention pass is running, skipping this one')
+                return report
+            try:
+                for table in self.tables:
+                    with self.engine.connect() as conn:
+                        if self.partitioned:
+                            """Partitions are added even when logs are kept forever, or new rows pile up in p_future"""
+                            report[table.name] = {
+                                "added": self.add_partitions(conn, table, today),
+                                "dropped": self.expire_partitions(conn, table, cutoff) if self.retention_days > 0 else []
+                            }
+                        elif self.retention_days > 0:
+                            report[table.name] = {"deleted": self.expire_rows(conn, table, cutoff)}
+                if self.processed_ttl_days > 0:
+                    with self.engine.connect() as conn:
+                        report[models.ProcessedMessage.__tablename__] = {"deleted": self.purge_processed_messages(
+                            conn, models.utcnow() - datetime.timedelta(days=self.processed_ttl_days)
+                        )}
+            finally:
+                self.release_lock(lock)
+        return report
+
+    def acquire_lock(self, conn: Connection) -> bool:
+        """Take the MySQL named lock of a pass on `conn`, without waiting; other dialects run unlocked"""
+        if not self.partitioned:
+            return True
+        return bool(conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar())
+
+    def release_lock(self, conn: Connection):
+        if self.partitioned:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+    def run_forever(self, interval: float):
+        """Run a maintenance pass every `interval` seconds"""
+        while True:
+            try:
+                report = self.run_once()
+                logger.info(f'Audit log retention pass: {report}')
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            time.sleep(interval)
+
+
+retention = AuditLogRetention(
+    engine=engine,
+    tables=[models.RequestLog.__table__, models.ResponseLog.__table__],
+    retention_days=settings.audit_log_retention_days,
+    partitions_ahead=settings.audit_log_partitions_ahead,
+    archive_dir=settings.audit_log_archive_dir,
+    chunk_size=settings.db_delete_chunk_size,
+    processed_ttl_days=settings.processed_message_ttl_days
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the partitions of the request/response log tables.")
+    parser.add_argument("command", choices=["run", "migrate"], nargs="?", default="run")
+    parser.add_argument("--forever", action="store_true", help="Repeat the pass every --interval seconds.")
+    parser.add_argument("--interval", type=float, default=settings.audit_log_retention_interval)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        with engine.connect() as conn:
+            for table in retention.tables:
+                retention.migrate(conn, table)
+    if args.forever:
+        retention.run_forever(args.interval)
+    print(retention.run_once())
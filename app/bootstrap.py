@@ -0,0 +1,63 @@
+"""
+Prepare the database for the API: create missing tables and, on MySQL,
+the day partitions of the request/response log tables.
+
+Usage:
+    python -m app.bootstrap [--migrate-logs] [--retries 10] [--retry-delay 3]
+
+Run it once per deploy, before starting the API and the consumer workers.
+--migrate-logs also converts log tables created before partitioning, which
+rewrites them (see AuditLogRetention.migrate).
+"""
+import sys, os, time, argparse
+from sqlalchemy.exc import OperationalError
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .database import Base, engine
+from . import models
+from .audit_retention import retention
+from .logger import logger
+
+
+def wait_for_database(retries: int, retry_delay: float):
+    """
+    Wait until the database accepts connections.
+
+    Raises:
+        OperationalError: If it still refuses connections after every retry.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            with engine.connect():
+                return
+        except OperationalError as e:
+            if attempt == retries:
+                raise
+            logger.warning(f'Database not reachable ({attempt}/{retries}), retrying in {retry_delay}s: {e}')
+            time.sleep(retry_delay)
+
+
+def bootstrap(migrate_logs: bool = False):
+    """Create missing tables, then prepare the log table partitions"""
+    Base.metadata.create_all(bind=engine)
+    logger.info('Created missing tables')
+    if not retention.partitioned:
+        return
+    with engine.connect() as conn:
+        for table in retention.tables:
+            if migrate_logs:
+                retention.migrate(conn, table)
+            added = retention.add_partitions(conn, table, models.utcnow().date())
+            logger.info(f'Added partitions {added} to {table.name}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the database schema for the API.")
+    parser.add_argument("--migrate-logs", action="store_true")
+    parser.add_argument("--retries", type=int, default=10)
+    parser.add_argument("--retry-delay", type=float, default=3.0)
+    args = parser.parse_args()
+    wait_for_database(args.retries, args.retry_delay)
+    bootstrap(args.migrate_logs)
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List
 
 class Settings(BaseSettings):
     db_user: str
@@ -30,6 +31,55 @@ class Settings(BaseSettings):
     smtp_port:int
     sender_email:str
     sender_password:str
+    kafka_transport: str = "aiokafka"
+    kafka_memory_partitions: int = 3
+    kafka_producer_linger_ms: int = 5
+    kafka_producer_max_batch_size: int = 16384
+    kafka_send_queue_maxsize: int = 10000
+    kafka_send_queue_overflow: str = "drop_oldest"
+    kafka_send_queue_batch_size: int = 500
+    kafka_audit_batch_max_records: int = 500
+    kafka_audit_batch_timeout_ms: int = 1000
+    kafka_partition_queue_size: int = 1000
+    kafka_write_coalesce_ms: int = 5
+    kafka_write_coalesce_max_messages: int = 500
+    db_executor_max_workers: int = 8
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    db_statement_cache_size: int = 512
+    db_read_page_size: int = 100
+    db_stream_chunk_size: int = 1000
+    db_delete_chunk_size: int = 10000
+    audit_log_retention_days: int = 30
+    audit_log_partitions_ahead: int = 7
+    audit_log_archive_dir: str = "archive"
+    audit_log_retention_interval: float = 3600.0
+    processed_message_ttl_days: int = 7
+    audit_body_sample_rate: float = 1.0
+    audit_body_max_bytes: int = 4096
+    audit_body_compress_min_bytes: int = 1024
+    audit_capture_cookies: bool = False
+    audit_capture_policies: Dict[str, dict] = {}
+    audit_redacted_headers: List[str] = []
+    kafka_codec_compression: str = "zstd"
+    kafka_codec_compression_threshold: int = 4096
+    kafka_audit_combined_exchange: bool = False
+    kafka_rpc_reply_topic: str = "rpc_replies"
+    kafka_rpc_timeout: float = 10.0
+    kafka_retry_topic: str = "retry"
+    kafka_dead_letter_topic: str = "dead_letter"
+    kafka_retry_max_attempts: int = 5
+    kafka_retry_base_delay: float = 1.0
+    kafka_retry_max_delay: float = 60.0
+    kafka_handler_db_retries: int = 1
+    api_run_consumers: bool = True
+    worker_topics: List[str] = []
+    worker_concurrency: Dict[str, int] = {}
+    worker_metrics_port: int = 9100
+    shutdown_drain_timeout: float = 20.0
     
     class Config:
         env_file = ".env"
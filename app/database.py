@@ -4,24 +4,92 @@ from pymongo.collection import Collection
 from sqlalchemy.orm import sessionmaker
 from pymongo import MongoClient
 from redis.client import Redis
+from concurrent.futures import ThreadPoolExecutor
 import redis
 import sys
 import os
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
 from .config import settings
+from . import metrics
 
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{settings.db_user}:{settings.db_password}@{settings.db_host}/{settings.db_name}"
 MONGO_DATABASE_URL = f"mongodb://{settings.mongo_db_host}:27017/"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_pre_ping=settings.db_pool_pre_ping,  # drop connections the server closed while idle
+    pool_recycle=settings.db_pool_recycle
+)
+metrics.DB_POOL_CHECKED_OUT.set_function(lambda: engine.pool.checkedout())
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+"""Bounded pool of threads that run blocking SQLAlchemy work off the event loop"""
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.db_executor_max_workers,
+    thread_name_prefix="db"
+)
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """
+    Run a blocking database call on the DB executor and await its result.
+
+    Args:
+        func: The blocking callable.
+        *args: Positional arguments for the callable.
+        **kwargs: Keyword arguments for the callable.
+
+    Returns:
+        The return value of the callable.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor, functools.partial(func, *args, **kwargs)
+    )
+
+def close_pools():
+    """
+    Wait for the database calls still running on the DB executor, then
+    close the pooled connections. Blocks, so run it off the event loop.
+    """
+    db_executor.shutdown(wait=True)
+    engine.dispose()
+
+@contextmanager
+def session_scope():
+    """
+    Hand out one pooled session for a unit of work. The connection is
+    checked out up front so the time spent waiting for the pool is
+    recorded; the session is rolled back on error and always closed,
+    which returns the connection to the pool.
+
+    Yields:
+        Session: The session.
+    """
+    session = SessionLocal()
+    try:
+        start = time.perf_counter()
+        session.connection()
+        metrics.DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
 def get_db():
     db = SessionLocal()
     try:
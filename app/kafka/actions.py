@@ -1,9 +1,9 @@
-import sys, time
+import sys, asyncio
 from fastapi import HTTPException, status, Response
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Tuple, Union
-import datetime
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import insert, select
+from typing import Callable, List, Tuple, Union
 
 import os
 
@@ -11,331 +11,433 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
 from .. import models
-from ..database import SessionLocal
-from . import config
+from ..database import SessionLocal, session_scope, run_in_db_executor
+from . import config, statements
 from ..logger import logger
+from .. import metrics
+from ..config import settings
 
-async def write_db(
-        data: dict,
-        schemas: str, 
-        db: Session = SessionLocal(),
+class RetriesExhausted(HTTPException):
+    """Raised by run_with_retries when every attempt failed with an SQLAlchemy error"""
+
+def _insert_ignore(db: Session, schemas: str, key: Tuple[str, ...]):
+    """Insert-ignore statement for the dialect of the session"""
+    return statements.insert_ignore_statement(schemas, db.get_bind().dialect.name, key)
+
+def _processed_keys(db: Session, keys: set) -> set:
+    """The idempotency keys among `keys` whose writes are already committed"""
+    if not keys:
+        return set()
+    return set(db.execute(
+        select(models.ProcessedMessage.idempotency_key)
+        .where(models.ProcessedMessage.idempotency_key.in_(keys))
+    ).scalars())
+
+"""Attempts at claiming idempotency keys that other consumers keep recording first"""
+CLAIM_KEY_ATTEMPTS = 3
+
+def _claim_keys(db: Session, keys: set) -> set:
+    """
+    Record the idempotency keys among `keys` that are not processed yet,
+    as the first write of the session's transaction, and return them. If a
+    concurrent consumer records one of them between the check and the
+    insert, the duplicate key error rolls the transaction back and the keys
+    are checked again, so that message's rows are skipped as already
+    written instead of failing.
+    """
+    for attempt in range(1, CLAIM_KEY_ATTEMPTS + 1):
+        claimed = keys - _processed_keys(db, keys)
+        if not claimed:
+            return claimed
+        try:
+            db.execute(
+                insert(models.ProcessedMessage),
+                [{"idempotency_key": key} for key in claimed]
+            )
+            return claimed
+        except IntegrityError:
+            if attempt == CLAIM_KEY_ATTEMPTS:
+                raise
+            logger.info("idempotency keys recorded concurrently, checking them again")
+            db.rollback()
+
+def _run_in_session(operation: Callable[[Session], object], db: Session = None):
+    """
+    Run a blocking database operation inside a session. Runs on the DB
+    executor, never on the event loop.
+
+    Args:
+        operation (Callable[[Session], object]): The operation to run.
+        db (Session): The session to use, a pooled session scope is opened when None.
+
+    Returns:
+        The return value of the operation.
+    """
+    if db is None:
+        with session_scope() as session:
+            return operation(session)
+    try:
+        return operation(db)
+    except SQLAlchemyError:
+        """Rollback the transaction in case of an SQLAlchemy error"""
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_with_retries(
+        operation: Callable[[Session], object],
+        description: str,
+        db: Session = None,
         max_retries: int = 3,
-        retry_delay: float = 1.0  
+        retry_delay: float = 1.0
     ):
     """
-    Write the request details to the database.
+    Run a database operation on the DB executor, retrying on SQLAlchemy
+    errors without blocking the event loop between attempts.
 
     Args:
-        data: The request object containing additional database object information.
-        schemas (str): The SQLAlchemy model to operate on.
-        db (Session): The database session.
+        operation (Callable[[Session], object]): The operation to run.
+        description (str): What the operation does, used in log messages.
+        db (Session): The database session, a new one per attempt when None.
         max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
         retry_delay (float): The delay between retry attempts in seconds.
 
+    Returns:
+        The return value of the operation.
+
     Raises:
-        HTTPException: If any unexpected error occurs while saving the request.
+        RetriesExhausted: If every attempt failed with an SQLAlchemy error,
+            the last one is chained as the cause.
+        HTTPException: As raised by the operation, or with 500 if any other
+            unexpected error occurs.
     """
     retry_count = 0
+    last_error = None
     while retry_count < max_retries:
         try:
-            match schemas:
-                case config.DatabaseSchemas.USER:
-                    new_request = models.User(**data)
-                case config.DatabaseSchemas.USER_PROFILE:
-                    new_request = models.UserProfile(**data)
-                case config.DatabaseSchemas.AUDIT_TRAIL:
-                    new_request = models.AuditTrail(**data)
-                case config.DatabaseSchemas.CSUITE_DASHBOARD_CATEGORIES:
-                    new_request = models.CSuiteDashboardCategories(**data)
-                case config.DatabaseSchemas.CSUITE_DASHBOARD:
-                    new_request = models.CSuiteDashboard(**data)
-                case config.DatabaseSchemas.TEXT2SQL:
-                    new_request = models.Text2SQL(**data)
-                case config.DatabaseSchemas.TECHNICAL_CHATBOT_RESPONSE:
-                    new_request = models.TechnicalChatbotResponse(**data)
-                case config.DatabaseSchemas.CSUITE_CHATBOT_RESPONSE:
-                    new_request = models.CSuiteChatbotResponse(**data)
-                case config.DatabaseSchemas.CLIENT_DATABASE_INFO:
-                    new_request = models.ClientDatabaseInfo(**data)
-            
-            db.add(new_request)
-            db.commit() 
-            db.refresh(new_request)
-
-            """if successful, break out of the loop"""
-            break
+            return await run_in_db_executor(_run_in_session, operation, db)
 
         except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
-
+            last_error = sqla_error
+            retry_count += 1
+            if retry_count >= max_retries:
+                logger.error(
+                    f"SQLAlchemy error occurred while {description}: "
+                    f"{str(sqla_error)}."
+                )
+                continue
             logger.error(
-                "SQLAlchemy error occurred while writing data to db: "
+                f"SQLAlchemy error occurred while {description}: "
                 f"{str(sqla_error)}. "
                 f"Retrying in {retry_delay} seconds..."
             )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
+            metrics.DB_ACTION_RETRIES.labels(description).inc()
+            await asyncio.sleep(retry_delay)
+
+        except HTTPException:
+            raise
+
         except Exception as e:
             logger.error(
-                f"An error occurred while writing data to db: {e}", 
+                f"An error occurred while {description}: {e}",
                 exc_info=sys.exc_info()
             )
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Internal server error"
             )
-        
-        finally:
-            db.close()
 
     else:
         logger.error(
             "Max retries reached. Unable to establish database connection "
-            "while writing data to db"
+            f"while {description}"
         )
-        raise HTTPException(
+        raise RetriesExhausted(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
+        ) from last_error
+
+async def write_db(
+        data: Union[dict, List[dict]],
+        schemas: str,
+        db: Session = None,
+        refresh: bool = True,
+        idempotency_keys: List[str] = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+    """
+    Write one or more rows to the database.
+
+    Args:
+        data (Union[dict, List[dict]]): One row, or a list of rows written with
+            a single executemany insert per set of columns.
+        schemas (str): The SQLAlchemy model to operate on.
+        db (Session): The database session, a new one is opened when None.
+        refresh (bool): Reload and return a single row after the insert; lists
+            of rows are never refreshed.
+        idempotency_keys (List[str]): The idempotency key of the message each
+            row came from, aligned with the rows. Rows whose key is already
+            recorded, including by a concurrent consumer, are skipped, and
+            the new keys are recorded in the same transaction as the rows.
+        max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
+        retry_delay (float): The delay between retry attempts in seconds.
+
+    Returns:
+        The refreshed row when a single row is written with refresh, else None.
+
+    Raises:
+        HTTPException: If any unexpected error occurs while saving the request.
+    """
+    rows = [data] if isinstance(data, dict) else data
+    if not rows:
+        return
+    if idempotency_keys is None:
+        idempotency_keys = [None] * len(rows)
+
+    if isinstance(data, dict) and refresh:
+        def operation(db: Session):
+            keys = {key for key in idempotency_keys if key}
+            if keys and not _claim_keys(db, keys):
+                logger.info(f"skipping already written row for {schemas}")
+                return None
+            new_request = statements.get_model(schemas)(**data)
+
+            db.add(new_request)
+            db.commit()
+            db.refresh(new_request)
+            return new_request
+
+        return await run_with_retries(
+            operation, "writing data to db", db, max_retries, retry_delay
         )
 
+    def operation(db: Session):
+        claimed = _claim_keys(db, {key for key in idempotency_keys if key})
+        new_rows = [
+            row for row, key in zip(rows, idempotency_keys)
+            if key is None or key in claimed
+        ]
+
+        """Rows with the same columns go into one executemany insert"""
+        groups = {}
+        for row in new_rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        statement = statements.insert_statement(schemas)
+        for group in groups.values():
+            db.execute(statement, group)
+        db.commit()
+        logger.info(
+            f"done writing {len(new_rows)} rows to {schemas}, "
+            f"skipped {len(rows) - len(new_rows)} already written"
+        )
+
+    await run_with_retries(
+        operation, "writing data to db", db, max_retries, retry_delay
+    )
+
 async def read_db(
-        schemas: str,  
+        schemas: str,
         operation: str,
         columns: List[str] = None,
         filters: List[Tuple[str, str]] = None,
-        db: Session = SessionLocal(),
+        order_by: List[Union[str, Tuple[str, str]]] = None,
+        limit: int = None,
+        after: list = None,
+        db: Session = None,
         max_retries: int = 3,
         retry_delay: float = 1.0
     ):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            match schemas:
-                case config.DatabaseSchemas.USER:
-                    model = models.User
-                case config.DatabaseSchemas.USER_PROFILE:
-                    model = models.UserProfile
-                case config.DatabaseSchemas.AUDIT_TRAIL:
-                    model = models.AuditTrail
-                case config.DatabaseSchemas.CSUITE_DASHBOARD_CATEGORIES:
-                    model = models.CSuiteDashboardCategories
-                case config.DatabaseSchemas.CSUITE_DASHBOARD:
-                    model = models.CSuiteDashboard
-                case config.DatabaseSchemas.TEXT2SQL:
-                    model = models.Text2SQL
-                case config.DatabaseSchemas.TECHNICAL_CHATBOT_RESPONSE:
-                    model = models.TechnicalChatbotResponse
-                case config.DatabaseSchemas.CSUITE_CHATBOT_RESPONSE:
-                    model = models.CSuiteChatbotResponse
-                case config.DatabaseSchemas.CLIENT_DATABASE_INFO:
-                    model = models.ClientDatabaseInfo
-            
-            
-            if operation != "all" and operation != "first":
-                raise ValueError(f"Unsupported operation: {operation}")
-
-            """Build the filter conditions dynamically"""
-            if filters is not None:
-                filter_conditions = []
-                for column, operator, value in filters:
-                    if operator == "=" or operator == "==":
-                        filter_conditions.append(getattr(model, column) == value)
-                    elif operator == ">":
-                        filter_conditions.append(getattr(model, column) > value)
-                    elif operator == "<":
-                        filter_conditions.append(getattr(model, column) < value)
-                    elif operator == ">=":
-                        filter_conditions.append(getattr(model, column) >= value)
-                    elif operator == "<=":
-                        filter_conditions.append(getattr(model, column) <= value)
-                    else:
-                        raise ValueError(f"Unsupported operator: {operator}")
-            
+    """
+    Read rows from a table.
+
+    Args:
+        schemas (str): The SQLAlchemy model to operate on.
+        operation (str): "all" for every matching row (up to limit), "first"
+            for the first one, or "page" for one page of a keyset pagination.
+        columns (List[str]): The columns to select, whole rows when None.
+        filters (list): Filter conditions as (column, operator, value), see
+            statements.filter_shape; {"or": [...]} groups conditions.
+        order_by (List[Union[str, Tuple[str, str]]]): Column names or
+            (column, "asc"|"desc") pairs to order by. Pages are also ordered
+            by the primary key to break ties.
+        limit (int): The maximum number of rows; the page size for "page",
+            defaulting to DB_READ_PAGE_SIZE.
+        after (list): For "page", the next_cursor of the previous page.
+        db (Session): The database session, a new one is opened when None.
+        max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
+        retry_delay (float): The delay between retry attempts in seconds.
+
+    Returns:
+        The rows for "all", a row or None for "first", and for "page" a dict
+        with the "rows" and the "next_cursor" to pass as `after` (None on
+        the last page). Pages also select the order_by columns.
+
+    Raises:
+        HTTPException: If any unexpected error occurs while reading.
+    """
+    def read(db: Session):
+        if operation not in ("all", "first", "page"):
+            raise ValueError(f"Unsupported operation: {operation}")
+
+        select_columns = columns
+        page_size = limit
+        if operation == "page":
+            order = statements.order_shape(schemas, order_by, unique=True)
+            page_size = limit or settings.db_read_page_size
+            if after is not None and len(after) != len(order):
+                raise ValueError("The cursor does not match the order_by columns")
             if columns is not None:
-                """Build a list of expressions for the selected columns"""
-                column_expressions = [
-                    getattr(model, column) for column in columns
+                """The cursor is read from the last row, so it needs the order columns"""
+                select_columns = list(columns) + [
+                    column for column, _ in order if column not in columns
                 ]
+        else:
+            order = statements.order_shape(schemas, order_by)
 
-            """Query the selected columns based on the filter conditions"""
-            if filters is None and columns is None:
-                query = db.query(model)
-            elif filters is None and columns is not None:
-                query = db.query(*column_expressions)
-            elif filters is not None and columns is None:
-                query = db.query(model).filter(*filter_conditions)
-            else:
-                query = db.query(*column_expressions).filter(
-                    *filter_conditions)
-                
-            if operation == "all":
-                return query.all()
-            elif operation == "first":
-                return query.first()
-            
-        except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
+        """Query the selected columns based on the filter conditions"""
+        statement = statements.select_statement(
+            schemas, operation, select_columns, filters, order, page_size,
+            keyset=operation == "page" and after is not None
+        )
+        params = statements.filter_params(schemas, filters)
+        if operation == "page":
+            params.update(statements.keyset_params(schemas, order, after))
+        result = db.execute(statement, params)
+        if columns is None:
+            result = result.scalars()
+
+        if operation == "all":
+            return result.all()
+        elif operation == "first":
+            return result.first()
+
+        rows = result.all()
+        next_cursor = None
+        if len(rows) == page_size:
+            next_cursor = [getattr(rows[-1], column) for column, _ in order]
+        return {"rows": rows, "next_cursor": next_cursor}
+
+    return await run_with_retries(
+        read, "reading data from db", db, max_retries, retry_delay
+    )
+
+async def stream_db(
+        schemas: str,
+        columns: List[str] = None,
+        filters: List[Tuple[str, str]] = None,
+        order_by: List[Union[str, Tuple[str, str]]] = None,
+        chunk_size: int = None
+    ):
+    """
+    Stream matching rows in chunks from a server-side cursor, so memory
+    stays bounded and the first chunk arrives before the whole result is
+    read. Each chunk is fetched on the DB executor when the caller asks
+    for it; the session stays open until the generator is exhausted or
+    closed.
 
-            logger.error(
-                f"SQLAlchemy error occurred while reading data from db: "
-                f"{str(sqla_error)}. "
-                f"Retrying in {retry_delay} seconds..."
-            )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
-        except Exception as e:
-            logger.error(
-                f"An error occurred while reading data from db: {e}", 
-                exc_info=sys.exc_info()
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error"
-            )
-        
-        finally:
-            db.close()
+    Args:
+        schemas (str): The SQLAlchemy model to operate on.
+        columns (List[str]): The columns to select, whole rows when None.
+        filters (list): Filter conditions as (column, operator, value), see statements.filter_shape.
+        order_by (List[Union[str, Tuple[str, str]]]): Column names or
+            (column, "asc"|"desc") pairs to order by.
+        chunk_size (int): Rows per chunk, defaults to DB_STREAM_CHUNK_SIZE.
 
-    else:
+    Yields:
+        list: Up to chunk_size rows.
+
+    Raises:
+        HTTPException: If any error occurs while reading.
+    """
+    chunk_size = chunk_size or settings.db_stream_chunk_size
+    session = SessionLocal()
+
+    def execute():
+        statement = statements.select_statement(
+            schemas, "stream", columns, filters, statements.order_shape(schemas, order_by)
+        )
+        result = session.execute(
+            statement,
+            statements.filter_params(schemas, filters),
+            execution_options={"yield_per": chunk_size}
+        )
+        return result.scalars() if columns is None else result
+
+    try:
+        result = await run_in_db_executor(execute)
+        while True:
+            chunk = await run_in_db_executor(result.fetchmany, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    except Exception as e:
         logger.error(
-            "Max retries reached. Unable to establish database connection "
-            "while reading data from db"
+            f"An error occurred while streaming data from db: {e}",
+            exc_info=sys.exc_info()
         )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
+    finally:
+        await run_in_db_executor(session.close)
 
 async def update_db(
-        schemas: str,  
+        schemas: str,
         update_data: List[Tuple[str, Union[bool, int, str]]] = None,
         filters: List[Tuple[str, str, Union[str, int, float]]] = None,
-        db: Session = SessionLocal(),
+        db: Session = None,
         max_retries: int = 3,
         retry_delay: float = 1.0
     ):
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            match schemas:
-                case config.DatabaseSchemas.USER:
-                    model = models.User
-                case config.DatabaseSchemas.USER_PROFILE:
-                    model = models.UserProfile
-                case config.DatabaseSchemas.AUDIT_TRAIL:
-                    model = models.AuditTrail
-                case config.DatabaseSchemas.CSUITE_DASHBOARD_CATEGORIES:
-                    model = models.CSuiteDashboardCategories
-                case config.DatabaseSchemas.CSUITE_DASHBOARD:
-                    model = models.CSuiteDashboard
-                case config.DatabaseSchemas.TEXT2SQL:
-                    model = models.Text2SQL
-                case config.DatabaseSchemas.TECHNICAL_CHATBOT_RESPONSE:
-                    model = models.TechnicalChatbotResponse
-                case config.DatabaseSchemas.CSUITE_CHATBOT_RESPONSE:
-                    model = models.CSuiteChatbotResponse
-                case config.DatabaseSchemas.CLIENT_DATABASE_INFO:
-                    model = models.ClientDatabaseInfo
-
-            if update_data is None: 
-                """If no update_data is provided, raise an error"""
-                raise ValueError(
-                    "No update_data provided for the update operation."
-                )
-            
-            if filters is None:
-                """If no filters is provided, raise an error"""
-                raise ValueError(
-                    "No conditions provided for the update operation."
-                )
-            
-            """Build the filter conditions dynamically"""
-            filter_conditions = []
-            for column, operator, value in filters:
-                if column == "created_at":
-                    value = datetime.datetime.fromisoformat(value)
-                if operator == "=" or operator == "==":
-                    filter_conditions.append(getattr(model, column) == value)
-                elif operator == ">":
-                    filter_conditions.append(getattr(model, column) > value)
-                elif operator == "<":
-                    filter_conditions.append(getattr(model, column) < value)
-                elif operator == ">=":
-                    filter_conditions.append(getattr(model, column) >= value)
-                elif operator == "<=":
-                    filter_conditions.append(getattr(model, column) <= value)
-                else:
-                    raise ValueError(f"Unsupported operator: {operator}")
-
-            """Update based on a list of tuples (column name, value) and the filter conditions"""
-            update_dict = {column: value for column, value in update_data}
-            db.query(model).filter(*filter_conditions).update(update_dict)
-            
-            """Commit the changes to the database"""
-            db.commit() 
-
-            """if successful, break out of the loop"""
-            break
-
-        except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
-
-            logger.error(
-                f"SQLAlchemy error occurred while updating data from db: "
-                f"{str(sqla_error)}. "
-                f"Retrying in {retry_delay} seconds..."
+    def operation(db: Session):
+        if update_data is None:
+            """If no update_data is provided, raise an error"""
+            raise ValueError(
+                "No update_data provided for the update operation."
             )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
-        except Exception as e:
-            logger.error(
-                f"An error occurred while updating data from db: {e}", 
-                exc_info=sys.exc_info()
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error"
+
+        if not filters:
+            """If no filters is provided, raise an error"""
+            raise ValueError(
+                "No conditions provided for the update operation."
             )
-        
-        finally:
-            db.close()
 
-    else:
-        logger.error(
-            "Max retries reached. Unable to establish database connection "
-            "while updating data from db"
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error"
-        )
+        """Update based on a list of tuples (column name, value) and the filter conditions"""
+        update_dict = {column: value for column, value in update_data}
+        statement = statements.update_statement(schemas, list(update_dict), filters)
+        params = statements.filter_params(schemas, filters)
+        params.update(statements.update_params(schemas, update_dict))
+        db.execute(statement, params)
+
+        """Commit the changes to the database"""
+        db.commit()
+
+    await run_with_retries(
+        operation, "updating data from db", db, max_retries, retry_delay
+    )
 
 async def delete_db(
-        schemas: str,  
-        filters: List[Tuple[str, str]],
-        db: Session = SessionLocal(),
+        schemas: str,
+        filters: list,
+        chunk_size: int = None,
+        db: Session = None,
         max_retries: int = 3,
-        retry_delay: float = 1.0  
+        retry_delay: float = 1.0
     ):
     """
     Deletes data from a table based on filter conditions.
 
     Args:
         schemas (str): The SQLAlchemy model to operate on.
-        filters (List[Tuple[str, str]]): A list of filter conditions as tuples (column_name, value).
-        db (Session): The database session dependency.
+        filters (list): Filter conditions as (column, operator, value), see statements.filter_shape.
+        chunk_size (int): Delete in chunks of this many rows, committing after
+            each chunk, so large purges hold locks briefly and never load the
+            whole match. None deletes everything in one statement.
+        db (Session): The database session, a new one is opened when None.
         max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
         retry_delay (float): The delay between retry attempts in seconds.
 
@@ -345,110 +447,90 @@ async def delete_db(
     Raises:
         HTTPException: If any error happened in the sqlalchemy
         HTTPException: If the data with the specified filter conditions does not exist, a 404 Not Found error is raised.
+        HTTPException: If no filter conditions are given, a 400 Bad Request error is raised.
         HTTPException: If any other unexpected error occurs, a 500 Internal Server Error is raised.
     """
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            match schemas:
-                case config.DatabaseSchemas.USER:
-                    model = models.User
-                case config.DatabaseSchemas.USER_PROFILE:
-                    model = models.UserProfile
-                case config.DatabaseSchemas.AUDIT_TRAIL:
-                    model = models.AuditTrail
-                case config.DatabaseSchemas.CSUITE_DASHBOARD_CATEGORIES:
-                    model = models.CSuiteDashboardCategories
-                case config.DatabaseSchemas.CSUITE_DASHBOARD:
-                    model = models.CSuiteDashboard
-                case config.DatabaseSchemas.TEXT2SQL:
-                    model = models.Text2SQL
-                case config.DatabaseSchemas.TECHNICAL_CHATBOT_RESPONSE:
-                    model = models.TechnicalChatbotResponse
-                case config.DatabaseSchemas.CSUITE_CHATBOT_RESPONSE:
-                    model = models.CSuiteChatbotResponse
-                case config.DatabaseSchemas.CLIENT_DATABASE_INFO:
-                    model = models.ClientDatabaseInfo
-
-            """Build the filter conditions dynamically"""
-            filter_conditions = []
-            for column, operator, value in filters:
-                if column == "created_at":
-                    value = datetime.datetime.fromisoformat(value)
-                if operator == "=" or operator == "==":
-                    filter_conditions.append(getattr(model, column) == value)
-                elif operator == ">":
-                    filter_conditions.append(getattr(model, column) > value)
-                elif operator == "<":
-                    filter_conditions.append(getattr(model, column) < value)
-                elif operator == ">=":
-                    filter_conditions.append(getattr(model, column) >= value)
-                elif operator == "<=":
-                    filter_conditions.append(getattr(model, column) <= value)
-                else:
-                    raise ValueError(f"Unsupported operator: {operator}")
-            
-            """Query the data based on the filter conditions"""
-            data_query = db.query(model).filter(*filter_conditions)
-            
-            """Get the data based on the filter conditions"""
-            data = data_query.all()
-
-            """If no data matching the filter conditions exist, raise a 404 Not Found error"""
-            if not data:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, 
-                    detail=f"No data matching the filter conditions"
-                )
-
-            """Delete the data and commit the transaction"""
-            data_query.delete(synchronize_session=False)
-            db.commit()
+    if not filters:
+        """Without conditions the DELETE would empty the whole table"""
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No conditions provided for the delete operation."
+        )
 
-            return Response(status_code=status.HTTP_204_NO_CONTENT)
+    """Rows deleted by committed statements, kept across retries: a retry after a chunk committed finds fewer rows"""
+    deleted = 0
 
-        except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
+    def operation(db: Session):
+        nonlocal deleted
+        params = statements.filter_params(schemas, filters)
 
-            logger.error(
-                f"SQLAlchemy error occurred while deleting data from db: "
-                f"{str(sqla_error)}. "
-                f"Retrying in {retry_delay} seconds..."
-            )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
-        except Exception as e:
-            logger.error(
-                f"An error occurred while deleting data from db: {e}", 
-                exc_info=sys.exc_info()
-            )
+        if chunk_size is None:
+            """Delete the data and count the affected rows from the DELETE itself"""
+            rows = db.execute(statements.delete_statement(schemas, filters), params).rowcount
+            db.commit()
+            deleted += rows
+        else:
+            select_chunk = statements.delete_chunk_statement(schemas, filters, chunk_size)
+            delete_chunk = statements.delete_by_keys_statement(schemas)
+            single_key = len(statements.primary_key_columns(schemas)) == 1
+            while True:
+                """Only the primary keys of one chunk are held in memory"""
+                keys = db.execute(select_chunk, params).all()
+                if not keys:
+                    break
+                keys = [key[0] for key in keys] if single_key else [tuple(key) for key in keys]
+                rows = db.execute(delete_chunk, {"keys": keys}).rowcount
+                db.commit()
+                deleted += rows
+                if len(keys) < chunk_size:
+                    break
+
+        """If no data matching the filter conditions existed, raise a 404 Not Found error"""
+        if not deleted:
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error"
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No data matching the filter conditions"
             )
-        
-        finally:
-            db.close()
 
+        logger.info(f'deleted {deleted} rows from {schemas}')
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    return await run_with_retries(
+        operation, "deleting data from db", db, max_retries, retry_delay
+    )
+
+REQUEST_LOG_COLUMNS = (
+    "request_id", "method", "url_path", "query_params", "request_headers",
+    "request_body", "client_ip", "user_agent", "referer", "cookies",
+    "route_name", "created_at"
+)
+
+RESPONSE_LOG_COLUMNS = (
+    "request_id", "response_id", "response_status_code", "response_headers",
+    "response_body", "duration_ms", "created_at"
+)
+
+"""Unique keys of the partitioned log tables, see models.AUDIT_LOG_PARTITION_BY"""
+REQUEST_LOG_KEY = ("request_id", "created_at")
+RESPONSE_LOG_KEY = ("response_id", "created_at")
+
+def _log_row(model, data: dict, columns: Tuple[str, ...]) -> dict:
+    """
+    A log table row from an audit message. created_at arrives as an ISO
+    string; messages produced before it was set fall back to now.
+    """
+    row = {column: data.get(column) for column in columns}
+    if row["created_at"] is None:
+        row["created_at"] = models.utcnow()
     else:
-        logger.error(
-            "Max retries reached. Unable to establish database connection "
-            "while deleting data from db"
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error"
-        )
-    
+        row["created_at"] = statements.coerce_value(model.created_at, row["created_at"])
+    return row
+
 async def save_request_to_db(
-        request: dict, 
-        db: Session = SessionLocal(),
+        request: dict,
+        db: Session = None,
         max_retries: int = 3,
-        retry_delay: float = 1.0  
+        retry_delay: float = 1.0
     ):
     """
     Save the request details to the database.
@@ -457,83 +539,33 @@ async def save_request_to_db(
         request (Request): The request object containing additional information.
         request_id (str): The ID of the request.
         request_body (str): The body of the request.
-        db (Session): The database session.
+        db (Session): The database session, a new one is opened when None.
         max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
         retry_delay (float): The delay between retry attempts in seconds.
 
     Raises:
         HTTPException: If any unexpected error occurs while saving the request.
     """
-    retry_count = 0
-    while retry_count < max_retries:
-        try:
-            """Create a new RequestLog object with the request details and 
-                add it to the database"""
-            logger.info("saving request")
-
-            request_log = models.RequestLog(
-                request_id=request.get("request_id"),
-                method=request.get("method"),
-                url_path=request.get("url_path"),
-                query_params=request.get("query_params"),
-                request_headers=request.get("request_headers"),
-                request_body=request.get("request_body"),
-                client_ip=request.get("client_ip"),
-                user_agent=request.get("user_agent"),
-                referer=request.get("referer"),
-                cookies=request.get("cookies"),
-                route_name=request.get("route_name"),
-            )
+    row = _log_row(models.RequestLog, request, REQUEST_LOG_COLUMNS)
 
-            db.add(request_log)
-            db.commit()
-            logger.info("done saving request")
-
-            """if successful, break out of the loop"""
-            break
+    def operation(db: Session):
+        """Insert the request details, ignoring a request that is
+            already stored (the message was delivered again)"""
+        logger.info("saving request")
 
-        except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.REQUEST_LOG, REQUEST_LOG_KEY), [row])
+        db.commit()
+        logger.info("done saving request")
 
-            logger.error(
-                "SQLAlchemy error occurred while saving request to db: "
-                f"{str(sqla_error)}. "
-                f"Retrying in {retry_delay} seconds..."
-            )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
-        except Exception as e:
-            logger.error(
-                f"An error occurred while saving request to db: {e}",
-                exc_info=sys.exc_info()
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error"
-            )
-        
-        finally:
-            db.close()
-    
-    else:
-        logger.error(
-            "Max retries reached. Unable to establish database connection "
-            "while saving reqeust to db"
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error"
-        )
+    await run_with_retries(
+        operation, "saving request to db", db, max_retries, retry_delay
+    )
 
 async def save_response_to_db(
-        response: dict, 
-        db: Session = SessionLocal(),
+        response: dict,
+        db: Session = None,
         max_retries: int = 3,
-        retry_delay: float = 1.0  
+        retry_delay: float = 1.0
     ):
     """
     Save the response details to the database.
@@ -541,68 +573,131 @@ async def save_response_to_db(
     Args:
         request_id (str): The ID of the request.
         response (Response): The response object containing additional information.
-        db (Session): The database session.
+        db (Session): The database session, a new one is opened when None.
         max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
         retry_delay (float): The delay between retry attempts in seconds.
 
     Raises:
         HTTPException: If any unexpected error occurs while saving the response.
     """
-    retry_count = 0
-    while retry_count < max_retries:
-        try: 
-            logger.info("saving response")
-
-            """Create a new ResponseLog object with the response details and 
-                add it to the database"""
-            response_log =  models.ResponseLog(
-                request_id=response.get("request_id"),
-                response_id=response.get("response_id"),
-                response_status_code=response.get("response_status_code"),
-                response_headers=response.get("response_headers"),
-                response_body=response.get("response_body")
-            )
+    row = _log_row(models.ResponseLog, response, RESPONSE_LOG_COLUMNS)
 
-            db.add(response_log)
-            db.commit()
-            logger.info("done saving response")
+    def operation(db: Session):
+        logger.info("saving response")
 
-            """if successful, break out of the loop"""
-            break
+        """Insert the response details, ignoring a response that is
+            already stored (the message was delivered again)"""
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.RESPONSE_LOG, RESPONSE_LOG_KEY), [row])
+        db.commit()
+        logger.info("done saving response")
 
-        except SQLAlchemyError as sqla_error:
-            if db is not None:
-                """Rollback the transaction in case of an SQLAlchemy error"""
-                db.rollback() 
-                db.close()
+    await run_with_retries(
+        operation, "saving response to db", db, max_retries, retry_delay
+    )
 
-            logger.error(
-                "SQLAlchemy error occurred while saving response to db: "
-                f"{str(sqla_error)}. "
-                f"Retrying in {retry_delay} seconds..."
-            )
-            time.sleep(retry_delay)
-            retry_count += 1
-        
-        except Exception as e:
-            logger.error(
-                f"An error occurred while saving response to db: {e}", 
-                exc_info=sys.exc_info()
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Internal server error"
-            )
-        
-        finally:
-            db.close()
+async def save_requests_to_db(
+        requests: List[dict],
+        db: Session = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+    """
+    Save a batch of request details to the database with a single
+    multi-row insert. Requests whose request_id is already stored are
+    skipped, so a redelivered batch does not add duplicates.
 
-    else:
-        logger.error(
-            "Max retries reached. Unable to establish database connection "
-            "while saving response to db"
-        )
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Internal server error"
-        )
\ No newline at end of file
+    Args:
+        requests (List[dict]): The request details, one dict per request.
+        db (Session): The database session, a new one is opened when None.
+        max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
+        retry_delay (float): The delay between retry attempts in seconds.
+
+    Raises:
+        HTTPException: If any unexpected error occurs while saving the requests.
+    """
+    if not requests:
+        return
+    rows = [_log_row(models.RequestLog, request, REQUEST_LOG_COLUMNS) for request in requests]
+
+    def operation(db: Session):
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.REQUEST_LOG, REQUEST_LOG_KEY), rows)
+        db.commit()
+        logger.info(f"done saving {len(rows)} requests")
+
+    await run_with_retries(
+        operation, "saving requests to db", db, max_retries, retry_delay
+    )
+
+async def save_responses_to_db(
+        responses: List[dict],
+        db: Session = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+    """
+    Save a batch of response details to the database with a single
+    multi-row insert. Responses whose response_id is already stored are
+    skipped, so a redelivered batch does not add duplicates.
+
+    Args:
+        responses (List[dict]): The response details, one dict per response.
+        db (Session): The database session, a new one is opened when None.
+        max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
+        retry_delay (float): The delay between retry attempts in seconds.
+
+    Raises:
+        HTTPException: If any unexpected error occurs while saving the responses.
+    """
+    if not responses:
+        return
+    rows = [_log_row(models.ResponseLog, response, RESPONSE_LOG_COLUMNS) for response in responses]
+
+    def operation(db: Session):
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.RESPONSE_LOG, RESPONSE_LOG_KEY), rows)
+        db.commit()
+        logger.info(f"done saving {len(rows)} responses")
+
+    await run_with_retries(
+        operation, "saving responses to db", db, max_retries, retry_delay
+    )
+
+async def save_exchanges_to_db(
+        exchanges: List[dict],
+        db: Session = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+    """
+    Save a batch of combined request/response exchanges to the database,
+    inserting the request and response rows in one transaction.
+
+    Args:
+        exchanges (List[dict]): The exchanges, each with a "request" and a
+            "response" dict.
+        db (Session): The database session, a new one is opened when None.
+        max_retries (int): The maximum number of retry attempts on SQLAlchemy errors.
+        retry_delay (float): The delay between retry attempts in seconds.
+
+    Raises:
+        HTTPException: If any unexpected error occurs while saving the exchanges.
+    """
+    if not exchanges:
+        return
+    request_rows = [
+        _log_row(models.RequestLog, exchange["request"], REQUEST_LOG_COLUMNS)
+        for exchange in exchanges
+    ]
+    response_rows = [
+        _log_row(models.ResponseLog, exchange["response"], RESPONSE_LOG_COLUMNS)
+        for exchange in exchanges
+    ]
+
+    def operation(db: Session):
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.REQUEST_LOG, REQUEST_LOG_KEY), request_rows)
+        db.execute(_insert_ignore(db, config.DatabaseSchemas.RESPONSE_LOG, RESPONSE_LOG_KEY), response_rows)
+        db.commit()
+        logger.info(f"done saving {len(exchanges)} exchanges")
+
+    await run_with_retries(
+        operation, "saving exchanges to db", db, max_retries, retry_delay
+    )
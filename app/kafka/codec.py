@@ -0,0 +1,116 @@
+import orjson, uuid
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from ..config import settings
+from ..logger import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+"""Envelope version written by this codec; messages without one are version 1"""
+CODEC_VERSION = 1
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+
+class Compression:
+    NONE = "none"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+
+class MessageCodec:
+    """
+    Serializes Kafka message envelopes ({"version", "idempotency_key",
+    "action", "data"}) with
+    orjson, compressing payloads above a size threshold. Compressed payloads
+    are recognised by their frame magic bytes, so plain JSON written by older
+    producers still decodes.
+    """
+    def __init__(self, compression: str = Compression.NONE, threshold: int = 4096):
+        if compression == Compression.ZSTD and zstandard is None:
+            logger.warning("zstandard is not installed, Kafka messages will not be compressed")
+            compression = Compression.NONE
+        if compression == Compression.LZ4 and lz4 is None:
+            logger.warning("lz4 is not installed, Kafka messages will not be compressed")
+            compression = Compression.NONE
+        if compression not in (Compression.NONE, Compression.ZSTD, Compression.LZ4):
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.compression = compression
+        self.threshold = threshold
+        self.zstd_compressor = zstandard.ZstdCompressor() if zstandard else None
+        self.zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def encode(self, value: dict) -> bytes:
+        """
+        Encode a message envelope.
+
+        Args:
+            value (dict): The envelope, "version" and "idempotency_key" fields
+                are added if missing. Consumers use the key to skip writes
+                they already committed when a message is delivered again.
+
+        Returns:
+            bytes: The serialized, possibly compressed, message.
+        """
+        if "version" not in value or "idempotency_key" not in value:
+            value = {
+                "version": CODEC_VERSION,
+                "idempotency_key": uuid.uuid4().hex,
+                **value
+            }
+        payload = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        if len(payload) < self.threshold:
+            return payload
+        match self.compression:
+            case Compression.ZSTD:
+                return self.zstd_compressor.compress(payload)
+            case Compression.LZ4:
+                return lz4.frame.compress(payload)
+        return payload
+
+    def decode(self, raw: bytes) -> dict:
+        """
+        Decode a message envelope.
+
+        Args:
+            raw (bytes): The message value as read from Kafka.
+
+        Returns:
+            dict: The envelope.
+
+        Raises:
+            ValueError: If the payload cannot be decoded or has an unknown version.
+        """
+        if raw[:4] == ZSTD_MAGIC:
+            if zstandard is None:
+                raise ValueError("Received zstd message but zstandard is not installed")
+            raw = self.zstd_decompressor.decompress(raw)
+        elif raw[:4] == LZ4_MAGIC:
+            if lz4 is None:
+                raise ValueError("Received lz4 message but lz4 is not installed")
+            raw = lz4.frame.decompress(raw)
+        value = orjson.loads(raw)
+        version = value.get("version", 1)
+        if version > CODEC_VERSION:
+            raise ValueError(f"Unsupported message version: {version}")
+        return value
+
+
+codec = MessageCodec(
+    compression=settings.kafka_codec_compression,
+    threshold=settings.kafka_codec_compression_threshold
+)
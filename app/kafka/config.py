@@ -14,6 +14,7 @@ class KafkaTopic:
     DELETE_DB = "delete_db"
     SAVE_RESPONSE_TO_DB = "save_response_to_db"
     SAVE_REQUEST_TO_DB = "save_request_to_db"
+    SAVE_EXCHANGE_TO_DB = "save_exchange_to_db"
 
 class KafkaAction:
     WRITE_DB = "write_db"
@@ -22,6 +23,16 @@ class KafkaAction:
     DELETE_DB = "delete_db"
     SAVE_RESPONSE_TO_DB = "save_response_to_db"
     SAVE_REQUEST_TO_DB = "save_request_to_db"
+    SAVE_EXCHANGE_TO_DB = "save_exchange_to_db"
+
+class KafkaTransport:
+    AIOKAFKA = "aiokafka"
+    MEMORY = "memory"
+
+class QueueOverflowPolicy:
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEW = "drop_new"
+    BLOCK = "block"
 
 class Task:
     WRITE_DB = None
@@ -30,6 +41,8 @@ class Task:
     DELETE_DB = None
     SAVE_RESPONSE_TO_DB = None
     SAVE_REQUEST_TO_DB = None
+    SAVE_EXCHANGE_TO_DB = None
+    RETRY = None
 
 class DatabaseSchemas:
     USER = models.User.__tablename__
@@ -42,3 +55,19 @@ class DatabaseSchemas:
     CLIENT_DATABASE_INFO = models.ClientDatabaseInfo.__tablename__
     REQUEST_LOG = models.RequestLog.__tablename__
     RESPONSE_LOG = models.ResponseLog.__tablename__
+    PROCESSED_MESSAGE = models.ProcessedMessage.__tablename__
+
+"""Models the generic DB actions can operate on, by schema name"""
+SCHEMA_MODELS = {
+    DatabaseSchemas.USER: models.User,
+    DatabaseSchemas.USER_PROFILE: models.UserProfile,
+    DatabaseSchemas.CSUITE_DASHBOARD_CATEGORIES: models.CSuiteDashboardCategories,
+    DatabaseSchemas.CSUITE_DASHBOARD: models.CSuiteDashboard,
+    DatabaseSchemas.TEXT2SQL: models.Text2SQL,
+    DatabaseSchemas.TECHNICAL_CHATBOT_RESPONSE: models.TechnicalChatbotResponse,
+    DatabaseSchemas.CSUITE_CHATBOT_RESPONSE: models.CSuiteChatbotResponse,
+    DatabaseSchemas.CLIENT_DATABASE_INFO: models.ClientDatabaseInfo,
+    DatabaseSchemas.REQUEST_LOG: models.RequestLog,
+    DatabaseSchemas.RESPONSE_LOG: models.ResponseLog,
+    DatabaseSchemas.PROCESSED_MESSAGE: models.ProcessedMessage,
+}
@@ -1,15 +1,36 @@
-import aiokafka, sys, json, asyncio
+import sys, asyncio
 from kafka import TopicPartition
-from typing import Set
+from typing import Dict, Optional, Set
+from aiokafka.abc import ConsumerRebalanceListener
+from aiokafka.errors import CommitFailedError, IllegalStateError
 
 import os
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
-from . import config, actions
+from . import config, actions, transport
+from .codec import codec
+from .producers import producer_manager
+from . import rpc
+from .retry import retry_scheduler, is_transient
+from fastapi import status
 from ..logger import logger
 from ..config import settings
+from .. import metrics
+
+
+class PartitionRebalanceListener(ConsumerRebalanceListener):
+    """Starts and stops partition workers as the group rebalances."""
+    def __init__(self, manager, topic: str):
+        self.manager = manager
+        self.topic = topic
+
+    async def on_partitions_revoked(self, revoked):
+        await self.manager.stop_partition_workers(self.topic, set(revoked))
+
+    async def on_partitions_assigned(self, assigned):
+        self.manager.start_partition_workers(self.topic, set(assigned))
 
 
 class KafkaConsumeManager:
@@ -17,6 +38,10 @@ class KafkaConsumeManager:
         self.loop = loop
         self.bootstrap_servers = bootstrap_servers
         self.consumers = {}
+        self.partition_workers = {}
+        self.processed_offsets = {}
+        self.stop_events: Dict[str, asyncio.Event] = {}
+        self.drain_deadlines: Dict[str, float] = {}
 
     async def create_bg_consumer(self, topic: str, group_id: str = "default"):
         try:
@@ -25,14 +50,23 @@ class KafkaConsumeManager:
                 f'for topic {topic}, group_id {group_id} '
                 f'and using bootstrap servers {self.bootstrap_servers}'
             )
-            consumer = aiokafka.AIOKafkaConsumer(
-                topic, 
+            consumer = transport.create_consumer(
                 loop=self.loop,
                 bootstrap_servers=self.bootstrap_servers,
-                group_id=group_id
+                group_id=group_id,
+                enable_auto_commit=False,  # offsets are committed once the partition worker has handled them
+                auto_offset_reset="earliest"
+            )
+            consumer.subscribe(
+                topics=[topic], 
+                listener=PartitionRebalanceListener(self, topic)
             )
             
             self.consumers[topic] = consumer
+            self.partition_workers[topic] = {}
+            self.processed_offsets[topic] = {}
+            self.stop_events[topic] = asyncio.Event()
+            self.drain_deadlines.pop(topic, None)
         except Exception as e:
             logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
             raise KeyError(f"Error creating Kafka consumer for topic '{topic}'")
@@ -43,76 +77,513 @@ class KafkaConsumeManager:
             await self.consumers.get(topic).start()
 
             partitions: Set[TopicPartition] = self.consumers.get(topic).assignment()
+            logger.info(
+                f"Assigned {len(partitions)} partitions for topic {topic}: "
+                f"{sorted(tp.partition for tp in partitions)}"
+            )
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            raise KeyError(f"Error starting Kafka consumer for topic '{topic}'")
 
-            nr_partitions = len(partitions)
-            if nr_partitions != 1:
-                pass
-                logger.warning(
-                    f"Found {nr_partitions} partitions "
-                    f"for topic {topic}. Expecting "
-                    "only one, remaining partitions will be ignored!"
-                )
-            for tp in partitions:
-                # Get the log_end_offset
-                end_offset_dict = await self.consumers.get(topic).end_offsets([tp])
-                end_offset = end_offset_dict[tp]
+    def start_partition_workers(self, topic: str, partitions: Set[TopicPartition]):
+        """
+        Start one worker per assigned partition. Each worker handles its 
+        partition's messages in offset order, so messages sharing a key 
+        (and therefore a partition) keep their order while partitions are 
+        processed in parallel.
+
+        Args:
+            topic (str): The topic the partitions belong to.
+            partitions (Set[TopicPartition]): The newly assigned partitions.
+        """
+        workers = self.partition_workers.setdefault(topic, {})
+        for tp in partitions:
+            if tp in workers:
+                continue
+            queue = asyncio.Queue(maxsize=settings.kafka_partition_queue_size)
+            task = asyncio.create_task(self.partition_worker(topic, tp, queue))
+            workers[tp] = (queue, task)
+            logger.info(f"Started worker for {tp.topic}[{tp.partition}]")
+
+    async def stop_partition_workers(
+            self, 
+            topic: str, 
+            partitions: Set[TopicPartition], 
+            deadline: float = None
+        ):
+        """
+        Let the workers of revoked partitions finish their queued messages, 
+        commit what they processed and stop them.
 
-                if end_offset == 0:
+        Args:
+            topic (str): The topic the partitions belong to.
+            partitions (Set[TopicPartition]): The revoked partitions.
+            deadline (float): Event loop time by which the queues must be 
+                drained; messages still queued then are not committed and 
+                are redelivered to the next owner of the partition.
+        """
+        workers = self.partition_workers.get(topic, {})
+        for tp in partitions:
+            if tp not in workers:
+                continue
+            queue, task = workers[tp]
+            if not task.done():
+                try:
+                    await asyncio.wait_for(queue.join(), self.time_left(deadline))
+                except asyncio.TimeoutError:
                     logger.warning(
-                        f'Topic ({topic}) has no messages (log_end_offset: '
-                        f'{end_offset}), skipping initialization ...'
+                        f"Worker for {tp.topic}[{tp.partition}] not drained in time, "
+                        f"cancelling it with {queue.qsize()} queued msgs left for redelivery"
                     )
-                    return None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            del workers[tp]
+            logger.info(f"Stopped worker for {tp.topic}[{tp.partition}]")
+        await self.commit_processed(topic, partitions)
+        for tp in partitions:
+            self.processed_offsets.get(topic, {}).pop(tp, None)
+
+    def request_stop(self, topic: str, timeout: float = None):
+        """
+        Ask the consuming loop of a topic to stop once its current batch is 
+        handled and committed. Partition workers then get `timeout` seconds 
+        to finish their queued messages before leaving the group.
+
+        Args:
+            topic (str): The topic to stop consuming.
+            timeout (float): Seconds to drain the partition workers 
+                (defaults to no limit).
+        """
+        if topic not in self.stop_events:
+            return
+        if timeout is not None:
+            self.drain_deadlines[topic] = asyncio.get_running_loop().time() + timeout
+        self.stop_events[topic].set()
 
-                logger.debug(
-                    'Found log_end_offset: '
-                    f'{end_offset} seeking to {end_offset-1}'
+    def stopping(self, topic: str) -> bool:
+        return self.stop_events[topic].is_set()
+
+    @staticmethod
+    def time_left(deadline: float = None):
+        if deadline is None:
+            return None
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+
+    def record_fetch(self, topic: str, batches: dict):
+        """
+        Record message counts, batch size and lag for one fetch.
+
+        Args:
+            topic (str): The topic the batches were fetched from.
+            batches (dict): The getmany result, messages per TopicPartition.
+        """
+        consumer = self.consumers.get(topic)
+        metrics.KAFKA_CONSUMER_BATCH_SIZE.labels(topic).observe(
+            sum(len(msgs) for msgs in batches.values())
+        )
+        for tp, msgs in batches.items():
+            if not msgs:
+                continue
+            metrics.KAFKA_CONSUMER_MESSAGES.labels(topic, tp.partition).inc(len(msgs))
+            highwater = consumer.highwater(tp)
+            if highwater is not None:
+                metrics.KAFKA_CONSUMER_LAG.labels(topic, tp.partition).set(
+                    highwater - (msgs[-1].offset + 1)
+                )
+
+    async def partition_worker(
+            self, 
+            topic: str, 
+            tp: TopicPartition, 
+            queue: asyncio.Queue
+        ):
+        coalesce = (
+            topic == config.KafkaTopic.WRITE_DB 
+            and settings.kafka_write_coalesce_ms > 0
+        )
+        pending = None
+        while True:
+            msg = pending if pending is not None else await queue.get()
+            pending = None
+            msgs = [msg]
+            value = None
+            try:
+                value = codec.decode(msg.value)
+                if coalesce and self.coalescable_schemas(msg, value) is not None:
+                    values = [value]
+                    pending = await self.collect_writes(queue, msgs, values)
+                if len(msgs) > 1:
+                    await self.handle_write_batch(msgs, values)
+                else:
+                    await self.handle_message(msg, value)
+            except Exception as e:
+                await self.handle_failure(msg, value, e)
+            finally:
+                for _ in msgs:
+                    queue.task_done()
+            self.processed_offsets[topic][tp] = msgs[-1].offset + 1
+
+    def coalescable_schemas(self, msg, value) -> Optional[str]:
+        """
+        The schema of a write_db message that can be merged with its 
+        neighbours, or None if it must be handled on its own: other actions, 
+        writes a caller waits the reply of, and malformed messages, whose 
+        failure then stays their own. Never raises.
+        """
+        if not isinstance(value, dict) or value.get("action") != config.KafkaAction.WRITE_DB:
+            return None
+        data = value.get("data")
+        if not isinstance(data, dict) or not isinstance(data.get("schemas"), str):
+            return None
+        if rpc.get_header(msg, rpc.REPLY_TO_HEADER) is not None:
+            return None
+        return data["schemas"]
+
+    async def collect_writes(self, queue: asyncio.Queue, msgs: list, values: list):
+        """
+        Take the write_db messages that follow the first one in the 
+        partition queue, for the same schema, until the coalescing window 
+        closes or enough messages are collected. The first message that 
+        cannot join the batch, including one that fails to decode, ends it 
+        and is handed back so it is handled, and fails, on its own.
+
+        Args:
+            queue (asyncio.Queue): The partition queue.
+            msgs (list): The collected messages, starting with the first one.
+            values (list): Their decoded values.
+
+        Returns:
+            The message that ended the run, to be handled next, or None.
+        """
+        schemas = self.coalescable_schemas(msgs[0], values[0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.kafka_write_coalesce_ms / 1000
+        while len(msgs) < settings.kafka_write_coalesce_max_messages:
+            timeout = deadline - loop.time()
+            try:
+                if timeout > 0:
+                    msg = await asyncio.wait_for(queue.get(), timeout)
+                else:
+                    msg = queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                return None
+            try:
+                value = codec.decode(msg.value)
+            except Exception:
+                return msg
+            if self.coalescable_schemas(msg, value) != schemas:
+                return msg
+            msgs.append(msg)
+            values.append(value)
+        return None
+
+    async def handle_write_batch(self, msgs: list, values: list):
+        """
+        Write the rows of several write_db messages for one schema with a 
+        single executemany insert. If the batch fails, the messages are 
+        handled one by one so a bad row only fails its own message.
+
+        Args:
+            msgs (list): The write_db messages.
+            values (list): Their decoded values.
+        """
+        schemas = values[0]["data"]["schemas"]
+        rows = []
+        idempotency_keys = []
+        for value in values:
+            data = {key: item for key, item in value["data"].items() if key != "schemas"}
+            message_rows = data["rows"] if "rows" in data else [data]
+            rows.extend(message_rows)
+            idempotency_keys.extend([value.get("idempotency_key")] * len(message_rows))
+        logger.info(f"Coalesced {len(msgs)} write_db msgs into {len(rows)} rows for {schemas}")
+        try:
+            with metrics.KAFKA_CONSUMER_HANDLER_SECONDS.labels(msgs[0].topic, "write_db_batch").time():
+                await actions.write_db(
+                    rows, 
+                    schemas, 
+                    refresh=False, 
+                    idempotency_keys=idempotency_keys, 
+                    max_retries=settings.kafka_handler_db_retries
                 )
-                self.consumers.get(topic).seek(tp, end_offset-1)
-                msg = await self.consumers.get(topic).getone()
-                logger.info(f'Initializing API with data from msg: {msg}')
+            return
         except Exception as e:
-            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
-            raise KeyError(f"Error starting Kafka consumer for topic '{topic}'")
+            logger.error(
+                f'Coalesced write of {len(rows)} rows to {schemas} failed, '
+                f'retrying message by message: {e}'
+            )
+        await self.handle_one_by_one(msgs, values)
+
+    async def handle_one_by_one(self, msgs: list, values: list):
+        """Handle messages individually, handing each failure to the retry scheduler"""
+        for msg, value in zip(msgs, values):
+            try:
+                await self.handle_message(msg, value)
+            except Exception as e:
+                await self.handle_failure(msg, value, e)
+
+    async def handle_failure(self, msg, value: dict, error: Exception):
+        """
+        Record a message whose handler failed and pass it to the retry 
+        scheduler, which sends it to the retry or the dead-letter topic. 
+        Keyed write/update/delete messages are first retried in place, so 
+        the later messages of their key are not applied before them. The 
+        caller then moves on to the next message.
+
+        Args:
+            msg: The failed message.
+            value (dict): The decoded message, or None if it could not be decoded.
+            error (Exception): The error the handler raised.
+        """
+        metrics.KAFKA_CONSUMER_HANDLER_ERRORS.labels(msg.topic).inc()
+        logger.error(
+            f'Failed to handle msg at {msg.topic}[{msg.partition}] '
+            f'offset {msg.offset}: {error}', 
+            exc_info=(type(error), error, error.__traceback__)
+        )
+        if value is not None:
+            """dispatch consumes the data of the value, retry and dead-letter topics get the message as sent"""
+            value = codec.decode(msg.value)
+        retries = None
+        if retry_scheduler.retries_in_place(msg, value, error):
+            error, retries = await self.retry_in_place(msg, error)
+            if error is None:
+                return
+        await retry_scheduler.schedule(msg, value, error, retries)
+
+    async def retry_in_place(self, msg, error: Exception):
+        """
+        Handle a failed message again with the scheduler's backoff until it 
+        succeeds, fails with a non-transient error or runs out of attempts. 
+        The partition waits meanwhile; a message cut short by shutdown is 
+        not committed and is redelivered.
+
+        Returns:
+            The last error, or None once handled, and the retries made.
+        """
+        for attempt in range(1, retry_scheduler.max_attempts + 1):
+            delay = retry_scheduler.backoff(attempt)
+            metrics.KAFKA_MESSAGES_RETRIED.labels(msg.topic).inc()
+            logger.warning(
+                f'Retrying msg at {msg.topic}[{msg.partition}] offset {msg.offset} in place, '
+                f'attempt {attempt}/{retry_scheduler.max_attempts} in {delay:.1f}s: {error}'
+            )
+            await asyncio.sleep(delay)
+            try:
+                """Decoded again, dispatch consumes the data of the value"""
+                await self.handle_message(msg)
+                return None, attempt
+            except Exception as e:
+                error = e
+                if not is_transient(e):
+                    return error, attempt
+        return error, retry_scheduler.max_attempts
+
+    async def commit_processed(self, topic: str, partitions: Set[TopicPartition] = None):
+        """
+        Commit the offsets the partition workers have finished with.
+
+        Args:
+            topic (str): The topic to commit offsets for.
+            partitions (Set[TopicPartition]): Only commit these partitions 
+                (defaults to every partition with processed messages).
+        """
+        processed = self.processed_offsets.get(topic, {})
+        offsets = {
+            tp: offset for tp, offset in processed.items()
+            if partitions is None or tp in partitions
+        }
+        if not offsets:
+            return
+        try:
+            await self.consumers.get(topic).commit(offsets)
+        except Exception as e:
+            logger.error(
+                f'Failed to commit offsets for topic {topic}: {e}', 
+                exc_info=sys.exc_info()
+            )
+
+    async def commit_batch(self, topic: str, offsets: dict = None):
+        """
+        Commit what a batch consumer has handled. aiokafka refuses the 
+        commit when the group rebalanced during the batch (another process 
+        joined or left); the batch is then redelivered to the new owner of 
+        its partitions, where inserts ignore the rows already written, and 
+        the consumer carries on instead of dying.
+
+        Args:
+            topic (str): The topic of the consumer.
+            offsets (dict): The offsets to commit, the consumed position when None.
+        """
+        try:
+            await self.consumers.get(topic).commit(offsets)
+        except (CommitFailedError, IllegalStateError) as e:
+            logger.warning(
+                f'Offsets of topic {topic} not committed after a rebalance, '
+                f'the batch will be redelivered: {e}'
+            )
+
+    async def handle_message(self, msg, value: dict = None):
+        if value is None:
+            value = codec.decode(msg.value)
+        action = value.get("action")
+        data = value.get("data")
+        logger.info(f"Consumed BG msg: {msg}")
+
+        reply_to = rpc.get_header(msg, rpc.REPLY_TO_HEADER)
+        try:
+            with metrics.KAFKA_CONSUMER_HANDLER_SECONDS.labels(msg.topic, str(action)).time():
+                result = await self.dispatch(
+                    action, 
+                    data, 
+                    value.get("idempotency_key"), 
+                    reply=reply_to is not None
+                )
+            if reply_to is not None:
+                result = rpc.serialize_result(result)
+        except Exception as e:
+            if reply_to is not None:
+                await self.send_reply(msg, reply_to, {
+                    "status": "error",
+                    "status_code": getattr(e, "status_code", status.HTTP_500_INTERNAL_SERVER_ERROR),
+                    "detail": getattr(e, "detail", "Internal server error")
+                })
+            raise
+        if reply_to is not None:
+            await self.send_reply(msg, reply_to, {
+                "status": "ok",
+                "result": result
+            })
+
+    async def send_reply(self, msg, reply_to: str, value: dict):
+        """
+        Send the outcome of a request message to its reply topic, tagged 
+        with the request's correlation id.
+
+        Args:
+            msg: The request message.
+            reply_to (str): The reply topic named in the request headers.
+            value (dict): The reply envelope.
+        """
+        correlation_id = rpc.get_header(msg, rpc.CORRELATION_ID_HEADER)
+        await producer_manager.send(
+            topic=reply_to,
+            value=value,
+            headers=[(rpc.CORRELATION_ID_HEADER, correlation_id.encode('utf-8'))]
+        )
+
+    async def dispatch(
+            self, 
+            action: str, 
+            data: dict, 
+            idempotency_key: str = None, 
+            reply: bool = False
+        ):
+        """
+        Run the DB action of a message.
+
+        Args:
+            action (str): The config.KafkaAction of the message.
+            data (dict): The message data.
+            idempotency_key (str): The idempotency key of write_db messages.
+            reply (bool): Whether a caller waits for the result; written 
+                rows are only reloaded for it.
+
+        Returns:
+            The result of the action.
+        """
+        match action:
+            case config.KafkaAction.SAVE_REQUEST_TO_DB:
+                await actions.save_request_to_db(
+                    data, max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.SAVE_RESPONSE_TO_DB:
+                await actions.save_response_to_db(
+                    data, max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.SAVE_EXCHANGE_TO_DB:
+                await actions.save_exchanges_to_db(
+                    [data], max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.WRITE_DB:
+                schemas = data.pop("schemas")
+                rows = data.pop("rows", data)
+                return await actions.write_db(
+                    rows, 
+                    schemas, 
+                    refresh=reply, 
+                    idempotency_keys=[idempotency_key] * (len(rows) if isinstance(rows, list) else 1), 
+                    max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.UPDATE_DB:
+                schemas = data.get("schemas")
+                data.pop("schemas")
+                update_data = data.get("update_data")
+                data.pop("update_data")
+                filters = data.get("filters")
+                data.pop("filters")
+                await actions.update_db(
+                    schemas, 
+                    update_data, 
+                    filters, 
+                    max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.DELETE_DB:
+                schemas = data.get("schemas")
+                filters = data.get("filters")
+                return await actions.delete_db(
+                    schemas=schemas, 
+                    filters=filters, 
+                    chunk_size=data.get("chunk_size"),
+                    max_retries=settings.kafka_handler_db_retries
+                )
+            case config.KafkaAction.READ_DB:
+                schemas = data.get("schemas", None)
+                operation = data.get("operation", None)
+                columns = data.get("columns", None)
+                filters = data.get("filters", None)
+                return await actions.read_db(
+                    schemas=schemas, 
+                    operation=operation, 
+                    columns=columns, 
+                    filters=filters, 
+                    order_by=data.get("order_by", None), 
+                    limit=data.get("limit", None), 
+                    after=data.get("after", None), 
+                    max_retries=settings.kafka_handler_db_retries
+                )
+            case _:
+                logger.error(f'Does not support action "{action}"')
+                raise KeyError(
+                    f'Does not support action "{action}"'
+                )
 
     async def bg_consume(self, topic):
+        """
+        Fetch messages for every assigned partition and hand them to that 
+        partition's worker; processed offsets are committed after each fetch.
+
+        Args:
+            topic (str): The topic to consume.
+        """
         await self.start_bg_consumer(topic)
         consumer = self.consumers.get(topic)
         try:
             if consumer:
-                 # Consume messages
-                async for msg in consumer:
-                    action = json.loads(msg.value).get("action")
-                    data = json.loads(msg.value).get("data")
-                    logger.info(f"Consumed BG msg: {msg}")
-
-                    match action:
-                        case config.KafkaAction.SAVE_REQUEST_TO_DB:
-                            await actions.save_request_to_db(data)
-                        case config.KafkaAction.SAVE_RESPONSE_TO_DB:
-                            await actions.save_response_to_db(data)
-                        case config.KafkaAction.WRITE_DB:
-                            schemas = data.get("schemas")
-                            data.pop("schemas")
-                            await actions.write_db(data, schemas)
-                        case config.KafkaAction.UPDATE_DB:
-                            schemas = data.get("schemas")
-                            data.pop("schemas")
-                            update_data = data.get("update_data")
-                            data.pop("update_data")
-                            filters = data.get("filters")
-                            data.pop("filters")
-                            await actions.update_db(
-                                schemas, update_data, filters
-                            )
-                        case _:
-                            logger.error(
-                                f'Does not support action "{e}"', 
-                                exc_info=sys.exc_info()
-                            )
-                            raise KeyError(
-                                f'Does not support action "{e}"'
-                            )
+                while not self.stopping(topic):
+                    batches = await consumer.getmany(timeout_ms=1000)
+                    if batches:
+                        self.record_fetch(topic, batches)
+                    for tp, msgs in batches.items():
+                        for msg in msgs:
+                            worker = self.partition_workers[topic].get(tp)
+                            if worker is None:
+                                # Partition was revoked mid-batch, the new owner re-reads it
+                                break
+                            await worker[0].put(msg)
+                    await self.commit_processed(topic)
             else:
                 raise KeyError(f"Consumer for topic '{topic}' not found")
         except Exception as e:
@@ -121,9 +592,14 @@ class KafkaConsumeManager:
                 f"Error while consuming messages for topic '{topic}'"
             )
         finally:
-            # Leave consumer group; perform autocommit if enabled
+            # Drain the partition workers and commit before leaving the group
             logger.warning('Stopping consumer')
             try:
+                await self.stop_partition_workers(
+                    topic, 
+                    set(self.partition_workers.get(topic, {})), 
+                    self.drain_deadlines.get(topic)
+                )
                 await self.stop_consumer(topic)
             except Exception as e:
                 logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
@@ -131,74 +607,112 @@ class KafkaConsumeManager:
                     f"Error while stopping Kafka consumer for topic '{topic}'"
                 )
 
-    async def create_ot_consumer(self, topic: str, group_id: str = "default"):
+    async def create_batch_consumer(self, topic: str, group_id: str = "default"):
         try:
             logger.debug(
-                'Initializing KafkaConsumer '
+                'Initializing batch KafkaConsumer '
                 f'for topic {topic}, group_id {group_id} '
                 f'and using bootstrap servers {self.bootstrap_servers}'
             )
-
-            consumer = aiokafka.AIOKafkaConsumer(
-                topic,
+            consumer = transport.create_consumer(
+                topic, 
                 loop=self.loop,
                 bootstrap_servers=self.bootstrap_servers,
-                group_id=group_id,  # unique identifier for each sidecar
-                enable_auto_commit=True,
-                auto_commit_interval_ms=1000,  # commit every second
-                auto_offset_reset="earliest",  # If committed offset not found, start from beginning
-                max_poll_records=1
+                group_id=group_id,
+                enable_auto_commit=False,  # offsets are committed after each batch is written
+                auto_offset_reset="earliest"
             )
             
             self.consumers[topic] = consumer
+            self.stop_events[topic] = asyncio.Event()
+            self.drain_deadlines.pop(topic, None)
         except Exception as e:
             logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
             raise KeyError(f"Error creating Kafka consumer for topic '{topic}'")
-        
-    async def start_ot_consumer(self, topic):
-        try:
-            # Get cluster layout and join group
-            await self.consumers.get(topic).start()
-        except Exception as e:
-            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
-            raise KeyError(f"Error starting Kafka consumer for topic '{topic}'")
 
-    async def ot_consume(self, topic):
+    async def bg_consume_batch(
+            self, 
+            topic: str, 
+            max_records: int = 500, 
+            timeout_ms: int = 1000
+        ):
+        """
+        Consume messages in batches and write each batch with a single 
+        multi-row insert. Offsets are committed only once the batch is 
+        written; if the batch fails its messages are written one by one, 
+        and those that still fail go to the retry scheduler.
+
+        Args:
+            topic (str): The topic to consume.
+            max_records (int): The maximum number of messages per batch.
+            timeout_ms (int): The maximum time to wait for a batch to fill.
+        """
+        await self.start_consumer(topic)
         consumer = self.consumers.get(topic)
         try:
-            msg = await consumer.getone()
-            if msg:
-                action = json.loads(msg.value).get("action")
-                data = json.loads(msg.value).get("data")
-                logger.info(f"Consumed OT msg: {msg}")
-
-                match action:
-                    case config.KafkaAction.DELETE_DB:
-                        schemas = data.get("schemas")
-                        filters = data.get("filters")
-                        result = await actions.delete_db(
-                            schemas=schemas, 
-                            filters=filters
-                        )
-                    case config.KafkaAction.READ_DB:
-                        schemas = data.get("schemas", None)
-                        operation = data.get("operation", None)
-                        columns = data.get("columns", None)
-                        filters = data.get("filters", None)
-                        result = await actions.read_db(
-                            schemas=schemas, 
-                            operation=operation, 
-                            columns=columns, 
-                            filters=filters
-                        )
-                    case _:
+            if consumer:
+                while not self.stopping(topic):
+                    batches = await consumer.getmany(
+                        timeout_ms=timeout_ms, 
+                        max_records=max_records
+                    )
+                    if not batches:
+                        continue
+                    self.record_fetch(topic, batches)
+
+                    requests, responses, exchanges = [], [], []
+                    decoded = []
+                    for tp, msgs in batches.items():
+                        for msg in msgs:
+                            try:
+                                value = codec.decode(msg.value)
+                            except Exception as e:
+                                await self.handle_failure(msg, None, e)
+                                continue
+                            action = value.get("action")
+                            data = value.get("data")
+                            match action:
+                                case config.KafkaAction.SAVE_REQUEST_TO_DB:
+                                    requests.append(data)
+                                case config.KafkaAction.SAVE_RESPONSE_TO_DB:
+                                    responses.append(data)
+                                case config.KafkaAction.SAVE_EXCHANGE_TO_DB:
+                                    exchanges.append(data)
+                                case _:
+                                    await self.handle_failure(msg, value, KeyError(
+                                        f'Does not support action "{action}" '
+                                        f'in batch consumer for topic {topic}'
+                                    ))
+                                    continue
+                            decoded.append((msg, value))
+                    logger.info(
+                        f"Consumed BG batch of {len(requests) + len(responses) + len(exchanges)} "
+                        f"msgs from topic {topic}"
+                    )
+
+                    try:
+                        with metrics.KAFKA_CONSUMER_HANDLER_SECONDS.labels(topic, "batch").time():
+                            await actions.save_requests_to_db(
+                                requests, max_retries=settings.kafka_handler_db_retries
+                            )
+                            await actions.save_responses_to_db(
+                                responses, max_retries=settings.kafka_handler_db_retries
+                            )
+                            await actions.save_exchanges_to_db(
+                                exchanges, max_retries=settings.kafka_handler_db_retries
+                            )
+                    except Exception as e:
                         logger.error(
-                            f'Does not support action "{e}"', 
-                            exc_info=sys.exc_info()
+                            f'Failed to write batch for topic {topic}, '
+                            f'writing message by message: {e}'
                         )
-                        raise KeyError(
-                            f'Does not support action "{e}"'
+                        """Inserts ignore rows that are already stored, so rewriting the ones that made it is safe"""
+                        await self.handle_one_by_one(
+                            [msg for msg, _ in decoded], 
+                            [value for _, value in decoded]
                         )
+
+                    await self.commit_batch(topic)
             else:
                 raise KeyError(f"Consumer for topic '{topic}' not found")
         except Exception as e:
@@ -206,8 +720,90 @@ class KafkaConsumeManager:
             raise KeyError(
                 f"Error while consuming messages for topic '{topic}'"
             )
-        return result
-    
+        finally:
+            # Leave consumer group; uncommitted batches are redelivered
+            logger.warning('Stopping consumer')
+            try:
+                await self.stop_consumer(topic)
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+                raise KeyError(
+                    f"Error while stopping Kafka consumer for topic '{topic}'"
+                )
+
+    async def bg_consume_retries(self, topic: str, timeout_ms: int = 1000):
+        """
+        Consume the delayed-retry topic and send each message back to its 
+        original topic once its backoff has passed. Partitions are handled 
+        concurrently, messages within a partition in order. When asked to 
+        stop, the messages still waiting for their backoff are left 
+        uncommitted and the ones already sent back are committed, so none 
+        is sent twice or lost.
+
+        Args:
+            topic (str): The retry topic.
+            timeout_ms (int): The maximum time to wait for messages.
+        """
+        await self.start_consumer(topic)
+        consumer = self.consumers.get(topic)
+        stop = self.stop_events[topic]
+        republished = {}
+
+        async def republish(tp, msgs):
+            for msg in msgs:
+                try:
+                    await retry_scheduler.republish(msg, codec.decode(msg.value))
+                except Exception as e:
+                    logger.error(
+                        f'Failed to republish retry msg at {msg.topic}[{msg.partition}] '
+                        f'offset {msg.offset}, it is lost: {e}', 
+                        exc_info=sys.exc_info()
+                    )
+                republished[tp] = msg.offset + 1
+
+        try:
+            if consumer:
+                while not stop.is_set():
+                    batches = await consumer.getmany(timeout_ms=timeout_ms)
+                    if not batches:
+                        continue
+                    self.record_fetch(topic, batches)
+                    republishing = asyncio.gather(*[republish(tp, msgs) for tp, msgs in batches.items()])
+                    stopped = asyncio.create_task(stop.wait())
+                    await asyncio.wait([republishing, stopped], return_when=asyncio.FIRST_COMPLETED)
+                    stopped.cancel()
+                    if not republishing.done():
+                        """Stopping: the messages still waiting are re-read on the next start"""
+                        republishing.cancel()
+                        await asyncio.gather(republishing, return_exceptions=True)
+                    if republished:
+                        await self.commit_batch(topic, dict(republished))
+                        republished.clear()
+            else:
+                raise KeyError(f"Consumer for topic '{topic}' not found")
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            raise KeyError(
+                f"Error while consuming messages for topic '{topic}'"
+            )
+        finally:
+            logger.warning('Stopping consumer')
+            try:
+                await self.stop_consumer(topic)
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+                raise KeyError(
+                    f"Error while stopping Kafka consumer for topic '{topic}'"
+                )
+
+    async def start_consumer(self, topic):
+        try:
+            # Get cluster layout and join group
+            await self.consumers.get(topic).start()
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            raise KeyError(f"Error starting Kafka consumer for topic '{topic}'")
+
     async def stop_consumer(self, topic):
         try:
             await self.consumers.get(topic).stop()
@@ -0,0 +1,329 @@
+import asyncio, time, zlib, itertools
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+from aiokafka.structs import TopicPartition
+from aiokafka.errors import ConsumerStoppedError
+
+
+@dataclass
+class InMemoryRecord:
+    """Mirrors the fields of aiokafka's ConsumerRecord that the app reads."""
+    topic: str
+    partition: int
+    offset: int
+    timestamp: int
+    key: bytes
+    value: bytes
+    headers: list = field(default_factory=list)
+
+
+@dataclass
+class InMemoryRecordMetadata:
+    topic: str
+    partition: int
+    offset: int
+    timestamp: int
+
+
+class InMemoryGroup:
+    """
+    A consumer group: its members, their partition assignment and the
+    committed offsets. Partitions are spread round-robin over the members
+    subscribed to each topic, and reassigned whenever a member joins or leaves.
+    """
+    def __init__(self, broker, group_id: str):
+        self.broker = broker
+        self.group_id = group_id
+        self.members = []
+        self.committed: Dict[TopicPartition, int] = {}
+        self.lock = asyncio.Lock()
+
+    async def join(self, consumer):
+        async with self.lock:
+            self.members.append(consumer)
+            await self.rebalance()
+
+    async def leave(self, consumer):
+        async with self.lock:
+            if consumer in self.members:
+                self.members.remove(consumer)
+                await consumer._revoke(consumer.assignment(), notify=False)
+            await self.rebalance()
+
+    async def rebalance(self):
+        target = {member: set() for member in self.members}
+        topics = sorted({topic for member in self.members for topic in member.topics})
+        for topic in topics:
+            subscribed = [member for member in self.members if topic in member.topics]
+            for tp in self.broker.partitions_for(topic):
+                target[subscribed[tp.partition % len(subscribed)]].add(tp)
+        for member in self.members:
+            await member._revoke(member.assignment() - target[member])
+        for member in self.members:
+            await member._assign(target[member] - member.assignment())
+
+
+class InMemoryBroker:
+    """
+    An asyncio, in-process stand-in for a Kafka cluster: topics with
+    partitions, keyed partitioning, consumer groups and committed offsets.
+    Topics are created on first use, like a broker with auto-create enabled.
+    """
+    def __init__(self, partitions: int = 1):
+        self.default_partitions = partitions
+        self.topics: Dict[str, List[List[InMemoryRecord]]] = {}
+        self.groups: Dict[str, InMemoryGroup] = {}
+        self.round_robin = itertools.count()
+        self.new_data = asyncio.Event()
+
+    def create_topic(self, topic: str, partitions: int = None):
+        if topic not in self.topics:
+            self.topics[topic] = [[] for _ in range(partitions or self.default_partitions)]
+
+    def partitions_for(self, topic: str) -> List[TopicPartition]:
+        self.create_topic(topic)
+        return [TopicPartition(topic, p) for p in range(len(self.topics[topic]))]
+
+    def group(self, group_id: str) -> InMemoryGroup:
+        if group_id not in self.groups:
+            self.groups[group_id] = InMemoryGroup(self, group_id)
+        return self.groups[group_id]
+
+    def highwater(self, tp: TopicPartition) -> int:
+        self.create_topic(tp.topic)
+        return len(self.topics[tp.topic][tp.partition])
+
+    def append(
+            self,
+            topic: str,
+            key: bytes,
+            value: bytes,
+            headers: list = None,
+            partition: int = None
+        ) -> InMemoryRecord:
+        self.create_topic(topic)
+        partitions = self.topics[topic]
+        if partition is None:
+            if key is not None:
+                partition = zlib.crc32(key) % len(partitions)
+            else:
+                partition = next(self.round_robin) % len(partitions)
+        log = partitions[partition]
+        record = InMemoryRecord(
+            topic=topic,
+            partition=partition,
+            offset=len(log),
+            timestamp=int(time.time() * 1000),
+            key=key,
+            value=value,
+            headers=list(headers or [])
+        )
+        log.append(record)
+        """Wake up consumers waiting for data"""
+        self.new_data.set()
+        self.new_data = asyncio.Event()
+        return record
+
+    def read(self, tp: TopicPartition, offset: int, max_records: int) -> List[InMemoryRecord]:
+        return self.topics[tp.topic][tp.partition][offset:offset + max_records]
+
+
+class InMemoryProducer:
+    """Accepts the AIOKafkaProducer arguments the app uses; others are ignored."""
+    def __init__(
+            self,
+            broker: InMemoryBroker,
+            value_serializer=None,
+            key_serializer=None,
+            **kwargs
+        ):
+        self.broker = broker
+        self.value_serializer = value_serializer
+        self.key_serializer = key_serializer
+
+    async def start(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(
+            self,
+            topic: str,
+            value=None,
+            key=None,
+            partition: int = None,
+            timestamp_ms: int = None,
+            headers: list = None
+        ) -> asyncio.Future:
+        if self.value_serializer is not None:
+            value = self.value_serializer(value)
+        if self.key_serializer is not None:
+            key = self.key_serializer(key)
+        record = self.broker.append(topic, key, value, headers, partition)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(InMemoryRecordMetadata(
+            record.topic, record.partition, record.offset, record.timestamp
+        ))
+        return future
+
+    async def send_and_wait(self, topic: str, value=None, key=None, partition: int = None,
+                            timestamp_ms: int = None, headers: list = None):
+        future = await self.send(topic, value, key, partition, timestamp_ms, headers)
+        return await future
+
+
+class InMemoryConsumer:
+    """Accepts the AIOKafkaConsumer arguments the app uses; others are ignored."""
+    def __init__(
+            self,
+            *topics,
+            broker: InMemoryBroker,
+            group_id: str = None,
+            enable_auto_commit: bool = True,
+            auto_offset_reset: str = "latest",
+            max_poll_records: int = None,
+            **kwargs
+        ):
+        self.broker = broker
+        self.group_id = group_id
+        self.enable_auto_commit = enable_auto_commit
+        self.auto_offset_reset = auto_offset_reset
+        self.max_poll_records = max_poll_records or 500
+        self.topics: Set[str] = set(topics)
+        self.listener = None
+        self.positions: Dict[TopicPartition, int] = {}
+        self.group = None
+        self.started = False
+        self.stopped = False
+
+    def subscribe(self, topics=(), pattern=None, listener=None):
+        self.topics = set(topics)
+        self.listener = listener
+
+    async def start(self):
+        if self.started:
+            return
+        self.started = True
+        if self.group_id is not None:
+            self.group = self.broker.group(self.group_id)
+            await self.group.join(self)
+        else:
+            partitions = set()
+            for topic in self.topics:
+                partitions.update(self.broker.partitions_for(topic))
+            await self._assign(partitions)
+
+    async def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.group is not None:
+            await self.group.leave(self)
+
+    def assignment(self) -> Set[TopicPartition]:
+        return set(self.positions)
+
+    async def _assign(self, partitions: Set[TopicPartition]):
+        if not partitions:
+            return
+        for tp in partitions:
+            committed = self.group.committed.get(tp) if self.group else None
+            if committed is not None:
+                self.positions[tp] = committed
+            elif self.auto_offset_reset == "earliest":
+                self.positions[tp] = 0
+            else:
+                self.positions[tp] = self.broker.highwater(tp)
+        if self.listener is not None:
+            await self.listener.on_partitions_assigned(set(partitions))
+
+    async def _revoke(self, partitions: Set[TopicPartition], notify: bool = True):
+        if not partitions:
+            return
+        if notify and self.listener is not None:
+            await self.listener.on_partitions_revoked(set(partitions))
+        if self.enable_auto_commit:
+            await self.commit({tp: self.positions[tp] for tp in partitions if tp in self.positions})
+        for tp in partitions:
+            self.positions.pop(tp, None)
+
+    async def getmany(self, *partitions, timeout_ms: int = 0, max_records: int = None):
+        if self.stopped:
+            raise ConsumerStoppedError()
+        max_records = max_records or self.max_poll_records
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            result = {}
+            remaining = max_records
+            for tp in list(partitions or self.positions):
+                if remaining <= 0:
+                    break
+                records = self.broker.read(tp, self.positions[tp], remaining)
+                if records:
+                    result[tp] = records
+                    self.positions[tp] += len(records)
+                    remaining -= len(records)
+            if result:
+                if self.enable_auto_commit:
+                    await self.commit()
+                return result
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return {}
+            try:
+                await asyncio.wait_for(self.broker.new_data.wait(), timeout)
+            except asyncio.TimeoutError:
+                return {}
+            if self.stopped:
+                raise ConsumerStoppedError()
+
+    async def getone(self, *partitions):
+        while True:
+            result = await self.getmany(*partitions, timeout_ms=1000, max_records=1)
+            for records in result.values():
+                return records[0]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.getone()
+        except ConsumerStoppedError:
+            raise StopAsyncIteration
+
+    async def commit(self, offsets: Dict[TopicPartition, int] = None):
+        if self.group is None:
+            return
+        if offsets is None:
+            offsets = dict(self.positions)
+        self.group.committed.update(offsets)
+
+    async def committed(self, tp: TopicPartition):
+        return self.group.committed.get(tp) if self.group else None
+
+    def seek(self, tp: TopicPartition, offset: int):
+        self.positions[tp] = offset
+
+    async def seek_to_end(self, *partitions):
+        for tp in partitions or list(self.positions):
+            self.positions[tp] = self.broker.highwater(tp)
+        return True
+
+    async def seek_to_beginning(self, *partitions):
+        for tp in partitions or list(self.positions):
+            self.positions[tp] = 0
+        return True
+
+    async def position(self, tp: TopicPartition) -> int:
+        return self.positions[tp]
+
+    def highwater(self, tp: TopicPartition) -> int:
+        return self.broker.highwater(tp)
+
+    async def end_offsets(self, partitions):
+        return {tp: self.broker.highwater(tp) for tp in partitions}
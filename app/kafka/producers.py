@@ -1,5 +1,4 @@
-from aiokafka import AIOKafkaProducer
-import sys, asyncio, json
+import sys, asyncio, time
 import os
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -9,36 +8,294 @@ sys.path.append(app_dir)
 
 from app.config import settings
 from app.logger import logger
+from app.kafka import config
+from app.kafka.codec import codec
+from app.kafka import transport
+from app import metrics, timing
+from typing import List, Tuple
 
 
 class KafkaProducerManager:
-    def __init__(self, loop, bootstrap_servers):
+    def __init__(
+            self, 
+            loop, 
+            bootstrap_servers, 
+            linger_ms: int = 0, 
+            max_batch_size: int = 16384
+        ):
         self.loop = loop
         self.bootstrap_servers = bootstrap_servers
-        self.producers = {}
-
-    async def send(self, topic: str, value: dict):
-        producer = AIOKafkaProducer(
-            loop=self.loop,
-            bootstrap_servers=self.bootstrap_servers,
-            value_serializer=lambda x: json.dumps(x).encode('utf-8')
-        )
-        # get cluster layout and initial topic/partition leadership information
-        await producer.start()
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self.producer = None
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        """
+        Create and start the shared producer used by every send.
+
+        Raises:
+            KeyError: If the producer could not connect to the cluster.
+        """
+        async with self._start_lock:
+            if self.producer is not None:
+                return
+            try:
+                logger.debug(
+                    'Initializing KafkaProducer '
+                    f'using bootstrap servers {self.bootstrap_servers}'
+                )
+                producer = transport.create_producer(
+                    loop=self.loop,
+                    bootstrap_servers=self.bootstrap_servers,
+                    value_serializer=codec.encode,
+                    key_serializer=lambda x: str(x).encode('utf-8') if x is not None else None,
+                    linger_ms=self.linger_ms,
+                    max_batch_size=self.max_batch_size
+                )
+                # get cluster layout and initial topic/partition leadership information
+                await producer.start()
+                self.producer = producer
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+                raise KeyError("Error starting Kafka producer")
+
+    async def send(self, topic: str, value: dict, key: str = None, headers: list = None):
+        if self.producer is None:
+            await self.start()
         try:
-            # produce message
+            # produce message; messages with the same key go to the same partition
             logger.info(f'Sending message with value: {value}')
-            await producer.send_and_wait(topic, value)
+            start = time.perf_counter()
+            with timing.stage("kafka_send"):
+                await self.producer.send_and_wait(topic, value, key=key, headers=headers)
+            metrics.KAFKA_PRODUCER_SEND_SECONDS.labels(topic).observe(
+                time.perf_counter() - start
+            )
         except Exception as e:
+            metrics.KAFKA_PRODUCER_SEND_ERRORS.labels(topic).inc()
             logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
             raise KeyError(f"failed to send message with value: {value}")
-        finally:
+
+    async def send_batch(self, messages: List[Tuple[str, dict, str]]):
+        """
+        Send several messages and wait for all of them at once, so they can
+        share producer batches instead of waiting for one ack per message.
+
+        Args:
+            messages (List[Tuple[str, dict, str]]): (topic, value, key) tuples to send.
+
+        Returns:
+            int: The number of messages that failed to be delivered.
+        """
+        if self.producer is None:
+            await self.start()
+        futures = []
+        failed = 0
+        for topic, value, key in messages:
+            try:
+                start = time.perf_counter()
+                future = await self.producer.send(topic, value, key=key)
+                future.add_done_callback(
+                    lambda f, topic=topic, start=start: self._observe_send(f, topic, start)
+                )
+                futures.append(future)
+            except Exception as e:
+                metrics.KAFKA_PRODUCER_SEND_ERRORS.labels(topic).inc()
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+                failed += 1
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f'Failed to deliver message: {result}')
+                failed += 1
+        return failed
+
+    @staticmethod
+    def _observe_send(future: asyncio.Future, topic: str, start: float):
+        if future.cancelled() or future.exception() is not None:
+            metrics.KAFKA_PRODUCER_SEND_ERRORS.labels(topic).inc()
+        else:
+            metrics.KAFKA_PRODUCER_SEND_SECONDS.labels(topic).observe(
+                time.perf_counter() - start
+            )
+
+    async def flush(self):
+        """Wait for the messages sent so far to be delivered, keeping the producer open"""
+        if self.producer is None:
+            return
+        try:
+            await self.producer.flush()
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+
+    async def stop(self):
+        """
+        Flush pending messages and stop the shared producer.
+
+        Raises:
+            KeyError: If the producer could not be flushed or stopped.
+        """
+        if self.producer is None:
+            return
+        producer = self.producer
+        self.producer = None
+        try:
             # wait for all pending messages to be delivered or expire.
+            await producer.flush()
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+        try:
             await producer.stop()
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            raise KeyError("Error stopping Kafka producer")
+
+class KafkaSendQueue:
+    """
+    Bounded in-process queue in front of a KafkaProducerManager.
+
+    Callers enqueue messages and return immediately; a background task drains
+    the queue and hands the messages to the producer in batches.
+    """
+    def __init__(
+            self, 
+            producer_manager: KafkaProducerManager, 
+            maxsize: int = 10000, 
+            overflow: str = config.QueueOverflowPolicy.DROP_OLDEST,
+            batch_size: int = 500
+        ):
+        if overflow not in (
+            config.QueueOverflowPolicy.DROP_OLDEST,
+            config.QueueOverflowPolicy.DROP_NEW,
+            config.QueueOverflowPolicy.BLOCK
+        ):
+            raise ValueError(f"Unsupported overflow policy: {overflow}")
+        self.producer_manager = producer_manager
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.task = None
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped_oldest = 0
+        self.dropped_new = 0
+
+    @property
+    def dropped(self) -> int:
+        return self.dropped_oldest + self.dropped_new
+
+    async def put(self, topic: str, value: dict, key: str = None):
+        """
+        Enqueue a message, applying the overflow policy when the queue is full.
+
+        Args:
+            topic (str): The topic to send the message to.
+            value (dict): The message value.
+            key (str): Optional partitioning key.
+        """
+        item = (topic, value, key)
+        match self.overflow:
+            case config.QueueOverflowPolicy.BLOCK:
+                await self.queue.put(item)
+            case config.QueueOverflowPolicy.DROP_NEW:
+                try:
+                    self.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    self.dropped_new += 1
+                    metrics.KAFKA_SEND_QUEUE_DROPPED.labels(self.overflow).inc()
+                    logger.warning(f'Send queue full, dropping new message for topic {topic}')
+                    return
+            case config.QueueOverflowPolicy.DROP_OLDEST:
+                while True:
+                    try:
+                        self.queue.put_nowait(item)
+                        break
+                    except asyncio.QueueFull:
+                        try:
+                            self.queue.get_nowait()
+                            self.queue.task_done()
+                            self.dropped_oldest += 1
+                            metrics.KAFKA_SEND_QUEUE_DROPPED.labels(self.overflow).inc()
+                            logger.warning('Send queue full, dropping oldest message')
+                        except asyncio.QueueEmpty:
+                            pass
+        self.enqueued += 1
+
+    def start(self):
+        """Start the background task that drains the queue."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while True:
+            messages = [await self.queue.get()]
+            while len(messages) < self.batch_size:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                failed = await self.producer_manager.send_batch(messages)
+                self.failed += failed
+                self.sent += len(messages) - failed
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+                self.failed += len(messages)
+            finally:
+                for _ in messages:
+                    self.queue.task_done()
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Wait for queued messages to be handed to the producer, then stop
+        the background task.
+
+        Args:
+            timeout (float): Maximum seconds to wait for the queue to drain.
+        """
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f'Send queue not drained within {timeout}s, '
+                f'{self.queue.qsize()} messages will be lost'
+            )
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "size": self.queue.qsize(),
+            "maxsize": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_new": self.dropped_new,
+        }
 
 loop = asyncio.get_event_loop()
 
 producer_manager = KafkaProducerManager(
     loop=loop, 
-    bootstrap_servers=settings.bootstrap_servers
-)
\ No newline at end of file
+    bootstrap_servers=settings.bootstrap_servers,
+    linger_ms=settings.kafka_producer_linger_ms,
+    max_batch_size=settings.kafka_producer_max_batch_size
+)
+
+send_queue = KafkaSendQueue(
+    producer_manager=producer_manager,
+    maxsize=settings.kafka_send_queue_maxsize,
+    overflow=settings.kafka_send_queue_overflow,
+    batch_size=settings.kafka_send_queue_batch_size
+)
+
+metrics.KAFKA_SEND_QUEUE_SIZE.set_function(send_queue.queue.qsize)
@@ -0,0 +1,216 @@
+import sys, asyncio, random, time, base64
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .producers import producer_manager, KafkaProducerManager
+from . import rpc, config
+from .actions import RetriesExhausted
+from ..logger import logger
+from ..config import settings
+from .. import metrics
+
+
+ORIGINAL_TOPIC_HEADER = "original_topic"
+RETRY_ATTEMPT_HEADER = "retry_attempt"
+RETRY_AT_HEADER = "retry_at"
+ERROR_HEADER = "error"
+
+"""
+Topics whose keyed messages must be applied in order: a later update of a
+key must not be overwritten by an earlier one that failed and came back
+through the retry topic
+"""
+ORDERED_TOPICS = (config.KafkaTopic.WRITE_DB, config.KafkaTopic.UPDATE_DB, config.KafkaTopic.DELETE_DB)
+
+"""Database errors worth retrying later: lost connections, deadlocks/lock waits, pool exhaustion"""
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failed message may succeed if handled again later. Everything
+    else (unknown actions, bad schemas or columns, constraint violations,
+    undecodable payloads) is a poison message.
+    """
+    if isinstance(error, RetriesExhausted):
+        return isinstance(error.__cause__, TRANSIENT_DB_ERRORS)
+    return isinstance(error, TRANSIENT_DB_ERRORS + (asyncio.TimeoutError, ConnectionError))
+
+
+def is_client_error(error: Exception) -> bool:
+    """
+    Whether a handler rejected the message itself (no matching rows, bad
+    filters): the final result of the message, not a failure to retry or
+    park.
+    """
+    return isinstance(error, HTTPException) and 400 <= error.status_code < 500
+
+
+class RetryScheduler:
+    """
+    Routes messages whose handler failed: transient failures go to the
+    delayed-retry topic with exponential backoff and jitter, poison messages
+    and messages out of attempts go to the dead-letter topic. The partition
+    worker moves on right away instead of sleeping on the failure, except
+    for keyed messages of ORDERED_TOPICS: those are retried in place with
+    the same backoff (see retries_in_place), holding back the later
+    messages of their partition, and dead-lettered once out of attempts.
+    """
+    def __init__(
+            self,
+            producer_manager: KafkaProducerManager,
+            retry_topic: str,
+            dead_letter_topic: str,
+            max_attempts: int = 5,
+            base_delay: float = 1.0,
+            max_delay: float = 60.0
+        ):
+        self.producer_manager = producer_manager
+        self.retry_topic = retry_topic
+        self.dead_letter_topic = dead_letter_topic
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with equal jitter: half the delay is fixed, half is random"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def keeps_order(self, msg) -> bool:
+        """Whether a message must be applied in order with the other messages of its key"""
+        topic = rpc.get_header(msg, ORIGINAL_TOPIC_HEADER) or msg.topic
+        return msg.key is not None and topic in ORDERED_TOPICS
+
+    def retries_in_place(self, msg, value: dict, error: Exception) -> bool:
+        """
+        Whether the partition worker retries a failed message itself: a
+        transient failure of a message that keeps order and that no caller
+        waits the reply of.
+        """
+        return (
+            value is not None 
+            and is_transient(error) 
+            and self.keeps_order(msg) 
+            and rpc.get_header(msg, rpc.REPLY_TO_HEADER) is None
+        )
+
+    async def schedule(self, msg, value: dict, error: Exception, retries: int = None):
+        """
+        Send a failed message to the retry or the dead-letter topic. RPC 
+        messages, whose caller already got the error reply, and messages a 
+        handler rejected with a 4xx are only logged.
+
+        Args:
+            msg: The message whose handler failed.
+            value (dict): The decoded message, or None if it could not be decoded.
+            error (Exception): The error the handler raised.
+            retries (int): The retries already made in place, for messages 
+                that keep order; these are dead-lettered rather than retried.
+        """
+        topic = rpc.get_header(msg, ORIGINAL_TOPIC_HEADER) or msg.topic
+        attempt = int(rpc.get_header(msg, RETRY_ATTEMPT_HEADER) or 0) + 1
+        key = msg.key.decode('utf-8') if msg.key is not None else None
+        try:
+            if rpc.get_header(msg, rpc.REPLY_TO_HEADER) is not None:
+                """The caller already received the error reply, retrying would act behind its back"""
+                logger.warning(
+                    f'Not retrying RPC msg from {topic} offset {msg.offset}: {_describe(error)}'
+                )
+            elif is_client_error(error):
+                logger.warning(
+                    f'Msg from {topic} offset {msg.offset} rejected, not retrying: {_describe(error)}'
+                )
+            elif value is None or not is_transient(error) or attempt > self.max_attempts:
+                await self.dead_letter(msg, topic, key, value, error, attempt - 1 if retries is None else retries)
+            elif self.keeps_order(msg):
+                """Out of in-place retries; sending it back later would reorder its key"""
+                await self.dead_letter(msg, topic, key, value, error, retries or 0)
+            else:
+                delay = self.backoff(attempt)
+                await self.producer_manager.send(
+                    topic=self.retry_topic,
+                    value=value,
+                    key=key,
+                    headers=[
+                        (ORIGINAL_TOPIC_HEADER, topic.encode('utf-8')),
+                        (RETRY_ATTEMPT_HEADER, str(attempt).encode('utf-8')),
+                        (RETRY_AT_HEADER, str(time.time() + delay).encode('utf-8')),
+                        (ERROR_HEADER, _describe(error).encode('utf-8'))
+                    ]
+                )
+                metrics.KAFKA_MESSAGES_RETRIED.labels(topic).inc()
+                logger.warning(
+                    f'Scheduled retry {attempt}/{self.max_attempts} of msg from {topic} '
+                    f'offset {msg.offset} in {delay:.1f}s: {_describe(error)}'
+                )
+        except Exception as e:
+            logger.error(
+                f'Failed to reschedule msg from {topic} offset {msg.offset}, '
+                f'it is lost: {e}',
+                exc_info=sys.exc_info()
+            )
+
+    async def dead_letter(self, msg, topic: str, key: str, value: dict, error: Exception, retries: int):
+        """Park a message on the dead-letter topic, with where it came from and why it failed"""
+        if value is None:
+            value = {"raw": base64.b64encode(msg.value).decode('ascii')}
+        await self.producer_manager.send(
+            topic=self.dead_letter_topic,
+            value=value,
+            key=key,
+            headers=[
+                (ORIGINAL_TOPIC_HEADER, topic.encode('utf-8')),
+                (RETRY_ATTEMPT_HEADER, str(retries).encode('utf-8')),
+                (ERROR_HEADER, _describe(error).encode('utf-8'))
+            ]
+        )
+        metrics.KAFKA_MESSAGES_DEAD_LETTERED.labels(topic).inc()
+        logger.error(
+            f'Dead-lettered msg from {topic} offset {msg.offset} '
+            f'after {retries} retries: {_describe(error)}'
+        )
+
+    async def republish(self, msg, value: dict):
+        """
+        Wait until a message from the retry topic is due, then send it back
+        to its original topic with its attempt count.
+
+        Args:
+            msg: The message read from the retry topic.
+            value (dict): The decoded message.
+        """
+        retry_at = float(rpc.get_header(msg, RETRY_AT_HEADER) or 0)
+        delay = retry_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.producer_manager.send(
+            topic=rpc.get_header(msg, ORIGINAL_TOPIC_HEADER),
+            value=value,
+            key=msg.key.decode('utf-8') if msg.key is not None else None,
+            headers=[
+                (RETRY_ATTEMPT_HEADER, rpc.get_header(msg, RETRY_ATTEMPT_HEADER).encode('utf-8'))
+            ]
+        )
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        cause = error.__cause__
+        return f"{type(cause or error).__name__}: {cause or error.detail}"[:500]
+    return f"{type(error).__name__}: {error}"[:500]
+
+
+retry_scheduler = RetryScheduler(
+    producer_manager=producer_manager,
+    retry_topic=settings.kafka_retry_topic,
+    dead_letter_topic=settings.kafka_dead_letter_topic,
+    max_attempts=settings.kafka_retry_max_attempts,
+    base_delay=settings.kafka_retry_base_delay,
+    max_delay=settings.kafka_retry_max_delay
+)
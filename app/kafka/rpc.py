@@ -0,0 +1,208 @@
+import sys, asyncio, base64, uuid
+from fastapi import HTTPException, status, Response
+from sqlalchemy.engine import Row
+
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .codec import codec
+from . import transport
+from .producers import producer_manager, KafkaProducerManager
+from ..logger import logger
+from ..config import settings
+
+
+CORRELATION_ID_HEADER = "correlation_id"
+REPLY_TO_HEADER = "reply_to"
+
+
+def get_header(msg, name: str) -> str:
+    """Return the value of a Kafka message header as str, or None."""
+    for key, value in msg.headers or ():
+        if key == name:
+            return value.decode('utf-8')
+    return None
+
+
+def serialize_result(result):
+    """
+    Convert the result of a DB action into something the codec can encode.
+
+    Args:
+        result: ORM objects, result rows, a Response, or lists of them.
+
+    Returns:
+        The JSON-compatible result.
+    """
+    if isinstance(result, (list, tuple)) and not isinstance(result, Row):
+        return [serialize_result(item) for item in result]
+    if isinstance(result, dict):
+        return {key: serialize_result(value) for key, value in result.items()}
+    if isinstance(result, Row):
+        return {key: serialize_result(value) for key, value in result._mapping.items()}
+    if isinstance(result, Response):
+        return {"status_code": result.status_code}
+    if isinstance(result, bytes):
+        return base64.b64encode(result).decode('ascii')
+    if hasattr(result, "__table__"):
+        return {
+            column.key: serialize_result(getattr(result, column.key))
+            for column in result.__table__.columns
+        }
+    return result
+
+
+class KafkaRPCClient:
+    """
+    Request/reply over Kafka. Requests carry a correlation id and the reply
+    topic in their headers; one long-lived consumer per process reads the
+    reply topic and resolves the matching pending future.
+    """
+    def __init__(
+            self,
+            loop,
+            bootstrap_servers,
+            producer_manager: KafkaProducerManager,
+            reply_topic: str,
+            timeout: float = 10.0
+        ):
+        self.loop = loop
+        self.bootstrap_servers = bootstrap_servers
+        self.producer_manager = producer_manager
+        self.reply_topic = reply_topic
+        self.timeout = timeout
+        self.pending = {}
+        self.consumer = None
+        self.task = None
+
+    async def start(self):
+        """
+        Start the reply consumer, positioned at the end of the reply topic.
+
+        Raises:
+            KeyError: If the reply consumer could not be started.
+        """
+        if self.consumer is not None:
+            return
+        try:
+            logger.debug(
+                'Initializing RPC reply consumer '
+                f'for topic {self.reply_topic} '
+                f'and using bootstrap servers {self.bootstrap_servers}'
+            )
+            consumer = transport.create_consumer(
+                self.reply_topic,
+                loop=self.loop,
+                bootstrap_servers=self.bootstrap_servers,
+                group_id=None,  # every process reads every reply partition
+                enable_auto_commit=False,
+                auto_offset_reset="latest"
+            )
+            await consumer.start()
+            if consumer.assignment():
+                await consumer.seek_to_end()
+            self.consumer = consumer
+            self.task = asyncio.create_task(self._consume_replies())
+        except Exception as e:
+            logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            raise KeyError(f"Error starting RPC reply consumer for topic '{self.reply_topic}'")
+
+    async def _consume_replies(self):
+        async for msg in self.consumer:
+            correlation_id = get_header(msg, CORRELATION_ID_HEADER)
+            future = self.pending.get(correlation_id)
+            if future is None or future.done():
+                continue
+            try:
+                future.set_result(codec.decode(msg.value))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def call(
+            self,
+            topic: str,
+            action: str,
+            data: dict,
+            key: str = None,
+            timeout: float = None
+        ):
+        """
+        Send a request and wait for its reply.
+
+        Args:
+            topic (str): The request topic.
+            action (str): The action to run.
+            data (dict): The action arguments.
+            key (str): Optional partitioning key.
+            timeout (float): Seconds to wait for the reply, defaults to the client timeout.
+
+        Returns:
+            The result of the action.
+
+        Raises:
+            HTTPException: If the action failed, or with 504 if no reply arrived in time.
+        """
+        if self.consumer is None:
+            await self.start()
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[correlation_id] = future
+        try:
+            await self.producer_manager.send(
+                topic=topic,
+                value={"action": action, "data": data},
+                key=key,
+                headers=[
+                    (CORRELATION_ID_HEADER, correlation_id.encode('utf-8')),
+                    (REPLY_TO_HEADER, self.reply_topic.encode('utf-8'))
+                ]
+            )
+            reply = await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'No reply for {action} request {correlation_id} on topic {topic}')
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Timed out waiting for reply"
+            )
+        finally:
+            self.pending.pop(correlation_id, None)
+
+        if reply.get("status") != "ok":
+            raise HTTPException(
+                status_code=reply.get("status_code", status.HTTP_500_INTERNAL_SERVER_ERROR),
+                detail=reply.get("detail", "Internal server error")
+            )
+        return reply.get("result")
+
+    async def stop(self):
+        """Stop the reply consumer and fail any calls still waiting."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.task = None
+        for future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+        if self.consumer is not None:
+            try:
+                await self.consumer.stop()
+            except Exception as e:
+                logger.error(f'An error occurred: {e}', exc_info=sys.exc_info())
+            self.consumer = None
+
+
+loop = asyncio.get_event_loop()
+
+rpc_client = KafkaRPCClient(
+    loop=loop,
+    bootstrap_servers=settings.bootstrap_servers,
+    producer_manager=producer_manager,
+    reply_topic=settings.kafka_rpc_reply_topic,
+    timeout=settings.kafka_rpc_timeout
+)
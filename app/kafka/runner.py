@@ -0,0 +1,134 @@
+import sys, asyncio
+from dataclasses import dataclass
+from typing import Iterable, List
+
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from . import config
+from .consumers import consumer_manager
+from ..logger import logger
+from ..config import settings
+
+
+@dataclass(frozen=True)
+class ConsumerSpec:
+    """
+    How a topic is consumed: by partition workers (bg_consume), in batches
+    (bg_consume_batch) or as the delayed-retry topic (bg_consume_retries),
+    and which config.Task attribute holds its task.
+    """
+    topic: str
+    group_id: str
+    mode: str
+    task: str
+
+
+"""Time left to the consumers to commit and leave their groups after the drain deadline"""
+COMMIT_GRACE_SECONDS = 5.0
+
+
+class ConsumeMode:
+    PARTITIONED = "partitioned"
+    BATCH = "batch"
+    RETRY = "retry"
+
+
+def consumer_specs() -> List[ConsumerSpec]:
+    """Every consumer of the app, in start order"""
+    specs = [
+        ConsumerSpec(config.KafkaTopic.SAVE_REQUEST_TO_DB, "default", ConsumeMode.BATCH, "SAVE_REQUEST_TO_DB"),
+        ConsumerSpec(config.KafkaTopic.SAVE_RESPONSE_TO_DB, "default", ConsumeMode.BATCH, "SAVE_RESPONSE_TO_DB"),
+    ]
+    if settings.kafka_audit_combined_exchange:
+        specs.append(ConsumerSpec(
+            config.KafkaTopic.SAVE_EXCHANGE_TO_DB, "save_exchange_to_db", ConsumeMode.BATCH, "SAVE_EXCHANGE_TO_DB"
+        ))
+    specs += [
+        ConsumerSpec(config.KafkaTopic.WRITE_DB, "write_db", ConsumeMode.PARTITIONED, "WRITE_DB"),
+        ConsumerSpec(config.KafkaTopic.UPDATE_DB, "update_db", ConsumeMode.PARTITIONED, "UPDATE_DB"),
+        ConsumerSpec(config.KafkaTopic.READ_DB, "read_db", ConsumeMode.PARTITIONED, "READ_DB"),
+        ConsumerSpec(config.KafkaTopic.DELETE_DB, "delete_db", ConsumeMode.PARTITIONED, "DELETE_DB"),
+        ConsumerSpec(settings.kafka_retry_topic, "retry", ConsumeMode.RETRY, "RETRY"),
+    ]
+    return specs
+
+
+def select_specs(topics: Iterable[str] = None) -> List[ConsumerSpec]:
+    """
+    The consumers of the given topics, or all of them.
+
+    Raises:
+        KeyError: If a topic has no consumer.
+    """
+    specs = consumer_specs()
+    if not topics:
+        return specs
+    topics = set(topics)
+    unknown = topics - {spec.topic for spec in specs}
+    if unknown:
+        raise KeyError(f"No consumer for topics {sorted(unknown)}")
+    return [spec for spec in specs if spec.topic in topics]
+
+
+async def start_consumers(specs: List[ConsumerSpec]):
+    """Create the consumers and start a consuming task for each"""
+    for spec in specs:
+        if spec.mode == ConsumeMode.PARTITIONED:
+            await consumer_manager.create_bg_consumer(topic=spec.topic, group_id=spec.group_id)
+        else:
+            await consumer_manager.create_batch_consumer(topic=spec.topic, group_id=spec.group_id)
+    for spec in specs:
+        match spec.mode:
+            case ConsumeMode.PARTITIONED:
+                consume = consumer_manager.bg_consume(topic=spec.topic)
+            case ConsumeMode.BATCH:
+                consume = consumer_manager.bg_consume_batch(
+                    topic=spec.topic,
+                    max_records=settings.kafka_audit_batch_max_records,
+                    timeout_ms=settings.kafka_audit_batch_timeout_ms
+                )
+            case ConsumeMode.RETRY:
+                consume = consumer_manager.bg_consume_retries(topic=spec.topic)
+        setattr(config.Task, spec.task, asyncio.create_task(consume, name=spec.topic))
+        logger.info(f'Started {spec.mode} consumer for {spec.topic}')
+
+
+async def stop_consumers(specs: List[ConsumerSpec], timeout: float = None):
+    """
+    Stop the consumers without losing or replaying work: each loop finishes
+    and commits its current batch, partition workers get until the drain
+    deadline to finish their queued messages, then the consumers leave
+    their groups. Loops still running COMMIT_GRACE_SECONDS after the
+    deadline are cancelled; their uncommitted messages are redelivered.
+
+    Args:
+        specs (List[ConsumerSpec]): The consumers to stop.
+        timeout (float): Seconds to drain (defaults to SHUTDOWN_DRAIN_TIMEOUT).
+    """
+    timeout = settings.shutdown_drain_timeout if timeout is None else timeout
+    for spec in specs:
+        consumer_manager.request_stop(spec.topic, timeout)
+    tasks = consumer_tasks(specs)
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout + COMMIT_GRACE_SECONDS)
+        for task in pending:
+            logger.warning(f'Consumer task {task.get_name()} not drained in time, cancelling it')
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f'Consumer stopped with an error: {result}')
+    for spec in specs:
+        """A no-op for the consumers their loop has stopped"""
+        if spec.topic in consumer_manager.consumers:
+            await consumer_manager.stop_consumer(topic=spec.topic)
+        setattr(config.Task, spec.task, None)
+
+
+def consumer_tasks(specs: List[ConsumerSpec]) -> List[asyncio.Task]:
+    return [
+        getattr(config.Task, spec.task) for spec in specs
+        if getattr(config.Task, spec.task) is not None
+    ]
@@ -0,0 +1,458 @@
+import sys, operator, threading, itertools, datetime, decimal
+from collections import OrderedDict
+from sqlalchemy import select, insert, update, delete, bindparam, and_, or_, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from typing import Callable, List, Tuple
+
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from . import config
+from ..config import settings
+from .. import metrics
+
+
+"""Operators taking one value"""
+FILTER_OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "like": lambda column, value: column.like(value),
+    "not like": lambda column, value: column.not_like(value),
+    "in": lambda column, value: column.in_(value),
+    "not in": lambda column, value: column.not_in(value),
+}
+
+"""Operators taking a [low, high] pair"""
+RANGE_OPERATORS = {
+    "between": lambda column, low, high: column.between(low, high),
+    "not between": lambda column, low, high: ~column.between(low, high),
+}
+
+"""Operators taking no value"""
+NULL_OPERATORS = {
+    "is null": lambda column: column.is_(None),
+    "is not null": lambda column: column.is_not(None),
+}
+
+"""Filter groups: {"or": [...]} or {"and": [...]}"""
+GROUP_OPERATORS = {
+    "or": or_,
+    "and": and_,
+}
+
+
+def get_model(schemas: str):
+    """
+    Look up the model registered for a schema name.
+
+    Args:
+        schemas (str): The schema name, one of config.DatabaseSchemas.
+
+    Returns:
+        The SQLAlchemy model.
+
+    Raises:
+        ValueError: If no model is registered for the schema.
+    """
+    model = config.SCHEMA_MODELS.get(schemas)
+    if model is None:
+        raise ValueError(f"Unsupported schema: {schemas}")
+    return model
+
+
+def _leaves(filters: list):
+    """
+    Walk a filter list depth-first, yielding (column, operator, value) for
+    every condition. Conditions are (column, operator, value) sequences, or
+    (column, operator) for the null checks; groups are {"or": [...]} or
+    {"and": [...]} and nest.
+
+    Raises:
+        ValueError: If a filter is malformed or an operator is not supported.
+    """
+    for item in filters or ():
+        if isinstance(item, dict):
+            if len(item) != 1 or next(iter(item)) not in GROUP_OPERATORS:
+                raise ValueError(f"Unsupported filter group: {item}")
+            yield from _leaves(next(iter(item.values())))
+            continue
+        column, op, *value = item
+        op = op.strip().lower()
+        if op in NULL_OPERATORS:
+            yield column, op, None
+        elif op in FILTER_OPERATORS or op in RANGE_OPERATORS:
+            if len(value) != 1:
+                raise ValueError(f"Missing value for filter on {column}")
+            yield column, op, value[0]
+        else:
+            raise ValueError(f"Unsupported operator: {op}")
+
+
+def filter_shape(filters: list) -> tuple:
+    """
+    The structure of a filter list without its values, which is what the
+    statement depends on: ("col", column, operator) per condition and
+    (group operator, children) per group. IN lists use expanding bind
+    parameters, so their length is not part of the shape.
+    """
+    shape = []
+    for item in filters or ():
+        if isinstance(item, dict):
+            (group, children), = item.items()
+            shape.append((group, filter_shape(children)))
+        else:
+            shape.extend(("col", column, op) for column, op, _ in _leaves([item]))
+    return tuple(shape)
+
+
+def coerce_value(column, value):
+    """
+    Convert a JSON value to the Python type of a column, e.g. ISO strings
+    for date/time columns and numeric strings for numeric columns. Values
+    that already match, or that cannot be converted, are returned as is.
+    """
+    if value is None or isinstance(value, bool):
+        return value
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if isinstance(value, python_type):
+        return value
+    try:
+        if python_type in (datetime.datetime, datetime.date, datetime.time) and isinstance(value, str):
+            return python_type.fromisoformat(value)
+        if python_type in (int, float, decimal.Decimal) and isinstance(value, (str, int, float)):
+            return python_type(value)
+    except ValueError:
+        return value
+    return value
+
+
+def filter_params(schemas: str, filters: list) -> dict:
+    """Bind parameter values for the conditions built by build_conditions, coerced to the column types"""
+    model = get_model(schemas)
+    params = {}
+    for i, (column, op, value) in enumerate(_leaves(filters)):
+        column_type = getattr(model, column)
+        if op in NULL_OPERATORS:
+            continue
+        if op in RANGE_OPERATORS:
+            low, high = value
+            params[f"f{i}_low"] = coerce_value(column_type, low)
+            params[f"f{i}_high"] = coerce_value(column_type, high)
+        elif op in ("in", "not in"):
+            params[f"f{i}"] = [coerce_value(column_type, item) for item in value]
+        else:
+            params[f"f{i}"] = coerce_value(column_type, value)
+    return params
+
+
+def build_conditions(model, shape: tuple) -> list:
+    """
+    Build WHERE conditions with bind parameters for the values, so the
+    statement can be reused for any filter values of the same shape.
+    Top-level conditions are ANDed.
+
+    Raises:
+        ValueError: If an operator is not supported.
+    """
+    counter = itertools.count()
+
+    def build(shape: tuple) -> list:
+        conditions = []
+        for kind, *rest in shape:
+            if kind in GROUP_OPERATORS:
+                conditions.append(GROUP_OPERATORS[kind](*build(rest[0])))
+                continue
+            column, op = rest
+            i = next(counter)
+            attribute = getattr(model, column)
+            if op in NULL_OPERATORS:
+                conditions.append(NULL_OPERATORS[op](attribute))
+            elif op in RANGE_OPERATORS:
+                conditions.append(RANGE_OPERATORS[op](
+                    attribute, bindparam(f"f{i}_low"), bindparam(f"f{i}_high")
+                ))
+            elif op in ("in", "not in"):
+                conditions.append(FILTER_OPERATORS[op](attribute, bindparam(f"f{i}", expanding=True)))
+            else:
+                conditions.append(FILTER_OPERATORS[op](attribute, bindparam(f"f{i}")))
+        return conditions
+
+    return build(shape)
+
+
+class StatementCache:
+    """
+    Least-recently-used cache of statements keyed by
+    (schema, operation, column set, filter shape). Reusing the same
+    statement object skips query construction, and SQLAlchemy memoizes its
+    cache key so the compiled form is found without walking the statement.
+    Statements are built and looked up from the DB executor threads.
+    """
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.statements = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, build: Callable[[], object]):
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is not None:
+                self.statements.move_to_end(key)
+                metrics.DB_STATEMENT_CACHE.labels("hit").inc()
+                return statement
+        metrics.DB_STATEMENT_CACHE.labels("miss").inc()
+        statement = build()
+        with self.lock:
+            self.statements[key] = statement
+            if len(self.statements) > self.maxsize:
+                self.statements.popitem(last=False)
+        return statement
+
+    def clear(self):
+        with self.lock:
+            self.statements.clear()
+
+
+statement_cache = StatementCache(maxsize=settings.db_statement_cache_size)
+
+
+def insert_statement(schemas: str):
+    """Cached INSERT for write_db, executed with one parameter dict per row"""
+    return statement_cache.get((schemas, "insert"), lambda: insert(get_model(schemas)))
+
+
+def insert_ignore_statement(schemas: str, dialect: str, key: Tuple[str, ...]):
+    """
+    Cached INSERT that skips rows whose unique key already exists, so
+    redelivered messages do not add duplicate rows. On MySQL this is
+    ON DUPLICATE KEY UPDATE with a no-op assignment rather than INSERT IGNORE,
+    which would also turn other errors into warnings.
+
+    Args:
+        schemas (str): The schema to insert into.
+        dialect (str): The name of the session's SQL dialect.
+        key (Tuple[str, ...]): The columns of the unique key that identifies duplicates.
+
+    Raises:
+        ValueError: If the dialect has no insert-ignore form.
+    """
+    key = tuple(key)
+
+    def build():
+        table = get_model(schemas).__table__
+        match dialect:
+            case "mysql":
+                statement = mysql.insert(table)
+                return statement.on_duplicate_key_update({key[0]: statement.inserted[key[0]]})
+            case "postgresql":
+                return postgresql.insert(table).on_conflict_do_nothing(index_elements=list(key))
+            case "sqlite":
+                return sqlite.insert(table).on_conflict_do_nothing(index_elements=list(key))
+        raise ValueError(f"Unsupported dialect for insert-ignore: {dialect}")
+
+    return statement_cache.get((schemas, "insert_ignore", dialect, key), build)
+
+
+def order_shape(schemas: str, order_by: list = None, unique: bool = False) -> tuple:
+    """
+    Normalize an order_by list of column names or (column, "asc"|"desc")
+    pairs.
+
+    Args:
+        schemas (str): The schema the columns belong to.
+        order_by (list): The requested ordering.
+        unique (bool): Append the primary key columns, so that the order is
+            total as keyset pagination requires.
+
+    Returns:
+        tuple: (column, direction) pairs.
+
+    Raises:
+        ValueError: If a direction is not asc or desc.
+    """
+    shape = []
+    for item in order_by or ():
+        column, direction = (item, "asc") if isinstance(item, str) else item
+        direction = direction.lower()
+        if direction not in ("asc", "desc"):
+            raise ValueError(f"Unsupported order direction: {direction}")
+        shape.append((column, direction))
+    if unique:
+        ordered = {column for column, _ in shape}
+        for column in get_model(schemas).__mapper__.primary_key:
+            if column.key not in ordered:
+                shape.append((column.key, "asc"))
+    return tuple(shape)
+
+
+def keyset_params(schemas: str, order: tuple, after: list) -> dict:
+    """Bind parameter values for the keyset condition, from a page cursor"""
+    model = get_model(schemas)
+    return {
+        f"k{i}": coerce_value(getattr(model, column), value)
+        for i, ((column, _), value) in enumerate(zip(order, after or ()))
+    }
+
+
+def update_params(schemas: str, update_dict: dict) -> dict:
+    """Bind parameter values for update_statement, coerced to the column types"""
+    model = get_model(schemas)
+    return {
+        f"v{i}": coerce_value(getattr(model, column), value)
+        for i, (column, value) in enumerate(update_dict.items())
+    }
+
+
+def build_keyset_condition(model, order: tuple):
+    """
+    Rows strictly after the cursor in the given order:
+    (c0 > k0) OR (c0 = k0 AND c1 > k1) OR ..., with < for descending columns.
+    """
+    alternatives = []
+    for i, (column, direction) in enumerate(order):
+        compare = operator.gt if direction == "asc" else operator.lt
+        alternatives.append(and_(
+            *[getattr(model, previous) == bindparam(f"k{j}") for j, (previous, _) in enumerate(order[:i])],
+            compare(getattr(model, column), bindparam(f"k{i}"))
+        ))
+    return or_(*alternatives)
+
+
+def select_statement(
+        schemas: str,
+        operation: str,
+        columns: List[str],
+        filters: list,
+        order: tuple = (),
+        limit: int = None,
+        keyset: bool = False
+    ):
+    """
+    Cached SELECT for read_db; "first" is limited to one row like
+    Query.first(). With keyset the statement also takes k0, k1, ... bind
+    parameters and returns the rows after that cursor in `order`.
+    """
+    columns = tuple(columns) if columns is not None else None
+    shape = filter_shape(filters)
+
+    def build():
+        model = get_model(schemas)
+        if columns is None:
+            statement = select(model)
+        else:
+            statement = select(*[getattr(model, column) for column in columns])
+        conditions = build_conditions(model, shape)
+        if keyset:
+            conditions.append(build_keyset_condition(model, order))
+        statement = statement.where(*conditions)
+        if order:
+            statement = statement.order_by(*[
+                getattr(model, column).asc() if direction == "asc" else getattr(model, column).desc()
+                for column, direction in order
+            ])
+        if operation == "first":
+            statement = statement.limit(1)
+        elif limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    return statement_cache.get(
+        (schemas, "select", operation, columns, shape, order, limit, keyset), build
+    )
+
+
+def update_statement(schemas: str, update_columns: List[str], filters: list):
+    """Cached UPDATE for update_db, values are bound as v0, v1, ..."""
+    update_columns = tuple(update_columns)
+    shape = filter_shape(filters)
+
+    def build():
+        model = get_model(schemas)
+        return (
+            update(model)
+            .where(*build_conditions(model, shape))
+            .values({column: bindparam(f"v{i}") for i, column in enumerate(update_columns)})
+            .execution_options(synchronize_session=False)
+        )
+
+    return statement_cache.get((schemas, "update", update_columns, shape), build)
+
+
+def _require_conditions(shape: tuple):
+    """
+    Refuse to build a DELETE without conditions, which would empty the table.
+
+    Raises:
+        ValueError: If the filters have no conditions.
+    """
+    if not shape:
+        raise ValueError("A delete needs at least one filter condition")
+
+
+def delete_statement(schemas: str, filters: list):
+    """Cached DELETE for delete_db"""
+    shape = filter_shape(filters)
+    _require_conditions(shape)
+
+    def build():
+        model = get_model(schemas)
+        return (
+            delete(model)
+            .where(*build_conditions(model, shape))
+            .execution_options(synchronize_session=False)
+        )
+
+    return statement_cache.get((schemas, "delete", shape), build)
+
+
+def primary_key_columns(schemas: str) -> tuple:
+    """The primary key attribute names of a schema's model"""
+    return tuple(column.key for column in get_model(schemas).__mapper__.primary_key)
+
+
+def _primary_key(model):
+    columns = [getattr(model, column.key) for column in model.__mapper__.primary_key]
+    return columns[0] if len(columns) == 1 else tuple_(*columns)
+
+
+def delete_chunk_statement(schemas: str, filters: list, chunk_size: int):
+    """
+    Cached SELECT of the primary keys of the next chunk of rows to delete.
+    The keys are then deleted with delete_by_keys_statement; MySQL does not
+    allow LIMIT in an IN subquery, so the two steps are separate statements.
+    """
+    shape = filter_shape(filters)
+    _require_conditions(shape)
+
+    def build():
+        model = get_model(schemas)
+        return (
+            select(*[getattr(model, column.key) for column in model.__mapper__.primary_key])
+            .where(*build_conditions(model, shape))
+            .limit(chunk_size)
+        )
+
+    return statement_cache.get((schemas, "delete_chunk", shape, chunk_size), build)
+
+
+def delete_by_keys_statement(schemas: str):
+    """Cached DELETE of the rows whose primary keys are bound to "keys" """
+    def build():
+        model = get_model(schemas)
+        return (
+            delete(model)
+            .where(_primary_key(model).in_(bindparam("keys", expanding=True)))
+            .execution_options(synchronize_session=False)
+        )
+
+    return statement_cache.get((schemas, "delete_by_keys"), build)
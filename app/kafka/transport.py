@@ -0,0 +1,57 @@
+import aiokafka
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from . import config
+from .memory import InMemoryBroker, InMemoryProducer, InMemoryConsumer
+from ..config import settings
+
+
+"""Shared by every producer and consumer of the process when the memory transport is selected"""
+broker = InMemoryBroker(partitions=settings.kafka_memory_partitions)
+
+
+def create_producer(**kwargs):
+    """
+    Create a producer for the configured transport.
+
+    Args:
+        **kwargs: AIOKafkaProducer arguments.
+
+    Returns:
+        An AIOKafkaProducer, or an InMemoryProducer with the memory transport.
+
+    Raises:
+        ValueError: If the configured transport is unknown.
+    """
+    match settings.kafka_transport:
+        case config.KafkaTransport.AIOKAFKA:
+            return aiokafka.AIOKafkaProducer(**kwargs)
+        case config.KafkaTransport.MEMORY:
+            return InMemoryProducer(broker=broker, **kwargs)
+    raise ValueError(f"Unknown Kafka transport: {settings.kafka_transport}")
+
+
+def create_consumer(*topics, **kwargs):
+    """
+    Create a consumer for the configured transport.
+
+    Args:
+        *topics: Topics to subscribe to.
+        **kwargs: AIOKafkaConsumer arguments.
+
+    Returns:
+        An AIOKafkaConsumer, or an InMemoryConsumer with the memory transport.
+
+    Raises:
+        ValueError: If the configured transport is unknown.
+    """
+    match settings.kafka_transport:
+        case config.KafkaTransport.AIOKAFKA:
+            return aiokafka.AIOKafkaConsumer(*topics, **kwargs)
+        case config.KafkaTransport.MEMORY:
+            return InMemoryConsumer(*topics, broker=broker, **kwargs)
+    raise ValueError(f"Unknown Kafka transport: {settings.kafka_transport}")
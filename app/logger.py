@@ -23,8 +23,9 @@ class CustomLogger(logging.Logger):
 logger = CustomLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-"""Create a file handler and set its level to DEBUG"""
-file_handler = logging.FileHandler('app/files/log_file.log')
+"""Create a file handler and set its level to DEBUG; the file is
+    opened on the first record rather than at import"""
+file_handler = logging.FileHandler('app/files/log_file.log', delay=True)
 file_handler.setLevel(logging.DEBUG)
 
 """Create a stream handler and set its level to INFO"""
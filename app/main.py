@@ -1,22 +1,23 @@
-from fastapi import FastAPI, Request, HTTPException, status
+from fastapi import FastAPI, Request, HTTPException, status, Response
 import sys, os, asyncio, time
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.concurrency import iterate_in_threadpool
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
-from .database import Base, engine
 from .router import auth, analysis, datasources
 from .logger import logger
-from .kafka.consumers import consumer_manager
-from .kafka.producers import producer_manager
+from .kafka import runner
+from .kafka.producers import producer_manager, send_queue
+from .kafka.rpc import rpc_client
 from .kafka import config
 from .config import settings
-from . import utils
+from . import utils, models, audit_capture, timing
+from .database import close_pools
 
-# 创建数据库表格
-Base.metadata.create_all(bind=engine)
+"""Tables are created by `python -m app.bootstrap`, not on import, so the
+    API starts even while MySQL is briefly unavailable"""
 
 app = FastAPI()
 
@@ -40,6 +41,42 @@ app.include_router(analysis.router)
 app.include_router(datasources.router)
 
 
+async def send_audit(request_data: dict, response_data: dict):
+    """Hand the audit records to the send queue so the response 
+        does not wait on Kafka"""
+    if settings.kafka_audit_combined_exchange:
+        save_exchange_kafka_value = {
+            "action": config.KafkaAction.SAVE_EXCHANGE_TO_DB,
+            "data": {
+                "request": request_data,
+                "response": response_data
+            }
+        }
+        await send_queue.put(
+            topic=config.KafkaTopic.SAVE_EXCHANGE_TO_DB,
+            value = save_exchange_kafka_value,
+        )
+    else:
+        save_request_kafka_value = {
+            "action": config.KafkaTopic.SAVE_REQUEST_TO_DB,
+            "data": request_data
+        }
+
+        save_response_kafka_value = {
+            "action": config.KafkaTopic.SAVE_RESPONSE_TO_DB,
+            "data": response_data
+        }
+
+        await send_queue.put(
+            topic=config.KafkaTopic.SAVE_REQUEST_TO_DB,
+            value = save_request_kafka_value,
+        ) 
+        await send_queue.put(
+            topic=config.KafkaTopic.SAVE_RESPONSE_TO_DB,
+            value = save_response_kafka_value,
+        )
+
+
 """Define the post-request hook to save the response"""
 @app.middleware("http")
 async def log_response(request: Request, call_next):
@@ -47,61 +84,78 @@ async def log_response(request: Request, call_next):
         """Call the next middleware or the endpoint handler
             to execute the request and generate the response"""
         start = time.time()
+        request_timing = timing.begin()
         request.state.app = app
         request_id = utils.generate_unique_id()
         request_body = await request.body()
         await utils.set_body(request, request_body)
-
-        response = await call_next(request)
-
-        response_body = [chunk async for chunk in response.body_iterator]
-        response.body_iterator = iterate_in_threadpool(iter(response_body))
-        response_body = response_body[0].decode() if response_body else ""
-        request_body_str = request_body.decode('utf-8') 
+        """Bodies are stored for a sample of the requests, per the route's policy"""
+        policy = audit_capture.policies.for_path(request.url.path)
+        capture_bodies = audit_capture.sampled(policy)
+        """The partitioning key of the log tables, set here so redelivered
+            messages carry the same value"""
+        created_at = models.utcnow()
 
         request_data = {
             "request_id": request_id,
             "method": request.method,
             "url_path": request.url.path,
             "query_params": str(dict(request.query_params)),
-            "request_headers": str(dict(request.headers)),
-            "request_body": request_body_str,
+            "request_headers": audit_capture.capture_headers(request.headers, policy),
+            "request_body": audit_capture.capture_body(
+                request_body, request.headers.get("content-type"), policy
+            ) if capture_bodies and policy.capture_request_body else None,
             "client_ip": request.client.host,
             "user_agent": request.headers.get("user-agent"),
             "referer": request.headers.get("referer"),
-            "cookies": str(dict(request.cookies)),
-            "route_name": ""
+            "cookies": audit_capture.capture_cookies(request.cookies, policy),
+            "route_name": "",
+            "created_at": created_at
         }
 
-        response_data = {
-            "request_id": request_id,
-            "response_id": utils.generate_unique_id(),
-            "response_status_code": response.status_code,
-            "response_headers": str(dict(response.headers)),
-            "response_body": response_body,
-        }
-        
-        save_request_kafka_value = {
-            "action": config.KafkaTopic.SAVE_REQUEST_TO_DB,
-            "data": request_data
-        }
+        response = await call_next(request)
 
-        save_response_kafka_value = {
-            "action": config.KafkaTopic.SAVE_RESPONSE_TO_DB,
-            "data": response_data
-        }
+        """Stages timed while the handler ran; stages of a streamed body
+            only reach the histograms"""
+        response.headers["Server-Timing"] = request_timing.server_timing()
+        route = getattr(request.scope.get("route"), "path", "unmatched")
 
-        await producer_manager.send(
-            topic=config.KafkaTopic.SAVE_REQUEST_TO_DB,
-            value = save_request_kafka_value,
-        ) 
-        await producer_manager.send(
-            topic=config.KafkaTopic.SAVE_RESPONSE_TO_DB,
-            value = save_response_kafka_value,
+        """Pass the body through as it is produced, keeping up to the
+            policy's cap for the audit record"""
+        capture_response = capture_bodies and policy.capture_response_body
+        response_capture = audit_capture.BodyCapture(
+            policy.max_body_bytes if capture_response else 0
+        )
+
+        async def on_complete():
+            """Send the audit records once the body has been streamed"""
+            try:
+                if not response_capture.complete:
+                    logger.warning(f'Response to {request_id} was interrupted after {response_capture.total} bytes')
+                response_data = {
+                    "request_id": request_id,
+                    "response_id": utils.generate_unique_id(),
+                    "response_status_code": response.status_code,
+                    "response_headers": audit_capture.capture_headers(response.headers, policy),
+                    "response_body": audit_capture.capture_body(
+                        response_capture.body,
+                        response.headers.get("content-type"),
+                        policy,
+                        total=response_capture.total
+                    ) if capture_response else None,
+                    "duration_ms": (time.time() - start) * 1000,
+                    "created_at": created_at
+                }
+                request_timing.observe(route)
+                await send_audit(request_data, response_data)
+                logger.info(f'Time take for log_response is {time.time()-start}s')
+            except Exception as e:
+                logger.error(f"An error occurred while saving the response: {e}", exc_info=sys.exc_info())
+
+        response.body_iterator = audit_capture.tee(
+            response.body_iterator, response_capture, on_complete
         )
 
-        logger.info(f'Time take for log_response is {time.time()-start}s')
-        
         """Return the response as usual"""
         return response
 
@@ -115,68 +169,37 @@ async def log_response(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     logger.info('Initializing API ...')
-    await consumer_manager.create_bg_consumer(
-        topic=config.KafkaTopic.SAVE_REQUEST_TO_DB
-    )
-    await consumer_manager.create_bg_consumer(
-        topic=config.KafkaTopic.SAVE_RESPONSE_TO_DB
-    )
-    await consumer_manager.create_bg_consumer(
-        topic=config.KafkaTopic.WRITE_DB,
-        group_id="write_db"
-    )
-    await consumer_manager.create_bg_consumer(
-        topic=config.KafkaTopic.UPDATE_DB,
-        group_id="update_db"
-    )
-    await consume()
+    await producer_manager.start()
+    send_queue.start()
+    await rpc_client.start()
+    """With API_RUN_CONSUMERS off the consumers run in `python -m app.worker`
+        processes, scaled apart from the HTTP workers"""
+    if settings.api_run_consumers:
+        await runner.start_consumers(runner.consumer_specs())
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    """
+    Drain in dependency order. Uvicorn has stopped accepting connections
+    and finished the in-flight requests by now; the audit messages they
+    queued are flushed before the consumers drain (which still send
+    replies and retries through the producer), and the database pool is
+    closed last.
+    """
     logger.info('Shutting down API')
-    if config.Task.SAVE_RESPONSE_TO_DB is not None:
-        config.Task.SAVE_REQUEST_TO_DB.cancel()
-    if config.Task.SAVE_RESPONSE_TO_DB is not None:
-        config.Task.SAVE_RESPONSE_TO_DB.cancel()
-    if config.Task.WRITE_DB is not None:
-        config.Task.WRITE_DB.cancel()
-    if config.Task.UPDATE_DB is not None:
-        config.Task.UPDATE_DB.cancel()
-
-    await consumer_manager.stop_consumer(
-        topic=config.KafkaTopic.SAVE_REQUEST_TO_DB
-    )
-    await consumer_manager.stop_consumer(
-        topic=config.KafkaTopic.SAVE_RESPONSE_TO_DB
-    )
-    await consumer_manager.stop_consumer(
-        topic=config.KafkaTopic.WRITE_DB
-    )
-    await consumer_manager.stop_consumer(
-        topic=config.KafkaTopic.UPDATE_DB
-    )
-
-async def consume():
-    config.Task.SAVE_REQUEST_TO_DB = asyncio.create_task(
-        consumer_manager.bg_consume(
-            topic=config.KafkaTopic.SAVE_REQUEST_TO_DB
-        )
-    )
-    config.Task.SAVE_RESPONSE_TO_DB = asyncio.create_task(
-        consumer_manager.bg_consume(
-            topic=config.KafkaTopic.SAVE_RESPONSE_TO_DB
-        )
-    )
-    config.Task.WRITE_DB = asyncio.create_task(
-        consumer_manager.bg_consume(
-            topic=config.KafkaTopic.WRITE_DB
-        )
-    )
-    config.Task.UPDATE_DB = asyncio.create_task(
-        consumer_manager.bg_consume(
-            topic=config.KafkaTopic.UPDATE_DB
-        )
-    )
+    await send_queue.stop(timeout=settings.shutdown_drain_timeout)
+    await producer_manager.flush()
+    if settings.api_run_consumers:
+        await runner.stop_consumers(runner.consumer_specs())
+    await rpc_client.stop()
+    await producer_manager.stop()
+    await asyncio.get_running_loop().run_in_executor(None, close_pools)
+    logger.info('API shut down')
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Expose Kafka producer/consumer, DB action and request stage metrics in Prometheus text format"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,104 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+
+"""Kafka consumers"""
+KAFKA_CONSUMER_MESSAGES = Counter(
+    "kafka_consumer_messages_total",
+    "Messages consumed, per topic and partition.",
+    ["topic", "partition"]
+)
+KAFKA_CONSUMER_LAG = Gauge(
+    "kafka_consumer_lag",
+    "Messages between the last fetched offset and the partition high watermark.",
+    ["topic", "partition"]
+)
+KAFKA_CONSUMER_BATCH_SIZE = Histogram(
+    "kafka_consumer_batch_size",
+    "Messages returned by one fetch.",
+    ["topic"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+KAFKA_CONSUMER_HANDLER_SECONDS = Histogram(
+    "kafka_consumer_handler_seconds",
+    "Time spent handling a message or a batch of messages.",
+    ["topic", "action"]
+)
+KAFKA_CONSUMER_HANDLER_ERRORS = Counter(
+    "kafka_consumer_handler_errors_total",
+    "Messages or batches whose handler raised.",
+    ["topic"]
+)
+KAFKA_MESSAGES_RETRIED = Counter(
+    "kafka_messages_retried_total",
+    "Failed messages sent to the delayed-retry topic, per original topic.",
+    ["topic"]
+)
+KAFKA_MESSAGES_DEAD_LETTERED = Counter(
+    "kafka_messages_dead_lettered_total",
+    "Poison or out-of-attempts messages sent to the dead-letter topic, per original topic.",
+    ["topic"]
+)
+
+"""Kafka producers"""
+KAFKA_PRODUCER_SEND_SECONDS = Histogram(
+    "kafka_producer_send_seconds",
+    "Time from handing a message to the producer until the broker acknowledged it.",
+    ["topic"]
+)
+KAFKA_PRODUCER_SEND_ERRORS = Counter(
+    "kafka_producer_send_errors_total",
+    "Messages the producer failed to deliver.",
+    ["topic"]
+)
+KAFKA_SEND_QUEUE_SIZE = Gauge(
+    "kafka_send_queue_size",
+    "Messages waiting in the in-process send queue."
+)
+KAFKA_SEND_QUEUE_DROPPED = Counter(
+    "kafka_send_queue_dropped_total",
+    "Messages dropped because the send queue was full.",
+    ["policy"]
+)
+
+"""HTTP requests"""
+HTTP_STAGE_SECONDS = Histogram(
+    "http_request_stage_seconds",
+    "Time spent in each stage of a request (auth, redis, mysql, llm, s3, kafka), per route template.",
+    ["route", "stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+"""Database connection pool"""
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled connection when a session scope starts.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool."
+)
+
+"""Database actions"""
+DB_ACTION_RETRIES = Counter(
+    "db_action_retries_total",
+    "Database actions retried after an SQLAlchemy error.",
+    ["operation"]
+)
+DB_STATEMENT_CACHE = Counter(
+    "db_statement_cache_lookups_total",
+    "Statement cache lookups of the generic DB actions, by hit or miss.",
+    ["result"]
+)
+
+"""Audit log retention"""
+AUDIT_LOG_ROWS_ARCHIVED = Counter(
+    "audit_log_rows_archived_total",
+    "Expired request/response log rows written to archive files.",
+    ["table"]
+)
+AUDIT_LOG_PARTITIONS_DROPPED = Counter(
+    "audit_log_partitions_dropped_total",
+    "Expired day partitions dropped from the request/response log tables.",
+    ["table"]
+)
@@ -1,10 +1,11 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Date, LargeBinary, ForeignKey, Enum, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Date, LargeBinary, ForeignKey, Enum, Float, Index, UniqueConstraint
 from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import DATETIME
 from sqlalchemy.orm import relationship
 import sys
 import os
+import datetime
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
@@ -104,12 +105,33 @@ class ClientDatabaseInfo(Base):
     database_keys = Column(String(255), nullable=False, comment="Keys associated with the client's database.")
     user = relationship(User)
 
+def utcnow() -> datetime.datetime:
+    """Naive UTC timestamp, the way the log tables store created_at."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+"""
+The log tables are range-partitioned by day on created_at (MySQL). New days
+are split off p_future and expired days are archived and dropped by
+app.audit_retention. MySQL requires the partitioning column in every unique
+key, so created_at is part of the primary key and of the request_id /
+response_id keys; the producer sets created_at, so a redelivered message
+carries the same value and is still recognised as a duplicate.
+"""
+AUDIT_LOG_PARTITION_BY = "RANGE (TO_DAYS(created_at)) (PARTITION p_future VALUES LESS THAN MAXVALUE)"
+
 class RequestLog(Base):
     """RequestLog table stores logs of incoming requests."""
     __tablename__ = "request_logs"
-
-    id = Column(Integer, primary_key=True, nullable=False, comment="Primary key for the RequestLog table.")
-    request_id = Column(String(255), nullable=False, index=True, comment="Unique identifier for the incoming request.")
+    __table_args__ = (
+        UniqueConstraint("request_id", "created_at", name="uq_request_logs_request_id"),
+        Index("ix_request_logs_created_at", "created_at"),
+        Index("ix_request_logs_route_name_created_at", "route_name", "created_at"),
+        Index("ix_request_logs_url_path_created_at", "url_path", "created_at"),
+        {"mysql_partition_by": AUDIT_LOG_PARTITION_BY},
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True, nullable=False, comment="Primary key for the RequestLog table.")
+    request_id = Column(String(255), nullable=False, comment="Unique identifier for the incoming request.")
     method = Column(String(255), comment="HTTP method of the request.")
     url_path = Column(String(255), comment="URL path of the request.")
     query_params = Column(LONGTEXT, comment="Query parameters of the request.")
@@ -120,16 +142,30 @@ class RequestLog(Base):
     referer = Column(String(255), comment="Referer information from the request.")
     cookies = Column(LONGTEXT, comment="Cookies sent with the request.")
     route_name = Column(String(255), comment="Name of the route in the application.")
-    created_at = Column(DATETIME(timezone=True), server_default=text('CURRENT_TIMESTAMP'), nullable=False, comment="Timestamp of log creation.")
+    created_at = Column(DATETIME(timezone=True), primary_key=True, default=utcnow, server_default=text('CURRENT_TIMESTAMP'), nullable=False, comment="Timestamp of log creation, the partitioning key.")
 
 class ResponseLog(Base):
     """ResponseLog table stores logs of outgoing responses."""
     __tablename__ = 'response_logs'
-
-    id = Column(Integer, primary_key=True, nullable=False, comment="Primary key for the ResponseLog table.")
-    request_id = Column(String(255), nullable=False, index=True, comment="Foreign key linking to the RequestLog table.")
-    response_id = Column(String(255), nullable=False, index=True, comment="Unique identifier for the outgoing response.")
+    __table_args__ = (
+        UniqueConstraint("response_id", "created_at", name="uq_response_logs_response_id"),
+        Index("ix_response_logs_request_id", "request_id"),
+        Index("ix_response_logs_created_at", "created_at"),
+        {"mysql_partition_by": AUDIT_LOG_PARTITION_BY},
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True, nullable=False, comment="Primary key for the ResponseLog table.")
+    request_id = Column(String(255), nullable=False, comment="Foreign key linking to the RequestLog table.")
+    response_id = Column(String(255), nullable=False, comment="Unique identifier for the outgoing response.")
     response_status_code = Column(Integer, comment="HTTP status code of the response.")
     response_headers = Column(LONGTEXT, comment="Headers of the outgoing response.")
     response_body = Column(LONGTEXT, comment="Body content of the outgoing response.")
-    created_at = Column(DATETIME(timezone=True), server_default=text('CURRENT_TIMESTAMP'), nullable=False, comment="Timestamp of log creation.")
+    duration_ms = Column(Float, nullable=True, comment="Time in milliseconds between receiving the request and sending the response.")
+    created_at = Column(DATETIME(timezone=True), primary_key=True, default=utcnow, server_default=text('CURRENT_TIMESTAMP'), nullable=False, comment="Timestamp of log creation, the partitioning key.")
+
+class ProcessedMessage(Base):
+    """ProcessedMessage table stores the idempotency keys of Kafka messages whose writes were committed."""
+    __tablename__ = "processed_messages"
+
+    idempotency_key = Column(String(64), primary_key=True, comment="Idempotency key from the message envelope.")
+    created_at = Column(DATETIME(timezone=True), server_default=text('CURRENT_TIMESTAMP'), nullable=False, index=True, comment="Timestamp the message was processed.")
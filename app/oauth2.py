@@ -6,7 +6,7 @@ import os
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
-from . import database, models
+from . import database, models, timing
 from fastapi import status, HTTPException, Depends
 from sqlalchemy.orm import Session
 from .config import settings
@@ -35,12 +35,14 @@ def create_access_refresh_token(data : dict, is_access_only = False):
 def verify_access_token(token : str, credentials_exception):
     r = database.get_redis_client_return()
     # try:
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    with timing.stage("token_decode"):
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     id: str = payload.get("user_id")
     if id is None:
         print("No Access Token Here 1")
         raise credentials_exception
-    access_token = r.get(f"{id}:access_token")
+    with timing.stage("redis"):
+        access_token = r.get(f"{id}:access_token")
     if not access_token:
         print("No Access Token Here 2")
         raise credentials_exception
@@ -60,5 +62,6 @@ def get_current_user(token: str, db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                           detail=f"Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
     user_id = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
+    with timing.stage("mysql_user"):
+        user = db.query(models.User).filter(models.User.user_id == user_id).first()
     return user
\ No newline at end of file
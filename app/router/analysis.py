@@ -12,9 +12,7 @@ from redis import ConnectionError, Redis
 from fastapi.responses import JSONResponse, StreamingResponse
 from ..analysis.utils import get_recommendation, get_analysis_recommendation, test_streamimg
 from ..analysis.text2sql import Text2SQL
-import pandas as pd
 import json
-from openai import OpenAI
 from ..config import settings
 
 router = APIRouter(
@@ -106,6 +104,7 @@ async def get_analysis_results(language:str, access_token :str =  Header(None),d
     analysis_results = analysis_results.decode('utf-8')
     industry = industry.decode('utf-8')
     # Read JSON file into a DataFrame
+    import pandas as pd
     try:
         df = pd.read_json(json.loads(analysis_results)).to_string()
     except Exception:
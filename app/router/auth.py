@@ -78,7 +78,8 @@ async def register(
 
     await producer_manager.send(
         topic=config.KafkaTopic.WRITE_DB,
-        value = kafka_value
+        value = kafka_value,
+        key = user.email
     )
     return JSONResponse(content={"message": "Successfully registered"}, status_code=200)
 
@@ -282,7 +283,8 @@ async def reset_password(user_info: schemas.ResetPassword, db: Session = Depends
 
         await producer_manager.send(
             topic=config.KafkaTopic.UPDATE_DB,
-            value = kafka_value
+            value = kafka_value,
+            key = user.user_id
         )
     return JSONResponse(content={"message": f"Reset password sucessfully."}, status_code=200)
 
@@ -351,7 +353,8 @@ async def change_password(
 
         await producer_manager.send(
             topic=config.KafkaTopic.UPDATE_DB,
-            value = kafka_value
+            value = kafka_value,
+            key = current_user.user_id
         )
     return JSONResponse(content={"message": "Successfully change password"}, status_code=200)
 
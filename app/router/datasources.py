@@ -14,7 +14,6 @@ from .. import utils, schemas,models
 from ..kafka import config
 from ..kafka.producers import producer_manager
 from redis import Redis
-import pandas as pd
 import redis
 from bson import ObjectId
 
@@ -25,6 +24,7 @@ router = APIRouter(
 
 @router.post("/upload_csv")
 async def upload_csv(file: UploadFile = File(...),access_token :str =  Header(None),db:Session = Depends(get_db), collection: Collection = Depends(get_mongo_collection), r:Redis = Depends(get_redis_client)):
+    import pandas as pd
     current_user = utils.authentication(access_token,db)
     try:
         df = pd.read_csv(file.file)
@@ -88,7 +88,8 @@ async def add_database(connections: schemas.DatabaseConnection, db:Session = Dep
     }
     await producer_manager.send(
         topic=config.KafkaTopic.WRITE_DB,
-        value = kafka_value
+        value = kafka_value,
+        key = current_user.user_id
     )
     return connections
 
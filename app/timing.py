@@ -0,0 +1,92 @@
+import sys, os, time, functools, inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from . import metrics
+
+
+"""Route label of stages timed outside a request (consumers, background tasks)"""
+BACKGROUND_ROUTE = "background"
+
+
+class RequestTiming:
+    """
+    The stages of one request and the time spent in each. A stage entered
+    several times accumulates; nested stages are recorded independently.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """The stages so far as a Server-Timing header value, plus the total"""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def observe(self, route: str):
+        """Feed the stages into the per-route, per-stage histogram"""
+        for name, seconds in self.stages.items():
+            metrics.HTTP_STAGE_SECONDS.labels(route, name).observe(seconds)
+
+
+"""
+The timing of the request being handled. It holds a mutable object, so
+stages timed in threadpool dependencies and endpoints (which run in a copy
+of the context) are recorded on the same request.
+"""
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+def begin() -> RequestTiming:
+    """Start timing the request handled in the current context"""
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+
+def current() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block as a stage of the current request. Outside a request the
+    duration goes straight to the histogram under the background route.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timing = _current.get()
+        if timing is not None:
+            timing.add(name, elapsed)
+        else:
+            metrics.HTTP_STAGE_SECONDS.labels(BACKGROUND_ROUTE, name).observe(elapsed)
+
+
+def timed(name: str):
+    """Decorator form of stage, for sync and async functions"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -3,19 +3,23 @@ from fastapi import HTTPException, status, Request
 from starlette.types import Message
 from sqlalchemy.orm import Session
 from cryptography.fernet import Fernet
-import sys, os, time, random, string
+import sys, os, time, random, string, functools
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(app_dir)
-from . import oauth2
+from . import oauth2, timing
 from .models import User
 from .config import settings
 from .logger import logger
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated = "auto")
 SECRET_KEY = settings.secret_key_encryp
-cipher_suite = Fernet(SECRET_KEY)
+
+@functools.lru_cache(maxsize=None)
+def get_cipher_suite() -> Fernet:
+    """The Fernet cipher, built on first use rather than at import"""
+    return Fernet(SECRET_KEY)
 
 def hash(password: str)-> bool:
     """
@@ -42,6 +46,7 @@ def verify(plain_password, hashed_password)->bool:
     """
     return pwd_context.verify(plain_password, hashed_password)
 
+@timing.timed("auth")
 def authentication(access_token:str, db: Session) -> User:
     """
     Performs user authentication based on the provided access token.
@@ -76,7 +81,7 @@ def encrypt_data(data:str) -> str:
     Returns:
         str: The encrypted data.
     """
-    return cipher_suite.encrypt(data.encode()).decode()
+    return get_cipher_suite().encrypt(data.encode()).decode()
 
 def decrypt_data(encrypted_data: str) -> str:
     """
@@ -88,7 +93,7 @@ def decrypt_data(encrypted_data: str) -> str:
     Returns:
         str: The decrypted data.
     """
-    return cipher_suite.decrypt(encrypted_data.encode()).decode()
+    return get_cipher_suite().decrypt(encrypted_data.encode()).decode()
 
 
 def generate_unique_id():
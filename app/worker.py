@@ -0,0 +1,124 @@
+"""
+Run the Kafka consumers without the HTTP API, so ingestion scales apart
+from request serving (start the API with API_RUN_CONSUMERS=false).
+
+Usage:
+    python -m app.worker [--topic write_db --topic update_db] [--concurrency write_db=4]
+
+Without --topic every consumer runs (WORKER_TOPICS narrows the default).
+--concurrency (or WORKER_CONCURRENCY, JSON) runs a topic in several
+processes; they join the same consumer group, so Kafka spreads the topic's
+partitions over them. Process i runs every selected topic whose concurrency
+is above i, so topics left at 1 share the first process.
+
+Each process serves its Prometheus metrics on WORKER_METRICS_PORT plus its
+index (9100, 9101, ... by default; 0 turns the endpoint off), the API's
+/metrics only covers consumers running inside the API.
+"""
+import sys, os, signal, asyncio, argparse, multiprocessing
+from typing import Dict, List
+from prometheus_client import start_http_server
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+sys.path.append(app_dir)
+from .kafka import runner
+from .kafka.consumers import loop
+from .kafka.producers import producer_manager
+from .logger import logger
+from .database import close_pools
+from .config import settings
+
+
+async def serve(topics: List[str]):
+    """Run the consumers of the given topics until SIGTERM/SIGINT or until one of them fails"""
+    specs = runner.select_specs(topics)
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+
+    await producer_manager.start()
+    await runner.start_consumers(specs)
+    logger.info(f'Worker {os.getpid()} consuming {[spec.topic for spec in specs]}')
+    try:
+        stop = asyncio.create_task(stopping.wait())
+        done, _ = await asyncio.wait(
+            [stop, *runner.consumer_tasks(specs)],
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        if stop not in done:
+            logger.error('A consumer stopped unexpectedly, shutting the worker down')
+        stop.cancel()
+    finally:
+        """The consumers finish and commit their work while the producer can still send replies and retries"""
+        await runner.stop_consumers(specs)
+        await producer_manager.stop()
+        await asyncio.get_running_loop().run_in_executor(None, close_pools)
+        logger.info(f'Worker {os.getpid()} stopped')
+
+
+def metrics_port(index: int) -> int:
+    """The port of the metrics endpoint of the worker process with the given index, 0 when disabled"""
+    if not settings.worker_metrics_port:
+        return 0
+    return settings.worker_metrics_port + index
+
+
+def run_process(topics: List[str], index: int = 0):
+    """Entry point of one worker process; the consumers are bound to the module-level loop"""
+    port = metrics_port(index)
+    if port:
+        start_http_server(port)
+        logger.info(f'Worker {os.getpid()} serving metrics on port {port}')
+    loop.run_until_complete(serve(topics))
+
+
+def process_topics(topics: List[str], concurrency: Dict[str, int]) -> List[List[str]]:
+    """The topics of each worker process for the requested per-topic concurrency"""
+    processes = max([concurrency.get(topic, 1) for topic in topics], default=1)
+    return [
+        [topic for topic in topics if concurrency.get(topic, 1) > i]
+        for i in range(processes)
+    ]
+
+
+def parse_concurrency(values: List[str]) -> Dict[str, int]:
+    concurrency = dict(settings.worker_concurrency)
+    for value in values:
+        topic, _, count = value.partition("=")
+        concurrency[topic] = int(count)
+    return concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Kafka consumers.")
+    parser.add_argument("--topic", action="append", default=[])
+    parser.add_argument("--concurrency", action="append", default=[], metavar="TOPIC=N")
+    args = parser.parse_args()
+
+    topics = [spec.topic for spec in runner.select_specs(args.topic or settings.worker_topics)]
+    groups = process_topics(topics, parse_concurrency(args.concurrency))
+    if len(groups) == 1:
+        run_process(groups[0])
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_process, args=(group, index), daemon=False)
+        for index, group in enumerate(groups)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measure request_logs insert throughput (rows/s) for the per-row path used
+by bg_consume (save_request_to_db) against the batched path used by
+bg_consume_batch (save_requests_to_db).
+
+Usage:
+    python -m benchmarks.audit_insert_throughput --rows 2000 --batch-size 500
+
+Runs against the MySQL database configured in .env unless --url is given.
+Rows written by the benchmark are deleted afterwards.
+"""
+import argparse, asyncio, time, uuid
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import SQLALCHEMY_DATABASE_URL
+from app.kafka import actions
+
+
+def make_requests(prefix: str, count: int, body_size: int) -> list:
+    body = "x" * body_size
+    return [
+        {
+            "request_id": f"{prefix}_{i}",
+            "method": "POST",
+            "url_path": "/auth/login",
+            "query_params": "{}",
+            "request_headers": "{'content-type': 'application/json'}",
+            "request_body": body,
+            "client_ip": "127.0.0.1",
+            "user_agent": "benchmark",
+            "referer": None,
+            "cookies": "{}",
+            "route_name": "",
+        }
+        for i in range(count)
+    ]
+
+
+async def per_row(Session, requests: list) -> float:
+    start = time.perf_counter()
+    for request in requests:
+        await actions.save_request_to_db(request, db=Session())
+    return time.perf_counter() - start
+
+
+async def batched(Session, requests: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(requests), batch_size):
+        await actions.save_requests_to_db(
+            requests[i:i + batch_size], db=Session()
+        )
+    return time.perf_counter() - start
+
+
+def cleanup(Session, prefix: str):
+    db = Session()
+    try:
+        db.query(models.RequestLog).filter(
+            models.RequestLog.request_id.like(f"{prefix}_%")
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--body-size", type=int, default=512)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    models.RequestLog.__table__.create(engine, checkfirst=True)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+
+    try:
+        elapsed = await per_row(
+            Session, make_requests(f"{prefix}_row", args.rows, args.body_size)
+        )
+        print(f"per-row : {args.rows / elapsed:10.1f} rows/s ({elapsed:.2f}s)")
+
+        elapsed = await batched(
+            Session, 
+            make_requests(f"{prefix}_batch", args.rows, args.body_size),
+            args.batch_size
+        )
+        print(f"batched : {args.rows / elapsed:10.1f} rows/s ({elapsed:.2f}s, "
+              f"batch size {args.batch_size})")
+    finally:
+        cleanup(Session, prefix)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
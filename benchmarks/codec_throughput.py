@@ -0,0 +1,74 @@
+"""
+Measure per-message encode/decode cost of the Kafka message codec against
+the previous json.dumps/json.loads path, for a range of payload sizes.
+
+Usage:
+    python -m benchmarks.codec_throughput --iterations 2000
+"""
+import argparse, json, time
+
+from app.kafka.codec import MessageCodec, Compression, zstandard, lz4
+
+
+def make_message(body_size: int) -> dict:
+    return {
+        "action": "save_request_to_db",
+        "data": {
+            "request_id": "1700000000_abcdef",
+            "method": "POST",
+            "url_path": "/analysis/text2sql",
+            "request_headers": "{'content-type': 'application/json'}",
+            "request_body": ("lorem ipsum dolor sit amet " * (body_size // 27 + 1))[:body_size],
+        }
+    }
+
+
+def legacy_encode(value: dict) -> bytes:
+    return json.dumps(value).encode('utf-8')
+
+
+def legacy_decode(raw: bytes) -> dict:
+    """The old consumers parsed every message twice (action, then data)"""
+    json.loads(raw).get("action")
+    return json.loads(raw).get("data")
+
+
+def measure(encode, decode, message: dict, iterations: int):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        raw = encode(message)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(raw)
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+    return encode_us, decode_us, len(raw)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 4096, 65536, 1048576])
+    args = parser.parse_args()
+
+    codecs = [("json (legacy)", legacy_encode, legacy_decode)]
+    plain = MessageCodec(compression=Compression.NONE)
+    codecs.append(("orjson", plain.encode, plain.decode))
+    if zstandard is not None:
+        zstd = MessageCodec(compression=Compression.ZSTD, threshold=4096)
+        codecs.append(("orjson+zstd", zstd.encode, zstd.decode))
+    if lz4 is not None:
+        lz4_codec = MessageCodec(compression=Compression.LZ4, threshold=4096)
+        codecs.append(("orjson+lz4", lz4_codec.encode, lz4_codec.decode))
+
+    print(f"{'codec':<15}{'body bytes':>12}{'wire bytes':>12}{'encode us':>12}{'decode us':>12}")
+    for size in args.sizes:
+        message = make_message(size)
+        iterations = max(10, args.iterations * 256 // max(size, 256))
+        for name, encode, decode in codecs:
+            encode_us, decode_us, wire = measure(encode, decode, message, iterations)
+            print(f"{name:<15}{size:>12}{wire:>12}{encode_us:>12.2f}{decode_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Measure the cold-start import time of the API, per module, with
+`python -X importtime`.
+
+Usage:
+    python -m benchmarks.import_time --module app.main --top 20 --repeat 3
+
+Prints the total time to import the module and the slowest imports by
+cumulative time (including what they import). Each run is a fresh
+interpreter; the fastest run is reported.
+"""
+import argparse, re, subprocess, sys
+
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_times(module: str) -> dict:
+    """Cumulative import time in microseconds per module, from one fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[args.module])
+    print(f"import {args.module}: {best[args.module] / 1000:8.1f} ms (best of {args.repeat})")
+
+    print(f"\nslowest imports by cumulative time:")
+    slowest = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    for name, micros in [item for item in slowest if item[0] != args.module][:args.top]:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure the Kafka message path (send queue -> producer -> partition workers
+-> dispatch, and an RPC round trip) on the in-process broker, so it can run
+in CI without a Kafka cluster. DB actions are replaced by a no-op, so the
+numbers cover queueing, encoding, routing and offset bookkeeping only.
+
+Usage:
+    python -m benchmarks.kafka_pipeline --messages 20000 --calls 500
+"""
+import argparse, asyncio, os, time
+
+os.environ["KAFKA_TRANSPORT"] = "memory"
+
+from app.kafka import config
+from app.kafka.consumers import consumer_manager
+from app.kafka.producers import producer_manager, send_queue
+from app.kafka.rpc import rpc_client
+
+
+async def run(messages: int, calls: int, body_size: int):
+    handled = asyncio.Event()
+    count = 0
+
+    async def dispatch(action, data, idempotency_key=None, reply=False):
+        nonlocal count
+        count += 1
+        if count == messages:
+            handled.set()
+        return {"ok": True}
+
+    consumer_manager.dispatch = dispatch
+
+    await producer_manager.start()
+    send_queue.start()
+    await rpc_client.start()
+    topics = (config.KafkaTopic.UPDATE_DB, config.KafkaTopic.READ_DB)
+    for topic in topics:
+        await consumer_manager.create_bg_consumer(topic, topic)
+    tasks = [asyncio.create_task(consumer_manager.bg_consume(topic)) for topic in topics]
+
+    body = "x" * body_size
+    start = time.perf_counter()
+    for i in range(messages):
+        await send_queue.put(
+            config.KafkaTopic.UPDATE_DB,
+            {"action": config.KafkaAction.UPDATE_DB, "data": {"i": i, "body": body}},
+            key=str(i % 64)
+        )
+    await handled.wait()
+    elapsed = time.perf_counter() - start
+    print(f"pipeline: {messages} messages in {elapsed:.3f}s ({messages / elapsed:,.0f} msg/s)")
+
+    start = time.perf_counter()
+    for i in range(calls):
+        await rpc_client.call(config.KafkaTopic.READ_DB, config.KafkaAction.READ_DB, {"i": i})
+    elapsed = time.perf_counter() - start
+    print(f"rpc: {calls} calls in {elapsed:.3f}s ({elapsed / calls * 1e3:.3f} ms/call)")
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await rpc_client.stop()
+    await send_queue.stop()
+    await producer_manager.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--body-size", type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.calls, args.body_size))
+
+
+if __name__ == "__main__":
+    main()
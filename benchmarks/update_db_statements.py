@@ -0,0 +1,93 @@
+"""
+Measure per-message CPU time of the update_db path with the cached
+statements against the previous per-message query construction (match over
+the schemas, if/elif operator chain, Query.update), on an in-memory SQLite
+users table.
+
+Usage:
+    python -m benchmarks.update_db_statements --messages 5000
+"""
+import argparse, time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.kafka import config, statements
+
+
+def legacy_update(db, schemas, update_data, filters):
+    match schemas:
+        case config.DatabaseSchemas.USER:
+            model = models.User
+        case config.DatabaseSchemas.USER_PROFILE:
+            model = models.UserProfile
+    filter_conditions = []
+    for column, operator, value in filters:
+        if operator == "=" or operator == "==":
+            filter_conditions.append(getattr(model, column) == value)
+        elif operator == ">":
+            filter_conditions.append(getattr(model, column) > value)
+        elif operator == "<":
+            filter_conditions.append(getattr(model, column) < value)
+        elif operator == ">=":
+            filter_conditions.append(getattr(model, column) >= value)
+        elif operator == "<=":
+            filter_conditions.append(getattr(model, column) <= value)
+    update_dict = {column: value for column, value in update_data}
+    db.query(model).filter(*filter_conditions).update(update_dict)
+    db.commit()
+
+
+def cached_update(db, schemas, update_data, filters):
+    update_dict = {column: value for column, value in update_data}
+    statement = statements.update_statement(schemas, list(update_dict), filters)
+    params = statements.filter_params(schemas, filters)
+    params.update(statements.update_params(schemas, update_dict))
+    db.execute(statement, params)
+    db.commit()
+
+
+def measure(update, session_factory, messages: int, users: int) -> float:
+    db = session_factory()
+    start = time.process_time()
+    for i in range(messages):
+        update(
+            db,
+            config.DatabaseSchemas.USER,
+            [["password", f"hash-{i}"]],
+            [["user_id", "==", i % users + 1]]
+        )
+    elapsed = time.process_time() - start
+    db.close()
+    return elapsed / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    models.User.__table__.create(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with session_factory() as db:
+        db.add_all(
+            models.User(username=f"user{i}", password="x", email=f"user{i}@example.com", role="tech")
+            for i in range(args.users)
+        )
+        db.commit()
+
+    """Warm up both paths so SQLAlchemy's own compiled cache is populated"""
+    for update in (legacy_update, cached_update):
+        measure(update, session_factory, 100, args.users)
+
+    legacy_us = measure(legacy_update, session_factory, args.messages, args.users)
+    cached_us = measure(cached_update, session_factory, args.messages, args.users)
+    print(f"{'path':<12}{'cpu us/msg':>12}")
+    print(f"{'legacy':<12}{legacy_us:>12.1f}")
+    print(f"{'cached':<12}{cached_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+from cryptography.fernet import Fernet
+
+"""Settings the app reads at import time; Kafka runs on the in-memory transport"""
+TEST_SETTINGS = {
+    "DB_USER": "test", "DB_PASSWORD": "test", "DB_HOST": "localhost", "DB_NAME": "test",
+    "SECRET_KEY": "test", "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_HOURS": "1",
+    "REFRESH_TOKEN_EXPIRE_WEEKS": "1", "PIN_EXPIRATION_TIME": "300",
+    "OPENAI_API_KEY": "test", "OPENAI_ORGANIZATION": "test",
+    "DATABASE_USER": "test", "DATABASE_PASSWORD": "test", "DATABASE_HOST": "localhost", "DATABASE_NAME": "test",
+    "AWS_ACCESS_KEY": "test", "AWS_SECRET_KEY": "test", "AWS_BUCKET_NAME": "test",
+    "MONGO_DB_HOST": "localhost", "MONGO_DB_NAME": "test", "MONGO_DB_COLLECTION": "test",
+    "REDIS_DB_HOST": "localhost", "SECRET_KEY_ENCRYP": Fernet.generate_key().decode(),
+    "BOOTSTRAP_SERVERS": "localhost:9092", "INSTANCE_NAME": "test",
+    "SMTP_SERVER": "localhost", "SMTP_PORT": "25", "SENDER_EMAIL": "test@example.com", "SENDER_PASSWORD": "test",
+    "KAFKA_TRANSPORT": "memory",
+}
+for key, value in TEST_SETTINGS.items():
+    os.environ.setdefault(key, value)
+os.makedirs(os.path.join(os.path.dirname(__file__), "..", "app", "files"), exist_ok=True)
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+
+@pytest.fixture
+def sqlite_db():
+    """
+    Bind the sessions of the app to an in-memory SQLite database. Returns a
+    function creating the tables of the given models.
+    """
+    from app import database
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    bind = database.SessionLocal.kw["bind"]
+    database.SessionLocal.configure(bind=engine)
+
+    def create_tables(*models):
+        for model in models:
+            model.__table__.create(engine)
+        return engine
+
+    yield create_tables
+    database.SessionLocal.configure(bind=bind)
+    engine.dispose()
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on the loop the Kafka managers were created with"""
+    from app.kafka.consumers import loop
+    return loop.run_until_complete
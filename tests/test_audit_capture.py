@@ -0,0 +1,34 @@
+from starlette.datastructures import Headers
+
+from app import audit_capture
+
+
+def test_credential_headers_are_redacted():
+    headers = Headers({
+        "access-token": "secret-token",
+        "Authorization": "Bearer secret",
+        "cookie": "session=secret",
+        "content-type": "application/json",
+    })
+
+    captured = audit_capture.capture_headers(headers, audit_capture.DEFAULT_POLICY)
+
+    assert "secret" not in captured
+    assert "application/json" in captured
+    assert captured.count(audit_capture.REDACTED) == 3
+
+
+def test_compressed_body_round_trips(monkeypatch):
+    monkeypatch.setattr(audit_capture.settings, "audit_body_compress_min_bytes", 16)
+    body = '{"question": "' + "how many orders shipped last week? " * 50 + '"}'
+
+    stored = audit_capture.compress_body(body)
+
+    assert stored.startswith(audit_capture.ZSTD_BODY_PREFIX)
+    assert audit_capture.decode_body(stored) == body
+
+
+def test_plain_bodies_decode_unchanged():
+    assert audit_capture.decode_body(None) is None
+    assert audit_capture.decode_body('{"a": 1}') == '{"a": 1}'
+    assert audit_capture.decode_body("zstd:not base64!") == "zstd:not base64!"
@@ -0,0 +1,66 @@
+import datetime, gzip
+import orjson
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, Text, select
+
+from app import audit_capture, models
+from app.audit_retention import AuditLogRetention, zstandard
+
+
+class FakePartitions(AuditLogRetention):
+    """Records the partition maintenance of a pass, as on MySQL"""
+    partitioned = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def acquire_lock(self, conn):
+        return True
+
+    def release_lock(self, conn):
+        pass
+
+    def add_partitions(self, conn, table, today):
+        self.calls.append("add")
+        return []
+
+    def expire_partitions(self, conn, table, cutoff):
+        self.calls.append("expire")
+        return []
+
+
+@pytest.mark.parametrize("retention_days, expected", [(0, ["add"]), (30, ["add", "expire"])])
+def test_partitions_are_added_when_logs_are_kept(sqlite_db, retention_days, expected):
+    engine = sqlite_db()
+    retention = FakePartitions(engine, [models.RequestLog.__table__], retention_days=retention_days)
+    retention.run_once()
+    assert retention.calls == expected
+
+
+def test_archive_decodes_compressed_bodies(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(audit_capture.settings, "audit_body_compress_min_bytes", 16)
+    body = "select * from orders where shipped; " * 50
+    """SQLite cannot create the partitioned request_logs, a table with its body column stands in"""
+    table = Table(
+        "request_logs", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("request_body", Text),
+        Column("created_at", DateTime),
+    )
+    engine = sqlite_db()
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert().values(
+            id=1, request_body=audit_capture.compress_body(body), created_at=datetime.datetime(2026, 1, 1)
+        ))
+        retention = AuditLogRetention(engine, [table], retention_days=30, archive_dir=str(tmp_path))
+        assert retention.archive(conn, table, select(table), "test") == 1
+
+    path, = (tmp_path / table.name).iterdir()
+    with open(path, "rb") as raw:
+        if zstandard:
+            lines = zstandard.ZstdDecompressor().stream_reader(raw).read().splitlines()
+        else:
+            lines = gzip.decompress(raw.read()).splitlines()
+    assert orjson.loads(lines[0])["request_body"] == body
@@ -0,0 +1,47 @@
+import asyncio
+from aiokafka.errors import CommitFailedError
+
+from app.kafka import actions, config
+from app.kafka.consumers import consumer_manager
+from app.kafka.producers import producer_manager
+
+
+TOPIC = config.KafkaTopic.SAVE_REQUEST_TO_DB
+
+
+def test_batch_consumer_survives_a_failed_commit(run, monkeypatch):
+    written = []
+
+    async def save_requests_to_db(requests, **kwargs):
+        written.extend(request["request_id"] for request in requests)
+    monkeypatch.setattr(actions, "save_requests_to_db", save_requests_to_db)
+
+    async def main():
+        await producer_manager.start()
+        await consumer_manager.create_batch_consumer(topic=TOPIC, group_id="test_batch")
+        consumer = consumer_manager.consumers[TOPIC]
+        commits = []
+
+        async def commit(offsets=None):
+            commits.append(offsets)
+            if len(commits) == 1:
+                raise CommitFailedError("group rebalanced")
+        consumer.commit = commit
+
+        task = asyncio.create_task(consumer_manager.bg_consume_batch(TOPIC, timeout_ms=50))
+        try:
+            for i in range(2):
+                await producer_manager.send(TOPIC, {"action": config.KafkaAction.SAVE_REQUEST_TO_DB, "data": {"request_id": i}})
+                for _ in range(100):
+                    if len(commits) > i:
+                        break
+                    await asyncio.sleep(0.01)
+            assert not task.done()
+            return len(commits)
+        finally:
+            consumer_manager.request_stop(TOPIC)
+            await asyncio.wait_for(task, timeout=5)
+            await producer_manager.stop()
+
+    assert run(main()) == 2
+    assert written == [0, 1]
@@ -0,0 +1,25 @@
+import os, subprocess, sys
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("module, args", [
+    ("benchmarks.kafka_pipeline", ["--messages", "200", "--calls", "5"]),
+    ("benchmarks.codec_throughput", ["--iterations", "5", "--sizes", "256", "65536"]),
+    ("benchmarks.update_db_statements", ["--messages", "50", "--users", "20"]),
+    ("benchmarks.import_time", ["--repeat", "1", "--top", "3"]),
+    pytest.param(
+        "benchmarks.audit_insert_throughput", [],
+        marks=pytest.mark.skip(reason="needs the MySQL database, the log tables cannot be created on SQLite")
+    ),
+])
+def test_benchmark_runs(module, args):
+    """Small runs of each benchmark, so they keep up with the code they measure"""
+    result = subprocess.run(
+        [sys.executable, "-m", module, *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from kafka import TopicPartition
+
+from app import models
+from app.kafka import actions, config, rpc
+from app.kafka.codec import codec
+from app.kafka.consumers import consumer_manager
+from app.kafka.memory import InMemoryRecord
+from app.kafka.retry import retry_scheduler
+
+
+USER = config.DatabaseSchemas.USER
+TP = TopicPartition(config.KafkaTopic.WRITE_DB, 0)
+
+
+def write_msg(offset: int, data):
+    value = {"action": config.KafkaAction.WRITE_DB, "data": data}
+    return InMemoryRecord(
+        topic=TP.topic, partition=TP.partition, offset=offset, timestamp=0,
+        key=None, value=codec.encode(value), headers=[]
+    )
+
+
+def user(name: str) -> dict:
+    return {"username": name, "password": "p", "email": f"{name}@example.com", "role": "tech", "schemas": USER}
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """The messages handed to the retry scheduler, with their errors"""
+    failures = []
+
+    async def schedule(msg, value, error, retries=None):
+        failures.append((msg.offset, error))
+    monkeypatch.setattr(retry_scheduler, "schedule", schedule)
+    return failures
+
+
+def consume(run, msgs):
+    """Run a write_db partition worker over `msgs` until it has handled all of them"""
+    queue = asyncio.Queue()
+    for msg in msgs:
+        queue.put_nowait(msg)
+    consumer_manager.processed_offsets[TP.topic] = {}
+
+    async def main():
+        worker = asyncio.create_task(consumer_manager.partition_worker(TP.topic, TP, queue))
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+    run(main())
+    return consumer_manager.processed_offsets[TP.topic][TP]
+
+
+def usernames(run):
+    return sorted(user.username for user in run(actions.read_db(USER, "all")))
+
+
+@pytest.mark.parametrize("bad", [None, {"rows": []}, "not a dict"])
+def test_poison_message_in_coalesced_batch(sqlite_db, run, scheduled, bad):
+    sqlite_db(models.User, models.ProcessedMessage)
+    msgs = [write_msg(0, user("a")), write_msg(1, user("b")), write_msg(2, bad), write_msg(3, user("c"))]
+
+    assert consume(run, msgs) == 4
+    assert usernames(run) == ["a", "b", "c"]
+    assert [offset for offset, _ in scheduled] == [2]
+
+
+def test_undecodable_message_in_coalesced_batch(sqlite_db, run, scheduled):
+    sqlite_db(models.User, models.ProcessedMessage)
+    garbage = InMemoryRecord(
+        topic=TP.topic, partition=TP.partition, offset=1, timestamp=0,
+        key=None, value=b"\xff not json", headers=[]
+    )
+    msgs = [write_msg(0, user("a")), garbage, write_msg(2, user("c"))]
+
+    assert consume(run, msgs) == 3
+    assert usernames(run) == ["a", "c"]
+    assert [offset for offset, _ in scheduled] == [1]
+
+
+def test_failed_batch_falls_back_to_single_writes(sqlite_db, run, scheduled):
+    sqlite_db(models.User, models.ProcessedMessage)
+    duplicate = user("a")
+    msgs = [write_msg(0, user("a")), write_msg(1, user("b")), write_msg(2, duplicate)]
+
+    assert consume(run, msgs) == 3
+    assert usernames(run) == ["a", "b"]
+    assert [offset for offset, _ in scheduled] == [2]
+
+
+@pytest.mark.parametrize("reply_to, refresh", [(None, False), ("replies", True)])
+def test_single_write_only_refreshes_for_a_reply(run, monkeypatch, reply_to, refresh):
+    calls = []
+
+    async def write_db(rows, schemas, **kwargs):
+        calls.append(kwargs["refresh"])
+    monkeypatch.setattr(actions, "write_db", write_db)
+    sent = []
+
+    async def send_reply(msg, reply_to, value):
+        sent.append(value)
+    monkeypatch.setattr(consumer_manager, "send_reply", send_reply)
+    msg = write_msg(0, user("a"))
+    if reply_to is not None:
+        msg.headers = [(rpc.REPLY_TO_HEADER, reply_to.encode()), (rpc.CORRELATION_ID_HEADER, b"1")]
+
+    run(consumer_manager.handle_message(msg))
+    assert calls == [refresh]
@@ -0,0 +1,37 @@
+import orjson
+import pytest
+
+from app.kafka.codec import CODEC_VERSION, Compression, MessageCodec, zstandard
+
+
+def test_envelope_gets_version_and_idempotency_key():
+    codec = MessageCodec()
+    value = codec.decode(codec.encode({"action": "write_db", "data": {"a": 1}}))
+    assert value["version"] == CODEC_VERSION
+    assert value["idempotency_key"]
+    assert value["data"] == {"a": 1}
+
+
+def test_idempotency_key_is_kept():
+    codec = MessageCodec()
+    envelope = {"version": CODEC_VERSION, "idempotency_key": "k1", "action": "x", "data": {}}
+    assert codec.decode(codec.encode(envelope))["idempotency_key"] == "k1"
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+def test_large_payloads_are_compressed():
+    codec = MessageCodec(compression=Compression.ZSTD, threshold=100)
+    small = codec.encode({"action": "x", "data": "a"})
+    large = codec.encode({"action": "x", "data": "a" * 1000})
+    assert small.startswith(b"{")
+    assert len(large) < 1000
+    assert codec.decode(large)["data"] == "a" * 1000
+
+
+def test_plain_json_from_older_producers_decodes():
+    assert MessageCodec().decode(orjson.dumps({"action": "x", "data": {}}))["action"] == "x"
+
+
+def test_newer_version_is_rejected():
+    with pytest.raises(ValueError):
+        MessageCodec().decode(orjson.dumps({"version": CODEC_VERSION + 1}))
@@ -0,0 +1,66 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.kafka import actions, config, statements
+
+
+USER = config.DatabaseSchemas.USER
+
+
+@pytest.fixture
+def users(sqlite_db, run):
+    sqlite_db(models.User, models.ProcessedMessage)
+    run(actions.write_db(
+        [{"username": f"u{i}", "password": "p", "email": f"e{i:02d}", "role": "tech"} for i in range(10)],
+        USER
+    ))
+
+
+def user_ids(run):
+    return [user.user_id for user in run(actions.read_db(USER, "all"))]
+
+
+@pytest.mark.parametrize("filters", [None, []])
+@pytest.mark.parametrize("chunk_size", [None, 3])
+def test_delete_without_filters_is_rejected(users, run, filters, chunk_size):
+    with pytest.raises(HTTPException) as error:
+        run(actions.delete_db(USER, filters, chunk_size=chunk_size))
+    assert error.value.status_code == 400
+    assert len(user_ids(run)) == 10
+
+
+@pytest.mark.parametrize("chunk_size", [None, 3])
+def test_delete_with_filters(users, run, chunk_size):
+    response = run(actions.delete_db(USER, [["user_id", "<=", 4]], chunk_size=chunk_size))
+    assert response.status_code == 204
+    assert user_ids(run) == list(range(5, 11))
+
+
+def test_delete_statements_need_conditions():
+    with pytest.raises(ValueError):
+        statements.delete_statement(USER, [])
+    with pytest.raises(ValueError):
+        statements.delete_chunk_statement(USER, None, 10)
+
+
+
+def test_chunked_delete_counts_chunks_committed_before_a_retry(users, run, monkeypatch):
+    commit = Session.commit
+    commits = []
+
+    def commit_then_lose_connection(self):
+        """Both chunks are committed, then the attempt fails and is retried with nothing left to delete"""
+        commit(self)
+        commits.append(self)
+        if len(commits) == 2:
+            raise OperationalError("DELETE", {}, Exception("connection lost"))
+    monkeypatch.setattr(Session, "commit", commit_then_lose_connection)
+
+    response = run(actions.delete_db(USER, [["user_id", "<=", 4]], chunk_size=3, retry_delay=0))
+
+    assert response.status_code == 204
+    assert len(commits) == 2
+    assert user_ids(run) == list(range(5, 11))
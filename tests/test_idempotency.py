@@ -0,0 +1,93 @@
+import datetime
+import pytest
+from sqlalchemy import insert, select
+
+from app import models
+from app.audit_retention import AuditLogRetention
+from app.kafka import actions, config
+
+
+USER = config.DatabaseSchemas.USER
+
+
+def user(name: str) -> dict:
+    return {"username": name, "password": "p", "email": f"{name}@example.com", "role": "tech"}
+
+
+@pytest.fixture
+def engine(sqlite_db):
+    return sqlite_db(models.User, models.ProcessedMessage)
+
+
+def usernames(run):
+    return sorted(user.username for user in run(actions.read_db(USER, "all")))
+
+
+def record_key(engine, key: str, created_at: datetime.datetime = None):
+    with engine.begin() as conn:
+        conn.execute(insert(models.ProcessedMessage), {
+            "idempotency_key": key,
+            **({"created_at": created_at} if created_at else {})
+        })
+
+
+@pytest.mark.parametrize("refresh", [True, False])
+def test_duplicate_key_is_written_once(engine, run, refresh):
+    run(actions.write_db(user("a"), USER, refresh=refresh, idempotency_keys=["k1"]))
+    assert run(actions.write_db(user("a"), USER, refresh=refresh, idempotency_keys=["k1"])) is None
+    assert usernames(run) == ["a"]
+
+
+@pytest.mark.parametrize("refresh", [True, False])
+def test_key_recorded_concurrently_is_skipped(engine, run, monkeypatch, refresh):
+    """Another consumer records the key between the check and the insert"""
+    processed_keys = actions._processed_keys
+    checks = []
+
+    def racing_processed_keys(db, keys):
+        checks.append(keys)
+        if len(checks) == 1:
+            record_key(engine, "k1")
+            return set()
+        return processed_keys(db, keys)
+    monkeypatch.setattr(actions, "_processed_keys", racing_processed_keys)
+
+    assert run(actions.write_db(user("a"), USER, refresh=refresh, idempotency_keys=["k1"], max_retries=1)) is None
+    assert usernames(run) == []
+    assert len(checks) == 2
+
+
+def test_concurrent_key_only_skips_its_own_rows(engine, run, monkeypatch):
+    processed_keys = actions._processed_keys
+    checks = []
+
+    def racing_processed_keys(db, keys):
+        checks.append(keys)
+        if len(checks) == 1:
+            record_key(engine, "k2")
+            return set()
+        return processed_keys(db, keys)
+    monkeypatch.setattr(actions, "_processed_keys", racing_processed_keys)
+
+    run(actions.write_db(
+        [user("a"), user("b"), user("c")], USER,
+        idempotency_keys=["k1", "k2", "k3"], max_retries=1
+    ))
+    assert usernames(run) == ["a", "c"]
+
+
+def test_expired_keys_are_purged(engine):
+    now = models.utcnow()
+    for i in range(5):
+        record_key(engine, f"old{i}", now - datetime.timedelta(days=10))
+    record_key(engine, "new", now - datetime.timedelta(days=1))
+
+    retention = AuditLogRetention(engine, [], retention_days=30, chunk_size=2, processed_ttl_days=7)
+    report = retention.run_once()
+
+    assert report == {"processed_messages": {"deleted": 5}}
+    with engine.connect() as conn:
+        keys = conn.execute(select(models.ProcessedMessage.idempotency_key)).scalars().all()
+    assert keys == ["new"]
+
+
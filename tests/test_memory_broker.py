@@ -0,0 +1,55 @@
+from app.kafka.memory import InMemoryBroker, InMemoryConsumer, InMemoryProducer
+
+
+def test_keyed_messages_share_a_partition(run):
+    broker = InMemoryBroker(partitions=3)
+    producer = InMemoryProducer(broker=broker)
+
+    async def main():
+        for i in range(10):
+            await producer.send("t", value=str(i).encode(), key=b"user-1")
+    run(main())
+
+    assert sorted(len(log) for log in broker.topics["t"]) == [0, 0, 10]
+
+
+def test_group_resumes_from_committed_offset(run):
+    broker = InMemoryBroker(partitions=1)
+    producer = InMemoryProducer(broker=broker)
+
+    async def consume(max_records: int, commit: bool):
+        consumer = InMemoryConsumer("t", broker=broker, group_id="g",
+                                    enable_auto_commit=False, auto_offset_reset="earliest")
+        await consumer.start()
+        batches = await consumer.getmany(timeout_ms=100, max_records=max_records)
+        if commit:
+            await consumer.commit()
+        await consumer.stop()
+        return [msg.value for msgs in batches.values() for msg in msgs]
+
+    async def main():
+        for i in range(5):
+            await producer.send("t", value=str(i).encode())
+        first = await consume(2, commit=True)
+        uncommitted = await consume(2, commit=False)
+        rest = await consume(10, commit=True)
+        return first, uncommitted, rest
+    first, uncommitted, rest = run(main())
+
+    assert first == [b"0", b"1"]
+    assert uncommitted == [b"2", b"3"]
+    assert rest == [b"2", b"3", b"4"]
+
+
+def test_partitions_are_spread_over_group_members(run):
+    broker = InMemoryBroker(partitions=4)
+
+    async def main():
+        members = [InMemoryConsumer("t", broker=broker, group_id="g") for _ in range(2)]
+        for member in members:
+            await member.start()
+        return [member.assignment() for member in members]
+    first, second = run(main())
+
+    assert len(first) == len(second) == 2
+    assert not first & second
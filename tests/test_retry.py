@@ -0,0 +1,161 @@
+import asyncio
+import pytest
+from kafka import TopicPartition
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+
+from app.kafka import actions, config, rpc
+from app.kafka.codec import codec
+from app.kafka.consumers import consumer_manager
+from app.kafka.memory import InMemoryRecord
+from app.kafka.producers import producer_manager
+from app.kafka.retry import retry_scheduler
+from app.config import settings
+
+
+TP = TopicPartition(config.KafkaTopic.UPDATE_DB, 0)
+
+
+def update_msg(offset: int, key: bytes = b"user-1"):
+    value = {"action": config.KafkaAction.UPDATE_DB, "data": {"offset": offset}}
+    return InMemoryRecord(
+        topic=TP.topic, partition=TP.partition, offset=offset, timestamp=0,
+        key=key, value=codec.encode(value), headers=[]
+    )
+
+
+def transient_error():
+    return OperationalError("UPDATE", {}, Exception("lost connection"))
+
+
+class SentMessages(list):
+    """Topics of the sent messages, with their values in payloads"""
+    def __init__(self):
+        super().__init__()
+        self.payloads = []
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """The messages the scheduler sends, by topic, with instant backoff"""
+    sent = SentMessages()
+    payloads = sent.payloads
+
+    async def send(topic, value, key=None, headers=None):
+        sent.append(topic)
+        payloads.append(value)
+    monkeypatch.setattr(producer_manager, "send", send)
+    monkeypatch.setattr(retry_scheduler, "backoff", lambda attempt: 0)
+    return sent
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Applied messages in order; fail_times[offset] makes the first attempts fail transiently"""
+    handled = []
+    fail_times = {}
+
+    async def dispatch(action, data, idempotency_key=None, reply=False):
+        if fail_times.get(data["offset"], 0) > 0:
+            fail_times[data["offset"]] -= 1
+            raise transient_error()
+        handled.append(data["offset"])
+    monkeypatch.setattr(consumer_manager, "dispatch", dispatch)
+    return handled, fail_times
+
+
+def consume(run, msgs):
+    queue = asyncio.Queue()
+    for msg in msgs:
+        queue.put_nowait(msg)
+    consumer_manager.processed_offsets[TP.topic] = {}
+
+    async def main():
+        worker = asyncio.create_task(consumer_manager.partition_worker(TP.topic, TP, queue))
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+    run(main())
+
+
+def test_keyed_update_is_retried_in_place_before_later_updates(run, sent, handled):
+    applied, fail_times = handled
+    fail_times[0] = 2
+
+    consume(run, [update_msg(0), update_msg(1)])
+
+    assert applied == [0, 1]
+    assert sent == []
+
+
+def test_keyed_update_out_of_attempts_is_dead_lettered(run, sent, handled):
+    applied, fail_times = handled
+    fail_times[0] = retry_scheduler.max_attempts + 1
+
+    consume(run, [update_msg(0), update_msg(1)])
+
+    assert applied == [1]
+    assert sent == [settings.kafka_dead_letter_topic]
+
+
+def test_unkeyed_update_goes_to_the_retry_topic(run, sent, handled):
+    applied, fail_times = handled
+    fail_times[0] = 1
+
+    consume(run, [update_msg(0, key=None), update_msg(1, key=None)])
+
+    assert applied == [1]
+    assert sent == [settings.kafka_retry_topic]
+
+
+@pytest.mark.parametrize("topic, ordered", [
+    (config.KafkaTopic.WRITE_DB, True),
+    (config.KafkaTopic.UPDATE_DB, True),
+    (config.KafkaTopic.DELETE_DB, True),
+    (config.KafkaTopic.READ_DB, False),
+    (config.KafkaTopic.SAVE_REQUEST_TO_DB, False),
+])
+def test_only_keyed_db_changes_keep_order(topic, ordered):
+    msg = InMemoryRecord(topic=topic, partition=0, offset=0, timestamp=0, key=b"k", value=b"", headers=[])
+    assert retry_scheduler.keeps_order(msg) == ordered
+    assert retry_scheduler.retries_in_place(msg, {}, transient_error()) == ordered
+    assert not retry_scheduler.retries_in_place(msg, {}, KeyError("poison"))
+
+
+@pytest.mark.parametrize("key, topic", [
+    (None, settings.kafka_retry_topic),
+    (b"user-1", settings.kafka_dead_letter_topic),
+])
+def test_failed_update_is_sent_whole(run, sent, monkeypatch, key, topic):
+    async def update_db(*args, **kwargs):
+        raise transient_error()
+    monkeypatch.setattr(actions, "update_db", update_db)
+    data = {"schemas": "users", "update_data": [["username", "x"]], "filters": [["user_id", "=", 1]]}
+    msg = InMemoryRecord(
+        topic=TP.topic, partition=TP.partition, offset=0, timestamp=0, key=key,
+        value=codec.encode({"action": config.KafkaAction.UPDATE_DB, "data": data}), headers=[]
+    )
+
+    consume(run, [msg])
+
+    assert sent == [topic]
+    assert sent.payloads[0]["data"] == data
+
+
+@pytest.mark.parametrize("error", [
+    HTTPException(status_code=404, detail="No data matching the filter conditions"),
+    HTTPException(status_code=400, detail="No conditions provided"),
+])
+def test_rejected_message_is_not_parked(run, sent, error):
+    run(retry_scheduler.schedule(update_msg(0, key=None), {"data": {}}, error))
+    assert sent == []
+
+
+@pytest.mark.parametrize("error", [transient_error(), KeyError("poison")])
+def test_rpc_message_is_never_retried_or_parked(run, sent, error):
+    msg = update_msg(0, key=None)
+    msg.headers = [(rpc.REPLY_TO_HEADER, b"replies"), (rpc.CORRELATION_ID_HEADER, b"1")]
+    run(retry_scheduler.schedule(msg, {"data": {}}, error))
+    assert sent == []
@@ -0,0 +1,72 @@
+import pytest
+
+from app import models
+from app.kafka import actions, config, statements
+
+
+USER = config.DatabaseSchemas.USER
+
+
+@pytest.fixture
+def users(sqlite_db, run):
+    sqlite_db(models.User, models.ProcessedMessage)
+    run(actions.write_db([
+        {"username": f"u{i}", "password": "p", "email": f"e{i}@example.com", "role": "tech" if i % 2 else "csuite"}
+        for i in range(1, 11)
+    ], USER))
+
+
+def user_ids(run, filters=None, **kwargs):
+    rows = run(actions.read_db(USER, "all", filters=filters, **kwargs))
+    return [row.user_id for row in rows]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ([["user_id", "=", 3]], [3]),
+    ([["user_id", ">", 8]], [9, 10]),
+    ([["user_id", "in", [2, 4, 99]]], [2, 4]),
+    ([["user_id", "not in", [1, 2, 3, 4, 5, 6, 7]]], [8, 9, 10]),
+    ([["user_id", "between", [4, 6]]], [4, 5, 6]),
+    ([["username", "like", "u1%"]], [1, 10]),
+    ([["user_id", "<=", 4], ["role", "=", "tech"]], [1, 3]),
+    ([{"or": [["user_id", "=", 1], ["user_id", "=", 10]]}], [1, 10]),
+    ([["role", "=", "tech"], {"or": [["user_id", "<", 3], ["user_id", ">", 8]]}], [1, 9]),
+    ([["created_at", "is not null"]], list(range(1, 11))),
+    ([["created_at", "IS NULL"]], []),
+])
+def test_filters(users, run, filters, expected):
+    assert user_ids(run, filters, order_by=["user_id"]) == expected
+
+
+def test_same_shape_reuses_the_statement():
+    first = statements.delete_statement(USER, [["user_id", "in", [1, 2]]])
+    second = statements.delete_statement(USER, [["user_id", "IN", [3, 4, 5]]])
+    other = statements.delete_statement(USER, [["user_id", "=", 1]])
+    assert first is second
+    assert first is not other
+
+
+def test_filter_values_are_coerced_to_column_types():
+    params = statements.filter_params(USER, [["user_id", "=", "3"], ["user_id", "between", ["1", "2"]]])
+    assert list(params.values()) == [3, 1, 2]
+
+
+@pytest.mark.parametrize("filters", [
+    [["user_id", "~", 1]],
+    [["user_id", "="]],
+    [{"xor": [["user_id", "=", 1]]}],
+])
+def test_invalid_filters_are_rejected(filters):
+    with pytest.raises(ValueError):
+        statements.filter_params(USER, filters)
+
+
+def test_keyset_pages_cover_every_row_once(users, run):
+    seen, after = [], None
+    while True:
+        page = run(actions.read_db(USER, "page", order_by=[("role", "desc")], limit=3, after=after))
+        seen += [row.user_id for row in page["rows"]]
+        after = page["next_cursor"]
+        if after is None:
+            break
+    assert sorted(seen) == list(range(1, 11))
@@ -0,0 +1,21 @@
+from app import worker
+from app.config import settings
+
+
+def test_each_worker_process_gets_its_own_metrics_port(monkeypatch):
+    monkeypatch.setattr(settings, "worker_metrics_port", 9100)
+    assert [worker.metrics_port(index) for index in range(3)] == [9100, 9101, 9102]
+
+
+def test_metrics_endpoint_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "worker_metrics_port", 0)
+    assert worker.metrics_port(1) == 0
+
+
+def test_worker_process_serves_metrics(monkeypatch):
+    served = []
+    monkeypatch.setattr(settings, "worker_metrics_port", 9200)
+    monkeypatch.setattr(worker, "start_http_server", served.append)
+    monkeypatch.setattr(worker, "serve", lambda topics: worker.asyncio.sleep(0))
+    worker.run_process(["write_db"], index=2)
+    assert served == [9202]